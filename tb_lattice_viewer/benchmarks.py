@@ -0,0 +1,641 @@
+"""Headless benchmarks of the lattice pipeline, run with:
+
+    python -m tb_lattice_viewer.benchmarks --output results.json --baseline baseline.json
+
+Results are written as json, times are compared with the baseline and the
+command exits with status 1 when any benchmark is slower than the tolerance.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy
+
+from tb_lattice_viewer.kernels import Kernel, buildSourceFromConfig, compileKernel
+from tb_lattice_viewer.lattice import (
+    LatticeSites,
+    Window,
+    evaluateMask,
+    generateLatticeSites,
+    latticeIndexRange,
+)
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+
+# loads the cached kernel in a fresh interpreter, where the extension is not
+# imported yet, and prints the time of compileKernel in the last line
+CACHED_KERNEL_SCRIPT = """
+import sys, time
+from pathlib import Path
+from tb_lattice_viewer.kernels import compileKernel
+source = sys.stdin.read()
+start = time.perf_counter()
+compileKernel(source, sys.argv[1], cacheDir=Path(sys.argv[2]), verbose=False)
+print(time.perf_counter() - start)
+"""
+SQRT3 = 3 ** 0.5
+
+# sites inside the circular hole in the middle of the window are removed
+MASK_CODE = """
+subroutine mask(is_in_lattice, x, y, z)
+real*8, intent(in)   :: x, y, z
+integer, intent(out)  :: is_in_lattice
+
+is_in_lattice = 1
+if ((x - hole_x) ** 2 + (y - hole_y) ** 2 < hole_radius ** 2) is_in_lattice = 0
+
+end subroutine
+"""
+
+
+class SyntheticLattice(NamedTuple):
+    v1: Tuple[float, float]
+    v2: Tuple[float, float]
+    basis: numpy.ndarray  # (M, 2)
+
+    @property
+    def cellArea(self) -> float:
+        return abs(self.v1[0] * self.v2[1] - self.v1[1] * self.v2[0])
+
+
+def supercell(lattice: SyntheticLattice, n: int, m: int) -> SyntheticLattice:
+    v1, v2 = numpy.array(lattice.v1), numpy.array(lattice.v2)
+    shifts = [i * v1 + j * v2 for i in range(n) for j in range(m)]
+    basis = numpy.vstack([lattice.basis + shift for shift in shifts])
+    return SyntheticLattice(tuple(n * v1), tuple(m * v2), basis)
+
+
+SQUARE = SyntheticLattice((1.0, 0.0), (0.0, 1.0), numpy.array([[0.0, 0.0]]))
+HONEYCOMB = SyntheticLattice(
+    (1.5, SQRT3 / 2), (1.5, -SQRT3 / 2), numpy.array([[0.0, 0.0], [1.0, 0.0]])
+)
+LATTICES = {
+    "square": SQUARE,
+    "honeycomb": HONEYCOMB,
+    "supercell": supercell(HONEYCOMB, 10, 10),
+}
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    lattice: str
+    targetSites: int
+    numSites: int
+    seconds: Optional[float]  # best of the repeats, None when skipped
+    backend: str = ""
+    note: str = ""
+    median: Optional[float] = None  # None for single runs and old results
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}/{self.lattice}/{self.targetSites}"
+
+
+class Timing(NamedTuple):
+    best: Optional[float]
+    median: Optional[float]
+
+
+def timeRepeats(fn: Callable[[], Any], repeat: int) -> Tuple[Timing, Any]:
+    """Best and median time of repeated calls and the value of the last call"""
+    times, value = [], None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - start)
+    return Timing(min(times), float(numpy.median(times))), value
+
+
+def timeCachedKernelLoad(
+    source: str, moduleName: str, cacheDir: Path, repeat: int
+) -> Timing:
+    """Best and median time of loading the cached kernel, each repeat runs in
+    a new process because this one has the extension imported already"""
+    env = dict(os.environ)
+    packageRoot = str(Path(__file__).resolve().parents[1])
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (packageRoot, env.get("PYTHONPATH")) if p
+    )
+    times = []
+    for _ in range(max(repeat, 1)):
+        result = subprocess.run(
+            [sys.executable, "-c", CACHED_KERNEL_SCRIPT, moduleName, str(cacheDir)],
+            input=source,
+            capture_output=True,
+            text=True,
+            env=env,
+            check=True,
+        )
+        times.append(float(result.stdout.split()[-1]))
+    return Timing(min(times), float(numpy.median(times)))
+
+
+def latticeWindow(lattice: SyntheticLattice, targetSites: int) -> Window:
+    """Square window which contains about targetSites sites"""
+    numCells = targetSites / len(lattice.basis)
+    size = (numCells * lattice.cellArea) ** 0.5
+    return (0.0, 0.0), (size, size)
+
+
+def holeParameters(window: Window) -> Dict[str, float]:
+    (xMin, yMin), (xMax, yMax) = window
+    return {
+        "hole_x": (xMin + xMax) / 2,
+        "hole_y": (yMin + yMax) / 2,
+        "hole_radius": (xMax - xMin) / 8,
+    }
+
+
+def latticeConfig(lattice: SyntheticLattice, window: Window) -> Dict[str, Any]:
+    """Config of the "lattice" presets category for the synthetic lattice"""
+    numBasis = len(lattice.basis)
+    return {
+        "parameters": [
+            {"name": name, "value": repr(float(value))}
+            for name, value in holeParameters(window).items()
+        ],
+        "lattice": {
+            "v1": list(lattice.v1),
+            "v2": list(lattice.v2),
+            "sites": {
+                "names": [f"s{k}" for k in range(numBasis)],
+                "positions": lattice.basis.tolist(),
+                "sizes": [0.3] * numBasis,
+                "colors": [[255, 128, 0]] * numBasis,
+            },
+        },
+        "code": MASK_CODE,
+        "dimensions": {"vMin": list(window[0]), "vMax": list(window[1])},
+        "tables": False,
+    }
+
+
+def pythonMasks(window: Window) -> Tuple[Callable, Callable]:
+    """Per call and batched python equivalents of MASK_CODE"""
+    hole = holeParameters(window)
+    x0, y0, r2 = hole["hole_x"], hole["hole_y"], hole["hole_radius"] ** 2
+
+    def maskFn(x, y, z=0):
+        return 0 if (x - x0) ** 2 + (y - y0) ** 2 < r2 else 1
+
+    def maskArrayFn(positions):
+        return (positions[:, 0] - x0) ** 2 + (positions[:, 1] - y0) ** 2 >= r2
+
+    return maskFn, maskArrayFn
+
+
+def maskWindow(lattice: SyntheticLattice) -> Window:
+    """Hole parameters are compiled into the kernel, so all sizes share the hole
+    of the smallest window"""
+    return latticeWindow(lattice, DEFAULT_SIZES[0])
+
+
+def keepAll(positions: numpy.ndarray) -> numpy.ndarray:
+    return numpy.ones(len(positions), dtype=bool)
+
+
+class BenchmarkSuite:
+    def __init__(
+        self,
+        sizes: Sequence[int],
+        lattices: Sequence[str],
+        repeat: int = 5,
+        perCallMaxSites: int = 10 ** 6,
+        sceneMaxSites: int = 10 ** 5,
+        skip: Sequence[str] = (),
+        cacheDir: Path = None,
+    ):
+        self.sizes = list(sizes)
+        self.lattices = list(lattices)
+        self.repeat = repeat
+        self.perCallMaxSites = perCallMaxSites
+        self.sceneMaxSites = sceneMaxSites
+        self.skip = set(skip)
+        self.cacheDir = cacheDir
+        self.results: List[BenchmarkResult] = []
+        self.app = None
+
+    def add(self, result: BenchmarkResult):
+        seconds = "skipped" if result.seconds is None else f"{result.seconds:.4f} s"
+        print(
+            f"{result.key:<40} {result.numSites:>10} sites  {seconds:>12}  "
+            f"{result.backend} {result.note}"
+        )
+        self.results.append(result)
+
+    def run(self) -> List[BenchmarkResult]:
+        for name in self.lattices:
+            lattice = LATTICES[name]
+            kernel = None
+            if "compile" not in self.skip:
+                kernel = self.benchCompile(name, lattice)
+            if "presets" not in self.skip:
+                self.benchPresets(name, lattice)
+            for targetSites in self.sizes:
+                self.benchSize(name, lattice, targetSites, kernel)
+        return self.results
+
+    def benchCompile(self, name: str, lattice: SyntheticLattice) -> Optional[Kernel]:
+        from tb_lattice_viewer import kernels
+
+        config = latticeConfig(lattice, maskWindow(lattice))
+        source = buildSourceFromConfig(config, f"bench_{name}")
+        digest = kernels.sourceHash(source)
+        with tempfile.TemporaryDirectory() as tempDir:
+            cacheDir = Path(tempDir) if self.cacheDir is None else self.cacheDir
+            for path in cacheDir.glob(f"{kernels.extensionName(digest)}*"):
+                path.unlink()
+            kernels.loadedKernels.pop(digest, None)
+
+            # cold compilation is expensive, it is timed only once
+            start = time.perf_counter()
+            try:
+                kernel = compileKernel(
+                    source, f"bench_{name}", cacheDir=cacheDir, verbose=False
+                )
+            except Exception as error:
+                note = f"cannot compile: {error}"
+                self.add(BenchmarkResult("compile-cold", name, 0, 0, None, note=note))
+                self.add(BenchmarkResult("compile-cached", name, 0, 0, None, note=note))
+                return None
+            self.add(
+                BenchmarkResult(
+                    "compile-cold", name, 0, 0, time.perf_counter() - start, "f2py"
+                )
+            )
+
+            timing = timeCachedKernelLoad(
+                source, f"bench_{name}", cacheDir, self.repeat
+            )
+            self.add(
+                BenchmarkResult(
+                    "compile-cached",
+                    name,
+                    0,
+                    0,
+                    timing.best,
+                    "f2py",
+                    median=timing.median,
+                )
+            )
+
+        kernel.setUnitCellPositions(lattice.basis)
+        return kernel
+
+    def benchPresets(self, name: str, lattice: SyntheticLattice, numPresets: int = 200):
+        from tb_lattice_viewer.presets import PresetsManager
+
+        config = latticeConfig(lattice, maskWindow(lattice))
+        presets = {"lattice": {f"{name}-{k}": config for k in range(numPresets)}}
+        with tempfile.TemporaryDirectory() as tempDir:
+            path = Path(tempDir) / "presets.json"
+            with open(path, "w") as file:
+                json.dump(presets, file, indent=2)
+
+            timing, _ = timeRepeats(lambda: PresetsManager.load(path), self.repeat)
+            self.add(
+                BenchmarkResult(
+                    "presets-load",
+                    name,
+                    numPresets,
+                    0,
+                    timing.best,
+                    median=timing.median,
+                )
+            )
+
+            def save():
+                PresetsManager.updatePreset("lattice", f"{name}-0", config)
+                PresetsManager.flush()
+
+            timing, _ = timeRepeats(save, self.repeat)
+            self.add(
+                BenchmarkResult(
+                    "presets-save",
+                    name,
+                    numPresets,
+                    0,
+                    timing.best,
+                    median=timing.median,
+                )
+            )
+
+    def benchSize(
+        self,
+        name: str,
+        lattice: SyntheticLattice,
+        targetSites: int,
+        kernel: Optional[Kernel],
+    ):
+        window = latticeWindow(lattice, targetSites)
+        indexRange = latticeIndexRange(lattice.v1, lattice.v2, window)
+
+        def generate(**maskFns) -> LatticeSites:
+            return generateLatticeSites(
+                lattice.v1, lattice.v2, lattice.basis, indexRange, window, **maskFns
+            )
+
+        timing, sites = timeRepeats(lambda: generate(maskArrayFn=keepAll), self.repeat)
+        numSites = sites.numSites
+        self.add(
+            BenchmarkResult(
+                "site-generation",
+                name,
+                targetSites,
+                numSites,
+                timing.best,
+                median=timing.median,
+            )
+        )
+
+        if kernel is not None:
+            backend, maskFn, maskArrayFn = "f2py", kernel.mask, kernel.maskArray
+        else:
+            maskFn, maskArrayFn = pythonMasks(maskWindow(lattice))
+            backend = "python"
+
+        positions = sites.positions
+        if "mask" not in self.skip:
+            if numSites <= self.perCallMaxSites:
+                timing, _ = timeRepeats(
+                    lambda: evaluateMask(maskFn, positions), self.repeat
+                )
+                note = ""
+            else:
+                timing, note = Timing(None, None), f"above {self.perCallMaxSites} sites"
+            self.add(
+                BenchmarkResult(
+                    "mask-per-call",
+                    name,
+                    targetSites,
+                    numSites,
+                    timing.best,
+                    backend,
+                    note,
+                    timing.median,
+                )
+            )
+            timing, _ = timeRepeats(lambda: maskArrayFn(positions), self.repeat)
+            self.add(
+                BenchmarkResult(
+                    "mask-batched",
+                    name,
+                    targetSites,
+                    numSites,
+                    timing.best,
+                    backend,
+                    median=timing.median,
+                )
+            )
+
+        if "scene" not in self.skip:
+            sites = generate(maskArrayFn=maskArrayFn)
+            self.benchScene(name, lattice, targetSites, sites)
+
+    def benchScene(
+        self,
+        name: str,
+        lattice: SyntheticLattice,
+        targetSites: int,
+        sites: LatticeSites,
+    ):
+        if sites.numSites > self.sceneMaxSites:
+            note = f"above {self.sceneMaxSites} sites"
+            self.add(
+                BenchmarkResult(
+                    "scene", name, targetSites, sites.numSites, None, note=note
+                )
+            )
+            return
+        try:
+            from PyQt5.Qt3DCore import QEntity
+            from PyQt5.QtGui import QColor, QGuiApplication
+            from tb_lattice_viewer.scene import createSpheresScene
+        except ImportError as error:
+            self.add(
+                BenchmarkResult(
+                    "scene", name, targetSites, sites.numSites, None, note=str(error)
+                )
+            )
+            return
+
+        if QGuiApplication.instance() is None:
+            os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+            self.app = QGuiApplication(sys.argv[:1])
+
+        numBasis = len(lattice.basis)
+        colors = [QColor(255, 128, 0)] * numBasis
+
+        def createScene():
+            rootEntity = QEntity()
+            createSpheresScene(
+                rootEntity, sites, [0.3] * numBasis, colors, progress=False
+            )
+            return rootEntity
+
+        timing, _ = timeRepeats(createScene, self.repeat)
+        self.add(
+            BenchmarkResult(
+                "scene",
+                name,
+                targetSites,
+                sites.numSites,
+                timing.best,
+                median=timing.median,
+            )
+        )
+
+
+def environmentInfo() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": str(os.cpu_count()),
+    }
+
+
+def saveResults(path: Path, results: Sequence[BenchmarkResult]):
+    report = {
+        "environment": environmentInfo(),
+        "results": [result._asdict() for result in results],
+    }
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to: {path}")
+
+
+def loadResults(path: Path) -> List[BenchmarkResult]:
+    with open(path, "r") as file:
+        report = json.load(file)
+    return [BenchmarkResult(**result) for result in report["results"]]
+
+
+def compareResults(
+    results: Sequence[BenchmarkResult],
+    baseline: Sequence[BenchmarkResult],
+    tolerance: float = 0.25,
+    minSeconds: float = 0.02,
+    noiseSeconds: float = 0.005,
+) -> List[Tuple[BenchmarkResult, BenchmarkResult]]:
+    """Returns (result, baseline) pairs slower than baseline * (1 + tolerance)
+    + noiseSeconds in both the best and the median time of the repeats, a
+    single slow repeat is not a regression. Benchmarks faster than minSeconds
+    are too noisy and are not compared."""
+
+    def slower(current: Optional[float], reference: Optional[float]) -> bool:
+        if current is None or reference is None:
+            # single runs and old results have no median
+            return True
+        return current > reference * (1 + tolerance) + noiseSeconds
+
+    baselineByKey = {result.key: result for result in baseline}
+    regressions = []
+    print(
+        f"{'benchmark':<40} {'baseline':>12} {'current':>12} {'ratio':>8} "
+        f"{'median':>8}"
+    )
+    for result in results:
+        reference = baselineByKey.get(result.key)
+        if reference is None or result.seconds is None or reference.seconds is None:
+            continue
+        ratio = result.seconds / max(reference.seconds, 1e-12)
+        medianRatio = ""
+        if result.median is not None and reference.median is not None:
+            medianRatio = f"{result.median / max(reference.median, 1e-12):.2f}x"
+        slowest = max(result.seconds, reference.seconds)
+        regressed = (
+            slowest > minSeconds
+            and slower(result.seconds, reference.seconds)
+            and slower(result.median, reference.median)
+        )
+        print(
+            f"{result.key:<40} {reference.seconds:>10.4f} s {result.seconds:>10.4f} s "
+            f"{ratio:>7.2f}x {medianRatio:>8}{'  REGRESSION' if regressed else ''}"
+        )
+        if regressed:
+            regressions.append((result, reference))
+    return regressions
+
+
+def parseSize(text: str) -> int:
+    return int(float(text))
+
+
+def parseSizes(text: str) -> List[int]:
+    return [parseSize(size) for size in text.split(",")]
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = ArgumentParser(description="Run lattice pipeline benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=parseSizes,
+        default=DEFAULT_SIZES,
+        help="Comma separated numbers of sites e.g. 1e3,1e4,1e5",
+    )
+    parser.add_argument(
+        "--lattices",
+        default=",".join(LATTICES),
+        help=f"Comma separated lattices, available: {', '.join(LATTICES)}",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--skip",
+        default="",
+        help="Comma separated benchmarks to skip: compile, presets, mask, scene",
+    )
+    parser.add_argument(
+        "--per-call-max-sites",
+        type=parseSize,
+        default=10 ** 6,
+        help="Larger lattices are skipped by the per call mask benchmark",
+    )
+    parser.add_argument(
+        "--scene-max-sites",
+        type=parseSize,
+        default=10 ** 5,
+        help="Larger lattices are skipped by the scene benchmark",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Kernels cache directory, temporary directory by default",
+    )
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", default=None, help="Baseline results json")
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Save results as the new baseline instead of comparing",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.02,
+        help="Faster benchmarks are too noisy and are not compared",
+    )
+    parser.add_argument(
+        "--noise-seconds",
+        type=float,
+        default=0.005,
+        help="Absolute slowdown allowed on top of the tolerance",
+    )
+    args = parser.parse_args(argv)
+
+    lattices = [name for name in args.lattices.split(",") if name]
+    unknown = set(lattices) - set(LATTICES)
+    if unknown:
+        print(f"Unknown lattices: {sorted(unknown)}, available: {list(LATTICES)}")
+        return 2
+
+    suite = BenchmarkSuite(
+        sizes=args.sizes,
+        lattices=lattices,
+        repeat=args.repeat,
+        perCallMaxSites=args.per_call_max_sites,
+        sceneMaxSites=args.scene_max_sites,
+        skip=[name for name in args.skip.split(",") if name],
+        cacheDir=None if args.cache_dir is None else Path(args.cache_dir),
+    )
+    try:
+        results = suite.run()
+    except MemoryError:
+        traceback.print_exc()
+        print("Out of memory, run with smaller --sizes")
+        return 2
+
+    saveResults(Path(args.output), results)
+    if args.baseline is None:
+        return 0
+
+    baselinePath = Path(args.baseline)
+    if args.update_baseline or not baselinePath.exists():
+        saveResults(baselinePath, results)
+        return 0
+
+    regressions = compareResults(
+        results,
+        loadResults(baselinePath),
+        args.tolerance,
+        args.min_seconds,
+        args.noise_seconds,
+    )
+    if regressions:
+        print(f"{len(regressions)} benchmarks are slower than the baseline")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+from typing import Dict, Tuple
+
+import numpy
+
+# anchor colors sampled evenly from the colormaps, interpolated linearly
+COLORMAPS: Dict[str, numpy.ndarray] = {
+    "viridis": numpy.array(
+        [
+            [0.267, 0.005, 0.329],
+            [0.283, 0.141, 0.458],
+            [0.254, 0.265, 0.530],
+            [0.207, 0.372, 0.553],
+            [0.164, 0.471, 0.558],
+            [0.128, 0.567, 0.551],
+            [0.135, 0.659, 0.518],
+            [0.267, 0.749, 0.441],
+            [0.478, 0.821, 0.318],
+            [0.741, 0.873, 0.150],
+            [0.993, 0.906, 0.144],
+        ]
+    ),
+    "magma": numpy.array(
+        [
+            [0.001, 0.000, 0.014],
+            [0.080, 0.058, 0.260],
+            [0.232, 0.060, 0.438],
+            [0.390, 0.100, 0.502],
+            [0.550, 0.161, 0.506],
+            [0.716, 0.215, 0.475],
+            [0.868, 0.288, 0.409],
+            [0.967, 0.439, 0.360],
+            [0.994, 0.624, 0.427],
+            [0.995, 0.812, 0.572],
+            [0.987, 0.991, 0.750],
+        ]
+    ),
+    "coolwarm": numpy.array(
+        [
+            [0.230, 0.299, 0.754],
+            [0.554, 0.690, 0.996],
+            [0.865, 0.865, 0.865],
+            [0.958, 0.604, 0.482],
+            [0.706, 0.016, 0.150],
+        ]
+    ),
+    "gray": numpy.array([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]]),
+}
+# color of NaN values
+MISSING_COLOR = (0.5, 0.5, 0.5)
+
+
+def valueRange(values: numpy.ndarray) -> Tuple[float, float]:
+    finite = values[numpy.isfinite(values)]
+    if len(finite) == 0:
+        return 0.0, 1.0
+    return float(finite.min()), float(finite.max())
+
+
+def mapScalars(
+    values: numpy.ndarray, colormap: str, vMin: float, vMax: float
+) -> numpy.ndarray:
+    """(N, 3) float32 rgb colors of the values, clipped to [vMin, vMax]"""
+    if colormap not in COLORMAPS:
+        raise ValueError(f"Unknown colormap: '{colormap}', expected {list(COLORMAPS)}")
+    anchors = COLORMAPS[colormap]
+    values = numpy.asarray(values, dtype=numpy.float64)
+    scale = 1 / (vMax - vMin) if vMax != vMin else 0.0
+    t = numpy.clip((values - vMin) * scale, 0, 1) * (len(anchors) - 1)
+    t = numpy.nan_to_num(t)
+    lower = numpy.minimum(t.astype(int), len(anchors) - 2)
+    weight = (t - lower)[:, None]
+    colors = anchors[lower] * (1 - weight) + anchors[lower + 1] * weight
+    colors[~numpy.isfinite(values)] = MISSING_COLOR
+    return colors.astype(numpy.float32)
+
+
+def loadField(path: str, numSites: int) -> numpy.ndarray:
+    """Per site values in the order of the generated (exported) sites,
+    complex amplitudes are shown as their modulus"""
+    values = numpy.load(path)
+    if numpy.iscomplexobj(values):
+        values = numpy.abs(values)
+    values = numpy.asarray(values, dtype=numpy.float64).ravel()
+    if len(values) != numSites:
+        raise ValueError(
+            f"Field has {len(values)} values, but the lattice has {numSites} sites"
+        )
+    return values
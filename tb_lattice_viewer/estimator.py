@@ -0,0 +1,172 @@
+from typing import NamedTuple, Optional, Sequence
+
+import numpy
+
+from tb_lattice_viewer.lattice import (
+    IndexRange,
+    MaskArrayFn,
+    Window,
+    asBasis,
+    latticeVectors,
+)
+from tb_lattice_viewer.scene import RENDER_MODES, SCENE_STATS
+
+# index grids, cell indices, origins and the window test of every scanned cell
+SCAN_BYTES_PER_CELL = 2 * 8 + 2 * 8 + 2 * 8 + 1
+# positions (float64 x 3), site type (int32), cell (int64 x 2) and the mask of
+# every candidate site are allocated during the generation
+GENERATION_BYTES_PER_SITE = 3 * 8 + 4 + 2 * 8 + 1
+# python wrapper and Qt3D backend nodes of an entity with its components
+ENTITY_BYTES = 4096
+
+
+class EstimatorThresholds(NamedTuple):
+    """Retained sites above which cheaper render modes are used in auto mode"""
+
+    instancedSites: int = 20000
+    pointsSites: int = 1000000
+    tilesSites: int = 5000000
+    warnMemoryMB: int = 2048
+    tileBudgetMB: int = 512
+
+
+class SceneEstimate(NamedTuple):
+    scannedCells: int  # cells of the index range
+    candidateCells: int  # cells with the origin inside the window
+    candidateSites: int
+    retainedSites: int  # sites passing the mask
+    maskSampled: bool  # False when retainedSites ignores the mask
+    renderMode: str
+    entities: int
+    memoryBytes: int
+
+    @property
+    def memoryMB(self) -> float:
+        return self.memoryBytes / 2 ** 20
+
+    def describe(self) -> str:
+        retained = f"{self.retainedSites:,}"
+        if not self.maskSampled:
+            retained += " (mask not sampled)"
+        return (
+            f"cells: {self.candidateCells:,} of {self.scannedCells:,} scanned\n"
+            f"candidate sites: {self.candidateSites:,}\n"
+            f"retained sites: ~{retained}\n"
+            f"render mode: {self.renderMode}, entities: {self.entities:,}\n"
+            f"memory: ~{self.memoryMB:,.1f} MB"
+        )
+
+
+def chooseRenderMode(retainedSites: int, thresholds: EstimatorThresholds) -> str:
+    if retainedSites > thresholds.tilesSites:
+        return "tiles"
+    if retainedSites > thresholds.pointsSites:
+        return "points"
+    if retainedSites > thresholds.instancedSites:
+        return "instanced"
+    return "spheres"
+
+
+def estimateMemoryBytes(
+    renderMode: str,
+    scannedCells: int,
+    candidateSites: int,
+    retainedSites: int,
+    numTypes: int,
+    tileBudgetMB: int = None,
+) -> int:
+    stats = SCENE_STATS[renderMode](retainedSites, numTypes)
+    memoryBytes = stats.bufferBytes + stats.entities * ENTITY_BYTES
+    if renderMode == "tiles":
+        # tiles are generated lazily, only the loaded ones take memory
+        memoryBytes += candidateSites * GENERATION_BYTES_PER_SITE
+        if tileBudgetMB is not None:
+            memoryBytes = min(memoryBytes, tileBudgetMB * 2 ** 20)
+        return memoryBytes
+    return (
+        memoryBytes
+        + scannedCells * SCAN_BYTES_PER_CELL
+        + candidateSites * GENERATION_BYTES_PER_SITE
+    )
+
+
+def estimateScene(
+    v1: Sequence[float],
+    v2: Sequence[float],
+    basis: Sequence[Sequence[float]],
+    indexRange: IndexRange,
+    window: Window,
+    maskArrayFn: Optional[MaskArrayFn] = None,
+    renderMode: str = "auto",
+    thresholds: EstimatorThresholds = EstimatorThresholds(),
+    sampleSize: int = 4096,
+    seed: int = 0,
+) -> SceneEstimate:
+    """Predicts the size of the scene from random sites of the index range,
+    without generating the lattice"""
+    basis = asBasis(basis)
+    vectors = latticeVectors(v1, v2)
+    numBasis = len(basis)
+    iMin, jMin, iMax, jMax = indexRange
+    scannedCells = max(iMax - iMin + 1, 0) * max(jMax - jMin + 1, 0)
+    scannedSites = scannedCells * numBasis
+
+    if scannedSites <= sampleSize:
+        # small lattices are enumerated exactly
+        ii, jj, kk = numpy.meshgrid(
+            numpy.arange(iMin, iMax + 1),
+            numpy.arange(jMin, jMax + 1),
+            numpy.arange(numBasis),
+            indexing="ij",
+        )
+        ii, jj, kk = ii.ravel(), jj.ravel(), kk.ravel()
+        scale = 1
+    else:
+        random = numpy.random.default_rng(seed)
+        ii = random.integers(iMin, iMax + 1, sampleSize)
+        jj = random.integers(jMin, jMax + 1, sampleSize)
+        kk = random.integers(0, numBasis, sampleSize)
+        scale = scannedSites / sampleSize
+
+    origins = numpy.stack([ii, jj], axis=1) @ vectors
+    (xMin, yMin), (xMax, yMax) = window
+    inside = (
+        (origins[:, 0] >= xMin)
+        & (origins[:, 0] <= xMax)
+        & (origins[:, 1] >= yMin)
+        & (origins[:, 1] <= yMax)
+    )
+    candidateSites = int(round(inside.sum() * scale))
+    candidateCells = int(round(candidateSites / numBasis))
+
+    retained = inside
+    if maskArrayFn is not None and inside.any():
+        positions = origins[inside] + basis[kk[inside]]
+        retained = numpy.zeros_like(inside)
+        retained[inside] = numpy.asarray(maskArrayFn(positions), dtype=bool)
+    retainedSites = int(round(retained.sum() * scale))
+
+    if renderMode == "auto":
+        renderMode = chooseRenderMode(retainedSites, thresholds)
+    if renderMode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode: '{renderMode}', expected {RENDER_MODES}")
+
+    numTypes = numBasis
+    stats = SCENE_STATS[renderMode](retainedSites, numTypes)
+    return SceneEstimate(
+        scannedCells=scannedCells,
+        candidateCells=candidateCells,
+        candidateSites=candidateSites,
+        retainedSites=retainedSites,
+        maskSampled=maskArrayFn is not None,
+        renderMode=renderMode,
+        entities=stats.entities,
+        memoryBytes=estimateMemoryBytes(
+            renderMode,
+            scannedCells,
+            candidateSites,
+            retainedSites,
+            numTypes,
+            thresholds.tileBudgetMB,
+        ),
+    )
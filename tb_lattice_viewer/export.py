@@ -0,0 +1,302 @@
+"""Scene export written in chunks straight from the site arrays:
+
+- binary glTF (.glb) with one instanced sphere mesh per site type
+  (EXT_mesh_gpu_instancing) and the bonds as a line primitive,
+- binary PLY point cloud with per site colors and the bonds as edges.
+"""
+import json
+import struct
+from pathlib import Path
+from typing import BinaryIO, Callable, List, NamedTuple, Optional, Sequence
+
+import numpy
+
+from tb_lattice_viewer.lattice import LatticeSites, Neighbours
+from tb_lattice_viewer.scene import SPHERE_RINGS, SPHERE_SLICES
+
+# sites or bonds converted and written at once
+EXPORT_CHUNK = 2 ** 20
+EXPORT_FILTERS = "glTF binary (*.glb);;PLY point cloud (*.ply)"
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON = 0x4E4F534A
+GLB_BIN = 0x004E4942
+# glTF accessor component types and buffer view targets
+FLOAT, UNSIGNED_SHORT = 5126, 5123
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+LINES = 1
+BOND_COLOR = (0.6, 0.6, 0.6)
+
+
+def uniqueBonds(neighbours: Neighbours) -> numpy.ndarray:
+    """(B, 2) site indices of the bonds, each bond once"""
+    forward = neighbours.rows < neighbours.cols
+    return numpy.stack([neighbours.rows[forward], neighbours.cols[forward]], axis=1)
+
+
+def sphereMesh(radius: float, rings: int = SPHERE_RINGS, slices: int = SPHERE_SLICES):
+    """Positions, normals and triangle indices of a UV sphere"""
+    theta = numpy.linspace(0, numpy.pi, rings + 1)
+    phi = numpy.linspace(0, 2 * numpy.pi, slices + 1)
+    theta, phi = numpy.meshgrid(theta, phi, indexing="ij")
+    normals = numpy.stack(
+        [
+            numpy.sin(theta) * numpy.cos(phi),
+            numpy.sin(theta) * numpy.sin(phi),
+            numpy.cos(theta),
+        ],
+        axis=-1,
+    ).reshape(-1, 3)
+    r, s = numpy.meshgrid(numpy.arange(rings), numpy.arange(slices), indexing="ij")
+    a = (r * (slices + 1) + s).ravel()
+    b, c, d = a + slices + 1, a + 1, a + slices + 2
+    indices = numpy.stack([a, b, c, c, b, d], axis=1).reshape(-1, 3)
+    # triangles at the poles are degenerate
+    valid = (indices[:, 0] != indices[:, 1]) & (indices[:, 1] != indices[:, 2])
+    indices = indices[valid]
+    return (
+        (normals * radius).astype(numpy.float32),
+        normals.astype(numpy.float32),
+        indices.astype(numpy.uint16).ravel(),
+    )
+
+
+def linearColor(rgb: Sequence[float]) -> List[float]:
+    """glTF material colors are linear, the unit cell colors are sRGB"""
+    return [float(c) ** 2.2 for c in rgb] + [1.0]
+
+
+class GlbBlock(NamedTuple):
+    """Part of the binary chunk written by `write` after the header"""
+
+    byteLength: int
+    write: Callable[[BinaryIO], None]
+
+
+def padding(length: int) -> int:
+    return -length % 4
+
+
+def writeArray(file: BinaryIO, values: numpy.ndarray, dtype: type):
+    numpy.ascontiguousarray(values, dtype=dtype).tofile(file)
+
+
+def exportGltf(
+    path: Path,
+    sites: LatticeSites,
+    sizes: Sequence[float],
+    colors: Sequence[Sequence[float]],
+    bonds: Optional[numpy.ndarray] = None,
+    chunk: int = EXPORT_CHUNK,
+):
+    """Writes one sphere mesh per site type instanced at the site positions in
+    the lattice units and optional (B, 2) bonds as lines. Sizes of all parts
+    are known upfront, so the file is written in a single pass."""
+    gltf = {
+        "asset": {"version": "2.0", "generator": "tb-lattice-viewer"},
+        "extensionsUsed": ["EXT_mesh_gpu_instancing"],
+        "scene": 0,
+        "scenes": [{"nodes": []}],
+        "nodes": [],
+        "meshes": [],
+        "materials": [],
+        "accessors": [],
+        "bufferViews": [],
+        "buffers": [],
+    }
+    blocks: List[GlbBlock] = []
+    offset = 0
+
+    def addView(byteLength: int, write, target: Optional[int] = None) -> int:
+        nonlocal offset
+        view = {"buffer": 0, "byteOffset": offset, "byteLength": byteLength}
+        if target is not None:
+            view["target"] = target
+        gltf["bufferViews"].append(view)
+        blocks.append(GlbBlock(byteLength, write))
+        offset += byteLength + padding(byteLength)
+        return len(gltf["bufferViews"]) - 1
+
+    def addAccessor(view: int, componentType: int, count: int, kind: str, **bounds):
+        gltf["accessors"].append(
+            {
+                "bufferView": view,
+                "componentType": componentType,
+                "count": count,
+                "type": kind,
+                **bounds,
+            }
+        )
+        return len(gltf["accessors"]) - 1
+
+    def addNode(name: str, primitive: dict, rgb: Sequence[float], extensions=None):
+        gltf["materials"].append(
+            {
+                "name": name,
+                "pbrMetallicRoughness": {
+                    "baseColorFactor": linearColor(rgb),
+                    "metallicFactor": 0.0,
+                },
+            }
+        )
+        primitive["material"] = len(gltf["materials"]) - 1
+        gltf["meshes"].append({"name": name, "primitives": [primitive]})
+        node = {"name": name, "mesh": len(gltf["meshes"]) - 1}
+        if extensions:
+            node["extensions"] = extensions
+        gltf["nodes"].append(node)
+        gltf["scenes"][0]["nodes"].append(len(gltf["nodes"]) - 1)
+
+    counts = numpy.bincount(sites.siteTypes, minlength=len(sizes))
+    for siteType, (size, rgb) in enumerate(zip(sizes, colors)):
+        if counts[siteType] == 0:
+            continue
+        positions, normals, indices = sphereMesh(size)
+        views = [
+            addView(a.nbytes, lambda file, a=a: a.tofile(file), target)
+            for a, target in [
+                (positions, ARRAY_BUFFER),
+                (normals, ARRAY_BUFFER),
+                (indices, ELEMENT_ARRAY_BUFFER),
+            ]
+        ]
+
+        def writeTranslations(file: BinaryIO, siteType=siteType):
+            for start in range(0, sites.numSites, chunk):
+                stop = start + chunk
+                selected = sites.siteTypes[start:stop] == siteType
+                writeArray(file, sites.positions[start:stop][selected], numpy.float32)
+
+        translations = addView(int(counts[siteType]) * 12, writeTranslations)
+        primitive = {
+            "attributes": {
+                "POSITION": addAccessor(
+                    views[0],
+                    FLOAT,
+                    len(positions),
+                    "VEC3",
+                    min=positions.min(0).tolist(),
+                    max=positions.max(0).tolist(),
+                ),
+                "NORMAL": addAccessor(views[1], FLOAT, len(normals), "VEC3"),
+            },
+            "indices": addAccessor(views[2], UNSIGNED_SHORT, len(indices), "SCALAR"),
+        }
+        instancing = {
+            "EXT_mesh_gpu_instancing": {
+                "attributes": {
+                    "TRANSLATION": addAccessor(
+                        translations, FLOAT, int(counts[siteType]), "VEC3"
+                    )
+                }
+            }
+        }
+        addNode(f"site {siteType + 1}", primitive, rgb, instancing)
+
+    if bonds is not None and len(bonds) > 0:
+
+        def writeBonds(file: BinaryIO):
+            for start in range(0, len(bonds), chunk):
+                ends = bonds[start : start + chunk].ravel()
+                writeArray(file, sites.positions[ends], numpy.float32)
+
+        # POSITION accessors need the bounds of the bonded sites
+        bonded = numpy.zeros(sites.numSites, dtype=bool)
+        bonded[bonds.ravel()] = True
+        lower, upper = numpy.full(3, numpy.inf), numpy.full(3, -numpy.inf)
+        for start in range(0, sites.numSites, chunk):
+            positions = sites.positions[start : start + chunk]
+            positions = positions[bonded[start : start + chunk]].astype(numpy.float32)
+            if len(positions) > 0:
+                lower = numpy.minimum(lower, positions.min(0))
+                upper = numpy.maximum(upper, positions.max(0))
+        view = addView(len(bonds) * 2 * 12, writeBonds, ARRAY_BUFFER)
+        accessor = addAccessor(
+            view,
+            FLOAT,
+            len(bonds) * 2,
+            "VEC3",
+            min=lower.tolist(),
+            max=upper.tolist(),
+        )
+        primitive = {"attributes": {"POSITION": accessor}, "mode": LINES}
+        addNode("bonds", primitive, BOND_COLOR)
+
+    gltf["buffers"].append({"byteLength": offset})
+    header = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    header += b" " * padding(len(header))
+    totalLength = 12 + 8 + len(header) + 8 + offset
+
+    print(f"Saving glTF scene of {sites.numSites} sites: {path}")
+    with open(path, "wb") as file:
+        file.write(struct.pack("<III", GLB_MAGIC, 2, totalLength))
+        file.write(struct.pack("<II", len(header), GLB_JSON))
+        file.write(header)
+        file.write(struct.pack("<II", offset, GLB_BIN))
+        for block in blocks:
+            block.write(file)
+            file.write(b"\0" * padding(block.byteLength))
+
+
+def exportPly(
+    path: Path,
+    sites: LatticeSites,
+    colors: Sequence[Sequence[float]],
+    bonds: Optional[numpy.ndarray] = None,
+    siteColors: Optional[Callable[[int, int], numpy.ndarray]] = None,
+    chunk: int = EXPORT_CHUNK,
+):
+    """Binary PLY with x, y, z, rgb and the site type of every site, and the
+    bonds as edges. siteColors(start, stop) returns (n, 3) rgb in [0, 1] of a
+    range of sites, by default the colors of the site types are used."""
+    vertex = numpy.dtype(
+        [
+            ("x", "<f4"),
+            ("y", "<f4"),
+            ("z", "<f4"),
+            ("red", "u1"),
+            ("green", "u1"),
+            ("blue", "u1"),
+            ("site_type", "<i4"),
+        ]
+    )
+    typeColors = numpy.asarray(colors, dtype=numpy.float64).reshape(-1, 3)
+    numBonds = 0 if bonds is None else len(bonds)
+    header = [
+        "ply",
+        "format binary_little_endian 1.0",
+        "comment tb-lattice-viewer",
+        f"element vertex {sites.numSites}",
+        "property float x",
+        "property float y",
+        "property float z",
+        "property uchar red",
+        "property uchar green",
+        "property uchar blue",
+        "property int site_type",
+    ]
+    if numBonds > 0:
+        header += [
+            f"element edge {numBonds}",
+            "property int vertex1",
+            "property int vertex2",
+        ]
+    header.append("end_header")
+
+    print(f"Saving PLY point cloud of {sites.numSites} sites: {path}")
+    with open(path, "wb") as file:
+        file.write(("\n".join(header) + "\n").encode("ascii"))
+        for start in range(0, sites.numSites, chunk):
+            stop = min(start + chunk, sites.numSites)
+            types = sites.siteTypes[start:stop]
+            rgb = typeColors[types] if siteColors is None else siteColors(start, stop)
+            data = numpy.empty(stop - start, dtype=vertex)
+            positions = sites.positions[start:stop]
+            data["x"], data["y"], data["z"] = positions.T
+            rgb = numpy.clip(numpy.round(rgb * 255), 0, 255).astype(numpy.uint8)
+            data["red"], data["green"], data["blue"] = rgb.T
+            data["site_type"] = types
+            data.tofile(file)
+        for start in range(0, numBonds, chunk):
+            writeArray(file, bonds[start : start + chunk], "<i4")
+
@@ -0,0 +1,116 @@
+import re
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Sequence
+
+import numpy
+
+from tb_lattice_viewer.lattice import LatticeSites, Neighbours
+
+# Constants named t1, t2, ... define the hopping of the n-th neighbour shell,
+# e0 defines the onsite energy of all sites and e0_<site name> of a single site
+HOPPING_PATTERN = re.compile(r"^t(\d+)$", re.IGNORECASE)
+ONSITE_PATTERN = re.compile(r"^e0(?:_(\w+))?$", re.IGNORECASE)
+
+
+class CSRMatrix(NamedTuple):
+    indptr: numpy.ndarray
+    indices: numpy.ndarray
+    data: numpy.ndarray
+    shape: tuple
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+
+def hoppingsFromConstants(constants: Dict[str, Any]) -> Dict[int, complex]:
+    """Returns shell index (starting from 0) -> hopping value"""
+    hoppings = {}
+    for name, value in constants.items():
+        match = HOPPING_PATTERN.match(name)
+        if match is not None and int(match.group(1)) > 0:
+            hoppings[int(match.group(1)) - 1] = value
+    return hoppings
+
+
+def onsiteFromConstants(
+    constants: Dict[str, Any], siteNames: Sequence[str]
+) -> numpy.ndarray:
+    """Returns onsite energy for each unit cell site"""
+    onsite = numpy.zeros(len(siteNames), dtype=numpy.complex128)
+    perSite = {}
+    for name, value in constants.items():
+        match = ONSITE_PATTERN.match(name)
+        if match is None:
+            continue
+        if match.group(1) is None:
+            onsite[:] = value
+        else:
+            perSite[match.group(1).lower()] = value
+
+    for k, siteName in enumerate(siteNames):
+        if siteName.lower() in perSite:
+            onsite[k] = perSite[siteName.lower()]
+    return onsite
+
+
+def indexDtype(size: int):
+    return numpy.int32 if size < numpy.iinfo(numpy.int32).max else numpy.int64
+
+
+def assembleHamiltonian(
+    sites: LatticeSites,
+    neighbours: Neighbours,
+    hoppings: Dict[int, complex],
+    onsite: Optional[numpy.ndarray] = None,
+) -> CSRMatrix:
+    """Assembles the tight binding Hamiltonian in the CSR format. The hopping
+    t of a shell is put above the diagonal and its conjugate below it."""
+    numSites = sites.numSites
+    numShells = int(neighbours.shells.max()) + 1 if neighbours.numBonds else 0
+    shellValues = numpy.zeros(numShells, dtype=numpy.complex128)
+    for shell, value in hoppings.items():
+        if shell < numShells:
+            shellValues[shell] = value
+
+    rows, cols = neighbours.rows, neighbours.cols
+    data = shellValues[neighbours.shells]
+    data = numpy.where(rows < cols, data, data.conj())
+
+    if onsite is not None:
+        diagonal = numpy.asarray(onsite, dtype=numpy.complex128)[sites.siteTypes]
+        nonZero = numpy.flatnonzero(diagonal)
+        rows = numpy.concatenate([rows, nonZero])
+        cols = numpy.concatenate([cols, nonZero])
+        data = numpy.concatenate([data, diagonal[nonZero]])
+
+    keep = data != 0
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+    if not numpy.iscomplexobj(data) or numpy.all(data.imag == 0):
+        data = data.real
+
+    order = numpy.lexsort((cols, rows))
+    dtype = indexDtype(max(numSites, len(data)))
+    indptr = numpy.zeros(numSites + 1, dtype=dtype)
+    numpy.cumsum(numpy.bincount(rows, minlength=numSites), out=indptr[1:])
+
+    return CSRMatrix(
+        indptr=indptr,
+        indices=cols[order].astype(dtype),
+        data=data[order],
+        shape=(numSites, numSites),
+    )
+
+
+def saveHamiltonian(path: Path, matrix: CSRMatrix, sites: LatticeSites):
+    print(f"Saving Hamiltonian {matrix.shape} with {matrix.nnz} entries: {path}")
+    numpy.savez(
+        path,
+        indptr=matrix.indptr,
+        indices=matrix.indices,
+        data=matrix.data,
+        shape=numpy.array(matrix.shape),
+        positions=sites.positions,
+        site_types=sites.siteTypes,
+        cells=sites.cells,
+    )
@@ -0,0 +1,257 @@
+import glob
+import hashlib
+import importlib.util
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence
+
+import numpy
+
+from tb_lattice_viewer.profiling import profiler
+from tb_lattice_viewer.templates import (
+    FORTRAN_CODE_MASK_ARRAY_TEMPLATE,
+    FORTRAN_CODE_MASK_FN_TEMPLATE,
+    FORTRAN_CODE_MODULE_TEMPLATE,
+    FORTRAN_CODE_TABLES_DECLARATIONS_TEMPLATE,
+    FORTRAN_CODE_TABLES_LOADER_TEMPLATE,
+    FORTRAN_CODE_UNIT_CELL_SETTER_TEMPLATE,
+)
+from tb_lattice_viewer.unit_cell import sitesFromConfig
+
+# compiled extensions are kept here and reused when the source did not change
+KERNELS_DIR = Path("~/.tb-lattice-viewer/kernels").expanduser()
+
+
+class ScalarProperty:
+    def __init__(self, name: str = "", value: str = ""):
+        self.name = name.strip()
+        self.value = value.strip()
+
+    def isEmpty(self):
+        if self.name == "" and self.value == "":
+            return True
+        return False
+
+    def isValid(self):
+        if self.name != "" and self.value != "":
+            return True
+        return False
+
+    def evaluate(self) -> Any:
+        return eval(self.value)
+
+    def toFortranDefinition(self, runtime: bool = False) -> Optional[str]:
+        """PARAMETER definition, or a module variable which can be changed
+        after the compilation when runtime is True"""
+
+        value = self.evaluate()
+        name = self.name
+
+        type2fType = {
+            int: "integer",
+            float: "double precision",
+            bool: "logical",
+            complex: "complex*16",
+        }
+        fType = type2fType[type(value)].upper()
+        if isinstance(value, complex):
+            value = f"CMPLX({value.real, value.imag})"
+
+        if runtime:
+            return f"{fType} :: {name} = {value}"
+        return f"{fType}, PARAMETER :: {name} = {value}"
+
+    def getConfig(self):
+        return {"name": self.name, "value": self.value}
+
+
+def latticeFortranDefinition(
+    v1: Sequence[float], v2: Sequence[float], numSites: int
+) -> str:
+    prefix = "double precision, dimension(2), parameter :: "
+    latticeStr = f"{prefix} unit_cell_v1 = (/{v1[0]}, {v1[1]}/)\n" \
+                 f"{prefix} unit_cell_v2 = (/{v2[0]}, {v2[1]}/)\n"
+
+    # positions are passed at runtime with set_unit_cell_positions, large
+    # unit cells do not fit into the source code literal
+    vectorsStr = f"integer, parameter :: unit_cell_num_sites = {numSites}\n" \
+                 f"double precision, dimension(:, :), allocatable :: unit_cell_positions"
+
+    return f"\n{latticeStr}\n{vectorsStr}\n".upper()
+
+
+def buildModuleSource(
+    moduleName: str,
+    properties: Sequence[ScalarProperty],
+    v1: Sequence[float],
+    v2: Sequence[float],
+    numSites: int,
+    code: str,
+    tables: bool = False,
+    runtimeConstants: Sequence[str] = (),
+) -> str:
+    runtimeNames = {name.lower() for name in runtimeConstants}
+    undefined = set(runtimeNames)
+    params = []
+    for k, prop in enumerate(properties):
+        if prop.isEmpty():
+            continue
+        if not prop.isValid():
+            raise ValueError(f"Missing name or value for property {k+1}")
+        params.append(prop.toFortranDefinition(prop.name.lower() in runtimeNames))
+        undefined.discard(prop.name.lower())
+    if undefined:
+        raise ValueError(f"Undefined constants: {', '.join(sorted(undefined))}")
+
+    params = "\n".join(params)
+    params = f"\n{params}\n{latticeFortranDefinition(v1, v2, numSites)}\n"
+    functions = (
+        code + FORTRAN_CODE_MASK_ARRAY_TEMPLATE + FORTRAN_CODE_UNIT_CELL_SETTER_TEMPLATE
+    )
+    if tables:
+        params += FORTRAN_CODE_TABLES_DECLARATIONS_TEMPLATE
+        functions += FORTRAN_CODE_TABLES_LOADER_TEMPLATE
+
+    source = FORTRAN_CODE_MODULE_TEMPLATE
+    source = source.replace("{{PARAMETERS}}", params)
+    source = source.replace("{{MODULE_NAME}}", moduleName)
+    source = source.replace("{{FUNCTIONS}}", functions)
+    return source
+
+
+def buildSourceFromConfig(
+    config: Dict[str, Any], moduleName: str, runtimeConstants: Sequence[str] = ()
+) -> str:
+    """Same source as SettingsWidget.buildSourceCode, built from the preset
+    config of the "lattice" category without any widgets"""
+    lattice = config.get("lattice", {})
+    names, _, _, _ = sitesFromConfig(lattice.get("sites"))
+    properties = [
+        ScalarProperty(param.get("name", ""), param.get("value", ""))
+        for param in config.get("parameters", [])
+    ]
+    return buildModuleSource(
+        moduleName,
+        properties,
+        lattice.get("v1", (0, 1)),
+        lattice.get("v2", (1, 0)),
+        len(names),
+        config.get("code", FORTRAN_CODE_MASK_FN_TEMPLATE),
+        config.get("tables", False),
+        runtimeConstants,
+    )
+
+
+def sourceHash(source: str) -> str:
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class Kernel:
+    """Compiled Fortran module with the mask subroutine"""
+
+    def __init__(self, extension, moduleName: str, digest: str, path: Path):
+        self.extension = extension
+        self.module = getattr(extension, moduleName)
+        self.moduleName = moduleName
+        self.hash = digest
+        self.path = path
+
+    def setUnitCellPositions(self, positions: numpy.ndarray):
+        positions = numpy.asarray(positions, dtype=numpy.float64)
+        self.module.set_unit_cell_positions(positions)
+
+    def setConstants(self, constants: Dict[str, Any]):
+        """Sets constants compiled as runtime module variables"""
+        for name, value in constants.items():
+            setattr(self.module, name.lower(), value)
+
+    def mask(self, x: float, y: float, z: float = 0) -> int:
+        return self.module.mask(float(x), float(y), float(z))
+
+    def maskArray(self, positions: numpy.ndarray) -> numpy.ndarray:
+        """Evaluates mask of (N, 3) positions with a single call"""
+        if len(positions) == 0:
+            return numpy.zeros(0, dtype=bool)
+        positions = numpy.asfortranarray(positions, dtype=numpy.float64)
+        return self.module.mask_array(positions) != 0
+
+
+# source hash -> kernel, extensions cannot be unloaded so they are kept loaded
+loadedKernels: Dict[str, Kernel] = {}
+
+
+def extensionName(digest: str) -> str:
+    return f"kernel_{digest[:20]}"
+
+
+def findExtension(name: str, cacheDir: Path) -> Optional[Path]:
+    paths = sorted(glob.glob(str(cacheDir / f"{name}*.so")))
+    return Path(paths[0]) if paths else None
+
+
+def loadExtension(name: str, path: Path):
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    extension = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(extension)
+    return extension
+
+
+def buildExtension(
+    source: str, name: str, cacheDir: Path, sourceFn: str = None, verbose: bool = True
+) -> Path:
+    """Runs f2py in a temporary directory (the same command f2py.compile runs)
+    and moves the extension into the cache directory"""
+    with tempfile.TemporaryDirectory() as buildDir:
+        sourcePath = Path(buildDir) / f"{name}.f90"
+        sourcePath.write_text(source)
+        if sourceFn is not None:
+            Path(sourceFn).write_text(source)
+
+        command = [sys.executable, "-m", "numpy.f2py"]
+        command += ["-c", str(sourcePath), "-m", name]
+        result = subprocess.run(
+            command,
+            cwd=buildDir,
+            stdout=None if verbose else subprocess.DEVNULL,
+            stderr=None if verbose else subprocess.DEVNULL,
+        )
+        built = findExtension(name, Path(buildDir))
+        if result.returncode != 0 or built is None:
+            title = f"Cannot compile Fortran code! Check console for output!"
+            raise ValueError(title)
+
+        cacheDir.mkdir(parents=True, exist_ok=True)
+        path = cacheDir / built.name
+        shutil.move(str(built), str(path))
+    return path
+
+
+def compileKernel(
+    source: str,
+    moduleName: str,
+    sourceFn: str = None,
+    cacheDir: Path = None,
+    verbose: bool = True,
+) -> Kernel:
+    """Compiles the module with f2py, the same source is compiled only once
+    and later loaded from the cache directory"""
+    digest = sourceHash(source)
+    if digest in loadedKernels:
+        return loadedKernels[digest]
+
+    cacheDir = KERNELS_DIR if cacheDir is None else Path(cacheDir)
+    name = extensionName(digest)
+    path = findExtension(name, cacheDir)
+    if path is None:
+        with profiler.span("f2py compile", "pipeline"):
+            path = buildExtension(source, name, cacheDir, sourceFn, verbose)
+    else:
+        print(f"Using cached kernel: {path}")
+
+    with profiler.span("import", "pipeline"):
+        kernel = Kernel(loadExtension(name, path), moduleName, digest, path)
+    loadedKernels[digest] = kernel
+    return kernel
@@ -0,0 +1,276 @@
+import threading
+from typing import Callable, NamedTuple, Sequence, Tuple
+
+import numpy
+
+from tb_lattice_viewer.mask_cache import MaskCache, maskContextKey
+from tb_lattice_viewer.symmetry import SymmetryOps, evaluateSymmetric
+
+IndexRange = Tuple[int, int, int, int]
+Window = Tuple[Tuple[float, float], Tuple[float, float]]
+MaskFn = Callable[[float, float, float], int]
+MaskArrayFn = Callable[[numpy.ndarray], numpy.ndarray]
+
+# sites evaluated between the checks of a cancellation event
+CANCEL_CHECK_SITES = 2 ** 16
+
+
+class GenerationCancelled(Exception):
+    """Raised by generateLatticeSites when its cancellation event is set"""
+
+
+class LatticeSites(NamedTuple):
+    """Generated lattice sites, ordered by cell (i, j) and then by basis site"""
+
+    positions: numpy.ndarray  # (N, 3) float64
+    siteTypes: numpy.ndarray  # (N,) int32 - index of the unit cell site
+    cells: numpy.ndarray  # (N, 2) int64 - (i, j) of the unit cell
+
+    @property
+    def numSites(self) -> int:
+        return len(self.positions)
+
+
+class NeighbourOffsets(NamedTuple):
+    """Bonds of the infinite lattice: site `siteFrom` in cell (i, j) is bonded
+    with site `siteTo` in cell (i + di, j + dj), `shell` = 0 is the nearest
+    neighbour shell"""
+
+    siteFrom: numpy.ndarray
+    siteTo: numpy.ndarray
+    di: numpy.ndarray
+    dj: numpy.ndarray
+    shell: numpy.ndarray
+    distances: numpy.ndarray  # distance of each shell
+
+    @property
+    def numOffsets(self) -> int:
+        return len(self.siteFrom)
+
+
+class Neighbours(NamedTuple):
+    rows: numpy.ndarray
+    cols: numpy.ndarray
+    shells: numpy.ndarray
+
+    @property
+    def numBonds(self) -> int:
+        return len(self.rows)
+
+
+def asBasis(basis: Sequence[Sequence[float]]) -> numpy.ndarray:
+    basis = numpy.asarray(basis, dtype=numpy.float64).reshape(len(basis), -1)
+    if basis.shape[1] < 3:
+        padding = numpy.zeros((len(basis), 3 - basis.shape[1]))
+        basis = numpy.hstack([basis, padding])
+    return basis
+
+
+def latticeVectors(v1: Sequence[float], v2: Sequence[float]) -> numpy.ndarray:
+    vectors = numpy.zeros((2, 3))
+    vectors[0, : len(v1)] = v1
+    vectors[1, : len(v2)] = v2
+    return vectors
+
+
+def stepIndexAt(vector: Sequence[float], x: float, y: float) -> Tuple[int, int]:
+    sx = 0 if vector[0] == 0 else round(x / vector[0])
+    sy = 0 if vector[1] == 0 else round(y / vector[1])
+    return sx, sy
+
+
+def latticeIndexRange(
+    v1: Sequence[float], v2: Sequence[float], window: Window
+) -> IndexRange:
+    """Returns (iMin, jMin, iMax, jMax) of the cells to scan for the window"""
+    xyMin, xyMax = window
+    s1x1, s1y1 = stepIndexAt(v1, *xyMin)
+    s1x2, s1y2 = stepIndexAt(v1, *xyMax)
+    s2x1, s2y1 = stepIndexAt(v2, *xyMin)
+    s2x2, s2y2 = stepIndexAt(v2, *xyMax)
+    x = s1x1, s1x2, s2x1, s2x2
+    y = s1y1, s1y2, s2y1, s2y2
+    return min(x), min(y), max(x), max(y)
+
+
+def windowCells(
+    v1: Sequence[float], v2: Sequence[float], indexRange: IndexRange, window: Window
+) -> numpy.ndarray:
+    """Returns (i, j) indices of the cells which origin lies inside the window"""
+    iMin, jMin, iMax, jMax = indexRange
+    vectors = latticeVectors(v1, v2)
+    ii, jj = numpy.meshgrid(
+        numpy.arange(iMin, iMax + 1), numpy.arange(jMin, jMax + 1), indexing="ij"
+    )
+    cells = numpy.stack([ii.ravel(), jj.ravel()], axis=1)
+    origins = cells @ vectors[:, :2]
+    (xMin, yMin), (xMax, yMax) = window
+    inside = (
+        (origins[:, 0] >= xMin)
+        & (origins[:, 0] <= xMax)
+        & (origins[:, 1] >= yMin)
+        & (origins[:, 1] <= yMax)
+    )
+    return cells[inside]
+
+
+def evaluateMask(maskFn: MaskFn, positions: numpy.ndarray) -> numpy.ndarray:
+    return numpy.fromiter(
+        (maskFn(x, y, z) != 0 for x, y, z in positions.tolist()),
+        dtype=bool,
+        count=len(positions),
+    )
+
+
+def generateLatticeSites(
+    v1: Sequence[float],
+    v2: Sequence[float],
+    basis: Sequence[Sequence[float]],
+    indexRange: IndexRange,
+    window: Window,
+    maskFn: MaskFn = None,
+    maskArrayFn: MaskArrayFn = None,
+    maskCache: MaskCache = None,
+    maskHash: str = None,
+    symmetry: SymmetryOps = None,
+    verifySamples: int = 0,
+    cancelled: threading.Event = None,
+) -> LatticeSites:
+    """Sites of the cells inside the window, filtered with the batched
+    maskArrayFn when given, otherwise with maskFn called per site. With
+    maskCache and the kernel maskHash only cells not cached are evaluated,
+    with symmetry only the irreducible sites are evaluated. The mask is
+    evaluated in chunks when the cancelled event is given, GenerationCancelled
+    is raised between the chunks once it is set."""
+    basis = asBasis(basis)
+    vectors = latticeVectors(v1, v2)
+    uniqueCells = windowCells(v1, v2, indexRange, window)
+
+    numBasis = len(basis)
+    cellPositions = (uniqueCells @ vectors)[:, None, :] + basis[None, :, :]
+    positions = cellPositions.reshape(-1, 3)
+    siteTypes = numpy.tile(numpy.arange(numBasis, dtype=numpy.int32), len(uniqueCells))
+    cells = numpy.repeat(uniqueCells, numBasis, axis=0)
+
+    def evaluateChunk(positions: numpy.ndarray) -> numpy.ndarray:
+        if maskArrayFn is not None:
+            return numpy.asarray(maskArrayFn(positions), dtype=bool)
+        return evaluateMask(maskFn, positions)
+
+    def evaluate(positions: numpy.ndarray) -> numpy.ndarray:
+        if cancelled is None:
+            return evaluateChunk(positions)
+        keep = numpy.zeros(len(positions), dtype=bool)
+        for start in range(0, len(positions), CANCEL_CHECK_SITES):
+            if cancelled.is_set():
+                raise GenerationCancelled()
+            stop = start + CANCEL_CHECK_SITES
+            keep[start:stop] = evaluateChunk(positions[start:stop])
+        return keep
+
+    if cancelled is not None and cancelled.is_set():
+        raise GenerationCancelled()
+    if symmetry is not None and symmetry.order > 1:
+        keep = evaluateSymmetric(
+            symmetry,
+            vectors,
+            basis,
+            cells,
+            siteTypes,
+            evaluate,
+            verifySamples,
+        )
+    elif maskCache is not None and maskHash is not None:
+        context = maskContextKey(maskHash, vectors, basis)
+        keep = maskCache.evaluate(context, uniqueCells, cellPositions, evaluate)
+        keep = keep.ravel()
+    else:
+        keep = evaluate(positions)
+    return LatticeSites(positions[keep], siteTypes[keep], cells[keep])
+
+
+def neighbourOffsets(
+    v1: Sequence[float],
+    v2: Sequence[float],
+    basis: Sequence[Sequence[float]],
+    numShells: int = 1,
+    searchRadius: int = None,
+    decimals: int = 6,
+) -> NeighbourOffsets:
+    basis = asBasis(basis)
+    vectors = latticeVectors(v1, v2)
+    if searchRadius is None:
+        searchRadius = numShells + 1
+
+    numBasis = len(basis)
+    steps = numpy.arange(-searchRadius, searchRadius + 1)
+    a, b, di, dj = [
+        g.ravel()
+        for g in numpy.meshgrid(
+            numpy.arange(numBasis), numpy.arange(numBasis), steps, steps, indexing="ij"
+        )
+    ]
+    shifts = numpy.stack([di, dj], axis=1) @ vectors
+    distances = numpy.linalg.norm(shifts + basis[b] - basis[a], axis=1)
+    distances = numpy.round(distances, decimals)
+
+    bonded = distances > 0
+    shellDistances = numpy.unique(distances[bonded])[:numShells]
+    shell = numpy.searchsorted(shellDistances, distances)
+    bonded &= numpy.isin(distances, shellDistances)
+
+    return NeighbourOffsets(
+        siteFrom=a[bonded].astype(numpy.int32),
+        siteTo=b[bonded].astype(numpy.int32),
+        di=di[bonded],
+        dj=dj[bonded],
+        shell=shell[bonded].astype(numpy.int32),
+        distances=shellDistances,
+    )
+
+
+def siteIndexTable(
+    sites: LatticeSites, numBasis: int
+) -> Tuple[Tuple[int, int], numpy.ndarray]:
+    """Returns the (iMin, jMin) origin and a dense table which maps
+    (i - iMin, j - jMin, site) to the index of the generated site or -1"""
+    if sites.numSites == 0:
+        return (0, 0), numpy.full((0, 0, numBasis), -1, dtype=numpy.int64)
+
+    origin = sites.cells.min(0)
+    shape = sites.cells.max(0) - origin + 1
+    table = numpy.full((shape[0], shape[1], numBasis), -1, dtype=numpy.int64)
+    local = sites.cells - origin
+    table[local[:, 0], local[:, 1], sites.siteTypes] = numpy.arange(sites.numSites)
+    return (int(origin[0]), int(origin[1])), table
+
+
+def findNeighbours(
+    sites: LatticeSites, offsets: NeighbourOffsets, numBasis: int
+) -> Neighbours:
+    origin, table = siteIndexTable(sites, numBasis)
+    local = sites.cells - numpy.array(origin)
+    shape = numpy.array(table.shape[:2])
+    sitesByType = [
+        numpy.flatnonzero(sites.siteTypes == t) for t in range(numBasis)
+    ]
+
+    rows, cols, shells = [], [], []
+    for k in range(offsets.numOffsets):
+        source = sitesByType[offsets.siteFrom[k]]
+        target = local[source] + (offsets.di[k], offsets.dj[k])
+        inside = numpy.all((target >= 0) & (target < shape), axis=1)
+        source, target = source[inside], target[inside]
+        target = table[target[:, 0], target[:, 1], offsets.siteTo[k]]
+        bonded = target >= 0
+        rows.append(source[bonded])
+        cols.append(target[bonded])
+        shells.append(numpy.full(bonded.sum(), offsets.shell[k], dtype=numpy.int32))
+
+    if not rows:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return Neighbours(empty, empty, empty.astype(numpy.int32))
+
+    return Neighbours(
+        numpy.concatenate(rows), numpy.concatenate(cols), numpy.concatenate(shells)
+    )
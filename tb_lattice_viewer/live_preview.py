@@ -0,0 +1,276 @@
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+import numpy
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from tb_lattice_viewer.estimator import estimateScene
+from tb_lattice_viewer.kernels import Kernel, compileKernel, sourceHash
+from tb_lattice_viewer.lattice import (
+    GenerationCancelled,
+    IndexRange,
+    LatticeSites,
+    Window,
+    generateLatticeSites,
+)
+from tb_lattice_viewer.symmetry import SymmetryOps
+
+# work needed for a change, each level includes the following ones
+COMPILE, GENERATE, SCENE = "compile", "generate", "scene"
+
+
+class PreviewInputs(NamedTuple):
+    source: str
+    moduleName: str
+    v1: Sequence[float]
+    v2: Sequence[float]
+    basis: numpy.ndarray
+    indexRange: IndexRange
+    window: Window
+    symmetry: Optional[SymmetryOps]
+    verifySamples: int
+    symmetryKey: str
+    appearanceKey: str  # sizes, colors and render settings
+
+    def generationKey(self) -> tuple:
+        """Everything the generated sites depend on except the source"""
+        basis = numpy.asarray(self.basis, dtype=numpy.float64)
+        return (
+            tuple(self.v1),
+            tuple(self.v2),
+            basis.tobytes(),
+            self.indexRange,
+            self.window,
+            self.symmetryKey,
+        )
+
+
+class PreviewResult(NamedTuple):
+    jobId: int
+    kernel: Optional[Kernel]
+    sites: Optional[LatticeSites]
+    seconds: float
+    error: str = ""
+
+
+def previewWork(
+    previous: Optional[PreviewInputs], current: PreviewInputs
+) -> Optional[str]:
+    """Cheapest work which brings the preview up to date, None when nothing
+    changed"""
+    if previous is None or previous.source != current.source:
+        return COMPILE
+    if previous.generationKey() != current.generationKey():
+        return GENERATE
+    if previous.appearanceKey != current.appearanceKey:
+        return SCENE
+    return None
+
+
+class LivePreview(QObject):
+    """Regenerates the lattice in a background thread after the settings stop
+    changing for intervalMs. Only one job runs at a time, a job superseded by
+    newer inputs stops between chunks of the mask evaluation and its result
+    is dropped."""
+
+    resultReady = pyqtSignal(object)
+    # emitted when a job returned, also when it was cancelled
+    jobFinished = pyqtSignal()
+
+    def __init__(
+        self,
+        settingsWidget: "SettingsWidget",
+        renderWidget: "RenderWidget",
+        intervalMs: int = 300,
+    ):
+        super().__init__(settingsWidget)
+        self.settings = settingsWidget
+        self.render = renderWidget
+        self.enabled = False
+
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="preview")
+        self.jobId = 0
+        self.cancelEvent: Optional[threading.Event] = None
+        self.job: Optional[Future] = None
+        # inputs of the last submitted job or scene
+        self.lastInputs: Optional[PreviewInputs] = None
+        # called on the GUI thread once the running job returns
+        self.pending: List[Callable[[], None]] = []
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(intervalMs)
+        self.timer.timeout.connect(self.update)
+        for signal in settingsWidget.changeSignals():
+            signal.connect(self.schedule)
+        self.resultReady.connect(self.finish)
+        self.jobFinished.connect(self.runPending)
+
+    def setEnabled(self, enabled: bool):
+        self.enabled = enabled
+        if enabled:
+            self.lastInputs = None
+            self.timer.start(0)
+        else:
+            self.timer.stop()
+            self.cancel()
+            self.settings.previewLabel.setText("")
+
+    def schedule(self, *args):
+        if self.enabled:
+            self.timer.start(self.timer.interval())
+
+    def isRunning(self) -> bool:
+        return self.job is not None and not self.job.done()
+
+    def cancel(self):
+        """Drops the result of the current job and stops its mask evaluation"""
+        if self.cancelEvent is not None:
+            self.cancelEvent.set()
+        self.jobId += 1
+
+    def whenIdle(self, callback: Callable[[], None]):
+        """Calls callback now or after the running job returns, the kernel and
+        the mask cache are not used by two threads at once. The GUI thread
+        does not wait for the job, no new jobs start in the meantime."""
+        if not self.isRunning():
+            callback()
+        elif callback not in self.pending:
+            self.pending.append(callback)
+
+    def runPending(self):
+        if self.isRunning():
+            return
+        pending, self.pending = self.pending, []
+        for callback in pending:
+            callback()
+
+    def update(self):
+        if self.pending:
+            # waits for the explicit compile queued after the running job
+            return
+        try:
+            inputs = self.settings.previewInputs()
+        except Exception as error:
+            self.settings.previewLabel.setText(f"Preview: {error}")
+            return
+
+        work = previewWork(self.lastInputs, inputs)
+        if work is None:
+            return
+        if work == SCENE:
+            self.lastInputs = inputs
+            # a running job builds its scene with the current appearance
+            if not self.isRunning():
+                self.showScene()
+            return
+
+        # upper bound without the mask, large scenes are left for the explicit
+        # compile and generate
+        estimate = estimateScene(
+            inputs.v1,
+            inputs.v2,
+            inputs.basis,
+            inputs.indexRange,
+            inputs.window,
+            renderMode=self.settings.renderModeCombo.currentText(),
+            thresholds=self.settings.thresholds(),
+        )
+        if estimate.renderMode == "tiles" or (
+            estimate.memoryMB > self.settings.warnMemorySpinBox.value()
+        ):
+            self.cancel()
+            self.lastInputs = None
+            self.settings.previewLabel.setText(
+                f"Preview paused: ~{estimate.candidateSites:,} sites, "
+                f"use compile and generate"
+            )
+            return
+
+        self.cancel()
+        self.cancelEvent = threading.Event()
+        self.lastInputs = inputs
+        kernel = self.settings.kernel
+        if kernel is None or kernel.hash != sourceHash(inputs.source):
+            work = COMPILE
+        self.settings.previewLabel.setText(
+            "Preview: compiling..." if work == COMPILE else "Preview: generating..."
+        )
+        self.job = self.executor.submit(
+            self.run, self.jobId, work, inputs, kernel, self.cancelEvent
+        )
+        # the future is done before the queued signal reaches the GUI thread
+        self.job.add_done_callback(lambda job: self.jobFinished.emit())
+
+    def run(
+        self,
+        jobId: int,
+        work: str,
+        inputs: PreviewInputs,
+        kernel: Optional[Kernel],
+        cancelled: threading.Event,
+    ):
+        """Runs in the worker thread, no widgets are accessed here"""
+        start = time.perf_counter()
+        try:
+            if work == COMPILE:
+                kernel = compileKernel(inputs.source, inputs.moduleName, verbose=False)
+            if cancelled.is_set():
+                return
+            kernel.setUnitCellPositions(inputs.basis)
+            sites = generateLatticeSites(
+                inputs.v1,
+                inputs.v2,
+                inputs.basis,
+                inputs.indexRange,
+                inputs.window,
+                maskFn=kernel.mask,
+                maskArrayFn=kernel.maskArray,
+                maskCache=self.settings.maskCache,
+                maskHash=kernel.hash,
+                symmetry=inputs.symmetry,
+                verifySamples=inputs.verifySamples,
+                cancelled=cancelled,
+            )
+            if cancelled.is_set():
+                return
+            seconds = time.perf_counter() - start
+            self.resultReady.emit(PreviewResult(jobId, kernel, sites, seconds))
+        except GenerationCancelled:
+            # superseded by newer inputs, the next job is already queued
+            return
+        except Exception as error:
+            traceback.print_exc()
+            seconds = time.perf_counter() - start
+            result = PreviewResult(jobId, None, None, seconds, str(error))
+            self.resultReady.emit(result)
+
+    def finish(self, result: PreviewResult):
+        if result.jobId != self.jobId:
+            return
+        if result.error:
+            self.settings.previewLabel.setText(f"Preview failed: {result.error}")
+            # the same inputs are tried again after the next change
+            self.lastInputs = None
+            return
+
+        self.settings.kernel = result.kernel
+        self.settings.maskFunction = result.kernel.mask
+        self.settings.sites = result.sites
+        self.settings.previewLabel.setText(
+            f"Preview: {result.sites.numSites:,} sites in {result.seconds:.2f} s"
+        )
+        self.showScene()
+
+    def showScene(self):
+        sites = self.settings.sites
+        if sites is None or sites.numSites == 0:
+            return
+        self.render.setScene(
+            lambda rootEntity, camera: self.settings.createSceneFromSites(
+                rootEntity, sites
+            )
+        )
@@ -2,15 +2,20 @@ import traceback
 
 from PyQt5.QtWidgets import *
 
+from tb_lattice_viewer.live_preview import LivePreview
+from tb_lattice_viewer.profiling import profiler
 from tb_lattice_viewer.render_widget import RenderWidget
 from tb_lattice_viewer.settings_widget import SettingsWidget
+from tb_lattice_viewer.widgets import TimingsPanel
 
 
 class App(QWidget):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.settingsWidget = SettingsWidget()
-		self.renderWidget = RenderWidget()
+		with profiler.span("SettingsWidget", "startup"):
+			self.settingsWidget = SettingsWidget()
+		with profiler.span("RenderWidget", "startup"):
+			self.renderWidget = RenderWidget()
 
 		scroll = QScrollArea()
 		scroll.setMaximumWidth(600)
@@ -22,14 +27,41 @@ class App(QWidget):
 		h.addWidget(self.renderWidget)
 		self.setLayout(h)
 
+		# shown in the status bar of the main window
+		self.timingsPanel = TimingsPanel("pipeline")
+		self.renderWidget.firstFrameRendered.connect(self.timingsPanel.refresh)
+
 		self.settingsWidget.compileButton.pressed.connect(self.generateScene)
 
+		self.preview = LivePreview(self.settingsWidget, self.renderWidget)
+		self.settingsWidget.livePreviewCheckBox.toggled.connect(self.preview.setEnabled)
+		self.settingsWidget.sceneRebuildRequested.connect(self.preview.showScene)
+		self.settingsWidget.sitePickerChanged.connect(self.renderWidget.setSitePicker)
+		self.settingsWidget.timeSeriesChanged.connect(
+			lambda series: self.renderWidget.setTimeSeries(
+				series, self.settingsWidget.showFieldFrame
+			)
+		)
+
 	def generateScene(self):
+		# runs once the cancelled preview job returns, without blocking the window
+		self.preview.cancel()
+		self.preview.whenIdle(self.compileScene)
+
+	def compileScene(self):
+		profiler.clear("pipeline")
 		try:
-			result = self.settingsWidget.compileSourceCode()
-			if result is None:
-				return
-			self.renderWidget.setScene(self.settingsWidget.createScene)
+			with profiler.span("generateScene", "pipeline"):
+				result = self.settingsWidget.compileSourceCode()
+				if result is None:
+					return
+				with profiler.span("estimate", "pipeline"):
+					estimate = self.settingsWidget.estimateScene()
+				if not self.settingsWidget.confirmEstimate(estimate):
+					return
+				self.renderWidget.setScene(self.settingsWidget.createScene)
+			print(profiler.summary("pipeline"))
+			self.timingsPanel.refresh()
 		except Exception as e:
 			title = f"Cannot parse"
 			traceback.print_exc()
@@ -0,0 +1,124 @@
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Tuple
+
+import numpy
+
+BLOCK_CELLS = 32
+MASK_CACHE_MB = 256
+
+
+class MaskBlock(NamedTuple):
+    """Mask of BLOCK_CELLS x BLOCK_CELLS cells, `known` marks evaluated cells"""
+
+    values: numpy.ndarray  # (B, B, numBasis) bool
+    known: numpy.ndarray  # (B, B) bool
+
+    @property
+    def numBytes(self) -> int:
+        return self.values.nbytes + self.known.nbytes
+
+
+def maskContextKey(
+    kernelHash: str, vectors: numpy.ndarray, basis: numpy.ndarray
+) -> str:
+    """Mask results depend on the compiled source and on the unit cell
+    positions, which are passed to the kernel at runtime"""
+    digest = hashlib.sha1(kernelHash.encode("utf-8"))
+    digest.update(numpy.ascontiguousarray(vectors, dtype=numpy.float64).tobytes())
+    digest.update(numpy.ascontiguousarray(basis, dtype=numpy.float64).tobytes())
+    return digest.hexdigest()
+
+
+class MaskCache:
+    """Mask results per block of cells, blocks are evicted in the least recently
+    used order above maxBytes"""
+
+    def __init__(
+        self, maxBytes: int = MASK_CACHE_MB * 2 ** 20, blockCells: int = BLOCK_CELLS
+    ):
+        self.maxBytes = maxBytes
+        self.blockCells = blockCells
+        self.blocks: "OrderedDict[Tuple[str, int, int], MaskBlock]" = OrderedDict()
+        self.usedBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.blocks.clear()
+        self.usedBytes = 0
+
+    def setMaxBytes(self, maxBytes: int):
+        self.maxBytes = maxBytes
+        self.evict()
+
+    def evaluate(
+        self,
+        context: str,
+        cells: numpy.ndarray,
+        positions: numpy.ndarray,
+        maskArrayFn: Callable[[numpy.ndarray], numpy.ndarray],
+    ) -> numpy.ndarray:
+        """Returns (C, numBasis) mask of the (C, 2) unique cells with (C, numBasis, 3)
+        site positions, only cells not seen before are passed to maskArrayFn"""
+        numCells, numBasis = positions.shape[:2]
+        result = numpy.zeros((numCells, numBasis), dtype=bool)
+        if numCells == 0:
+            return result
+
+        blockKeys = numpy.floor_divide(cells, self.blockCells)
+        local = cells - blockKeys * self.blockCells
+        # unique of flat keys is much faster than numpy.unique with axis=0
+        lower = blockKeys.min(0)
+        span = blockKeys.max(0) - lower + 1
+        flatKeys = (blockKeys[:, 0] - lower[0]) * span[1] + blockKeys[:, 1] - lower[1]
+        uniqueFlat, inverse = numpy.unique(flatKeys, return_inverse=True)
+        uniqueKeys = numpy.stack(
+            [uniqueFlat // span[1] + lower[0], uniqueFlat % span[1] + lower[1]], axis=1
+        )
+        inverse = inverse.ravel()
+        order = numpy.argsort(inverse, kind="stable")
+        bounds = numpy.searchsorted(inverse[order], numpy.arange(len(uniqueKeys) + 1))
+
+        # rows of the cells of each block and the rows not evaluated yet
+        groups: Dict[Tuple[str, int, int], numpy.ndarray] = {}
+        missingRows = []
+        for k, (bi, bj) in enumerate(uniqueKeys.tolist()):
+            key = (context, bi, bj)
+            rows = order[bounds[k] : bounds[k + 1]]
+            block = self.blocks.get(key)
+            if block is None:
+                block = MaskBlock(
+                    numpy.zeros((self.blockCells, self.blockCells, numBasis), dtype=bool),
+                    numpy.zeros((self.blockCells, self.blockCells), dtype=bool),
+                )
+                self.blocks[key] = block
+                self.usedBytes += block.numBytes
+            self.blocks.move_to_end(key)
+            groups[key] = rows
+            missingRows.append(rows[~block.known[local[rows, 0], local[rows, 1]]])
+
+        missingRows = numpy.concatenate(missingRows)
+        self.misses += len(missingRows)
+        self.hits += numCells - len(missingRows)
+        missing = numpy.zeros(numCells, dtype=bool)
+        missing[missingRows] = True
+        if len(missingRows) > 0:
+            values = maskArrayFn(positions[missingRows].reshape(-1, 3))
+            result[missingRows] = numpy.asarray(values, dtype=bool).reshape(-1, numBasis)
+
+        for key, rows in groups.items():
+            block = self.blocks[key]
+            li, lj = local[rows, 0], local[rows, 1]
+            new = missing[rows]
+            block.values[li[new], lj[new]] = result[rows[new]]
+            block.known[li[new], lj[new]] = True
+            result[rows[~new]] = block.values[li[~new], lj[~new]]
+
+        self.evict()
+        return result
+
+    def evict(self):
+        while self.usedBytes > self.maxBytes and self.blocks:
+            _, block = self.blocks.popitem(last=False)
+            self.usedBytes -= block.numBytes
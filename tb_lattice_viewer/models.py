@@ -0,0 +1,271 @@
+from typing import Any, Dict, List, Sequence
+
+import numpy
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+from tb_lattice_viewer.unit_cell import sitesFromConfig
+
+
+class ScalarPropertiesModel(QAbstractTableModel):
+    """Name = value constants, editors are created only for the edited cell"""
+
+    NAME, VALUE = range(2)
+    COLUMNS = ["Name", "Value"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.names: List[str] = []
+        self.values: List[str] = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.names)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return section + 1
+
+    def flags(self, index: QModelIndex):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        if index.column() == self.NAME:
+            return self.names[index.row()]
+        return self.values[index.row()]
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole) -> bool:
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        if index.column() == self.NAME:
+            self.names[index.row()] = str(value)
+        else:
+            self.values[index.row()] = str(value)
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def appendProperties(self, names: Sequence[str], values: Sequence[str]):
+        if len(names) == 0:
+            return
+        first = len(self.names)
+        self.beginInsertRows(QModelIndex(), first, first + len(names) - 1)
+        self.names += list(names)
+        self.values += list(values)
+        self.endInsertRows()
+
+    def removeRows(self, row: int, count: int, parent=QModelIndex()) -> bool:
+        if count <= 0 or row < 0 or row + count > len(self.names):
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        del self.names[row : row + count]
+        del self.values[row : row + count]
+        self.endRemoveRows()
+        return True
+
+    def getRowConfig(self, row: int) -> Dict[str, str]:
+        return {"name": self.names[row], "value": self.values[row]}
+
+    def setRowConfig(self, row: int, config: Dict[str, str]):
+        self.names[row] = config.get("name", "unknown")
+        self.values[row] = config.get("value", "0")
+        self.dataChanged.emit(self.index(row, 0), self.index(row, 1))
+
+    def setConfig(self, config: List[Dict[str, str]]):
+        self.beginResetModel()
+        self.names = [param.get("name", "") for param in config]
+        self.values = [param.get("value", "") for param in config]
+        self.endResetModel()
+
+    def getConfig(self) -> List[Dict[str, str]]:
+        return [
+            {"name": name, "value": value}
+            for name, value in zip(self.names, self.values)
+        ]
+
+
+class UnitCellModel(QAbstractTableModel):
+    """Unit cell sites stored as NumPy arrays, one row per site"""
+
+    NAME, X, Y, SIZE, COLOR = range(5)
+    COLUMNS = ["Name", "x", "y", "d", "Color"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.names: List[str] = []
+        self.positions = numpy.zeros((0, 2))
+        self.sizes = numpy.zeros(0)
+        self.colors = numpy.zeros((0, 3), dtype=numpy.uint8)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.names)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return section + 1
+
+    def flags(self, index: QModelIndex):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() != self.COLOR:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            if column == self.NAME:
+                return self.names[row]
+            if column == self.X:
+                return float(self.positions[row, 0])
+            if column == self.Y:
+                return float(self.positions[row, 1])
+            if column == self.SIZE:
+                return float(self.sizes[row])
+        if role == Qt.BackgroundRole and column == self.COLOR:
+            return QColor(*self.colors[row].tolist())
+        return None
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole) -> bool:
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        row, column = index.row(), index.column()
+        if column == self.NAME:
+            self.names[row] = str(value)
+        elif column == self.X:
+            self.positions[row, 0] = float(value)
+        elif column == self.Y:
+            self.positions[row, 1] = float(value)
+        elif column == self.SIZE:
+            self.sizes[row] = float(value)
+        elif column == self.COLOR:
+            color = QColor(value)
+            self.colors[row] = (color.red(), color.green(), color.blue())
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def setSites(
+        self,
+        names: Sequence[str],
+        positions: numpy.ndarray,
+        sizes: numpy.ndarray = None,
+        colors: numpy.ndarray = None,
+    ):
+        numSites = len(names)
+        self.beginResetModel()
+        self.names = list(names)
+        self.positions = numpy.array(positions, dtype=numpy.float64).reshape(-1, 2)
+        self.sizes = (
+            numpy.ones(numSites)
+            if sizes is None
+            else numpy.array(sizes, dtype=numpy.float64)
+        )
+        self.colors = (
+            numpy.full((numSites, 3), 255, dtype=numpy.uint8)
+            if colors is None
+            else numpy.array(colors, dtype=numpy.uint8).reshape(-1, 3)
+        )
+        self.endResetModel()
+
+    def appendSites(
+        self,
+        names: Sequence[str],
+        positions: numpy.ndarray,
+        sizes: numpy.ndarray = None,
+        colors: numpy.ndarray = None,
+    ):
+        numSites = len(names)
+        if numSites == 0:
+            return
+        first = len(self.names)
+        self.beginInsertRows(QModelIndex(), first, first + numSites - 1)
+        self.names += list(names)
+        self.positions = numpy.vstack(
+            [self.positions, numpy.reshape(positions, (-1, 2))]
+        )
+        sizes = numpy.ones(numSites) if sizes is None else sizes
+        colors = numpy.full((numSites, 3), 255) if colors is None else colors
+        self.sizes = numpy.concatenate([self.sizes, sizes])
+        self.colors = numpy.vstack(
+            [self.colors, numpy.reshape(colors, (-1, 3)).astype(numpy.uint8)]
+        )
+        self.endInsertRows()
+
+    def removeRows(self, row: int, count: int, parent=QModelIndex()) -> bool:
+        if count <= 0 or row < 0 or row + count > len(self.names):
+            return False
+        self.beginRemoveRows(parent, row, row + count - 1)
+        keep = numpy.ones(len(self.names), dtype=bool)
+        keep[row : row + count] = False
+        del self.names[row : row + count]
+        self.positions = self.positions[keep]
+        self.sizes = self.sizes[keep]
+        self.colors = self.colors[keep]
+        self.endRemoveRows()
+        return True
+
+    def setConfig(self, config):
+        """Accepts columnar config or the list of per site dicts of older presets"""
+        if isinstance(config, (dict, list, tuple)):
+            self.setSites(*sitesFromConfig(config))
+
+    def getConfig(self) -> Dict[str, Any]:
+        return {
+            "names": list(self.names),
+            "positions": self.positions.tolist(),
+            "sizes": self.sizes.tolist(),
+            "colors": self.colors.tolist(),
+        }
+
+
+class FloatDelegate(QStyledItemDelegate):
+    def __init__(
+        self,
+        minimum: float = -10000,
+        maximum: float = 10000,
+        decimals: int = 5,
+        step: float = 0.001,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decimals = decimals
+        self.step = step
+
+    def createEditor(self, parent, option, index):
+        editor = QDoubleSpinBox(parent)
+        editor.setFrame(False)
+        editor.setRange(self.minimum, self.maximum)
+        editor.setDecimals(self.decimals)
+        editor.setSingleStep(self.step)
+        return editor
+
+    def displayText(self, value, locale) -> str:
+        return f"{value:.{self.decimals}g}" if isinstance(value, float) else str(value)
+
+
+class ColorDelegate(QStyledItemDelegate):
+    """Opens color dialog on double click instead of an inline editor"""
+
+    def editorEvent(self, event, model, option, index) -> bool:
+        if event.type() == QEvent.MouseButtonDblClick:
+            color = QColorDialog.getColor(index.data(Qt.BackgroundRole))
+            if color.isValid():
+                model.setData(index, color)
+            return True
+        return super().editorEvent(event, model, option, index)
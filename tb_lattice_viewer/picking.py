@@ -0,0 +1,209 @@
+import time
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy
+
+from tb_lattice_viewer.lattice import LatticeSites
+from tb_lattice_viewer.scene import SceneFrame, viewProjectionMatrix
+
+# average number of sites in a cell of the picking grid
+SITES_PER_CELL = 4
+# hover and click tolerance around point sprites and small spheres
+PICK_PIXELS = 4
+
+
+class PickedSite(NamedTuple):
+    index: int  # in the generated (exported) sites
+    siteType: int
+    siteName: str
+    cell: Tuple[int, int]
+    position: Tuple[float, float, float]
+
+    def describe(self) -> str:
+        x, y, z = self.position
+        return (
+            f"site {self.index:,} ({self.siteName}) cell {self.cell} "
+            f"at ({x:.4g}, {y:.4g}, {z:.4g})"
+        )
+
+
+class SiteGrid:
+    """Uniform grid over the (x, y) positions of the sites, the indices of the
+    sites are sorted by grid cell so each cell is a slice of `order`"""
+
+    def __init__(self, positions: numpy.ndarray, sitesPerCell: int = SITES_PER_CELL):
+        self.positions = positions
+        numSites = max(len(positions), 1)
+        self.lower = positions.min(0)
+        self.upper = positions.max(0)
+        extent = (self.upper - self.lower)[:2]
+        area = numpy.prod(extent)
+        if area > 0:
+            self.cellSize = float(numpy.sqrt(area * sitesPerCell / numSites))
+        else:
+            # sites on a line or a single site
+            self.cellSize = float(max(extent.max() * sitesPerCell / numSites, 1e-6))
+        self.shape = numpy.floor(extent / self.cellSize).astype(numpy.int64) + 1
+
+        keys = self.cellKeys(self.cellsOf(positions[:, :2]))
+        dtype = numpy.int32 if len(positions) < 2 ** 31 else numpy.int64
+        self.order = numpy.argsort(keys, kind="stable").astype(dtype)
+        numCells = int(self.shape[0] * self.shape[1])
+        self.starts = numpy.searchsorted(keys[self.order], numpy.arange(numCells + 1))
+
+    def cellsOf(self, xy: numpy.ndarray) -> numpy.ndarray:
+        cells = numpy.floor((xy - self.lower[:2]) / self.cellSize).astype(numpy.int64)
+        return numpy.clip(cells, 0, self.shape - 1)
+
+    def cellKeys(self, cells: numpy.ndarray) -> numpy.ndarray:
+        return cells[:, 0] * self.shape[1] + cells[:, 1]
+
+    def clipRay(
+        self, origin: numpy.ndarray, direction: numpy.ndarray, margin: float
+    ) -> Optional[Tuple[float, float]]:
+        """Ray parameters where the ray is inside the bounding box of the sites
+        grown by margin, None when it misses the box"""
+        lower, upper = self.lower - margin, self.upper + margin
+        tMin, tMax = 0.0, numpy.inf
+        for axis in range(3):
+            if abs(direction[axis]) < 1e-12:
+                if not lower[axis] <= origin[axis] <= upper[axis]:
+                    return None
+                continue
+            t1 = (lower[axis] - origin[axis]) / direction[axis]
+            t2 = (upper[axis] - origin[axis]) / direction[axis]
+            tMin = max(tMin, min(t1, t2))
+            tMax = min(tMax, max(t1, t2))
+        if tMin > tMax:
+            return None
+        return tMin, tMax
+
+    def candidates(
+        self, origin: numpy.ndarray, direction: numpy.ndarray, margin: float
+    ) -> numpy.ndarray:
+        """Indices of the sites in the grid cells crossed by the ray, including
+        the cells within margin of it"""
+        span = self.clipRay(origin, direction, margin)
+        if span is None:
+            return numpy.zeros(0, dtype=numpy.int64)
+        tMin, tMax = span
+        # ray is sampled in the plane at half the cell size
+        planar = float(numpy.linalg.norm(direction[:2]))
+        step = 0.5 * self.cellSize / max(planar, 1e-12)
+        numSamples = int(min((tMax - tMin) / step, 4 * self.shape.sum())) + 2
+        t = numpy.linspace(tMin, tMax, numSamples)
+        cells = self.cellsOf(origin[:2] + t[:, None] * direction[:2])
+
+        reach = int(numpy.ceil(margin / self.cellSize))
+        offsets = numpy.arange(-reach, reach + 1)
+        di, dj = numpy.meshgrid(offsets, offsets, indexing="ij")
+        offsets = numpy.stack([di.ravel(), dj.ravel()], axis=1)
+        cells = (cells[:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+        inside = numpy.all((cells >= 0) & (cells < self.shape), axis=1)
+        keys = numpy.unique(self.cellKeys(cells[inside]))
+
+        # concatenated slices order[starts[k]:starts[k + 1]] of the cells
+        begins, ends = self.starts[keys], self.starts[keys + 1]
+        lengths = ends - begins
+        total = int(lengths.sum())
+        if total == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        shifts = numpy.repeat(begins - numpy.cumsum(lengths) + lengths, lengths)
+        return self.order[numpy.arange(total) + shifts]
+
+
+class SitePicker:
+    """Picks the site under the mouse by casting the camera ray against a grid
+    of the generated sites, the grid is built on the first pick"""
+
+    def __init__(
+        self,
+        sites: LatticeSites,
+        radii: Sequence[float],
+        frame: SceneFrame,
+        siteNames: Sequence[str] = (),
+    ):
+        self.sites = sites
+        self.radii = numpy.asarray(radii, dtype=numpy.float64)
+        self.frame = frame
+        self.siteNames = list(siteNames)
+        self.grid: Optional[SiteGrid] = None
+
+    def buildGrid(self) -> SiteGrid:
+        if self.grid is None:
+            start = time.perf_counter()
+            self.grid = SiteGrid(self.sites.positions)
+            seconds = time.perf_counter() - start
+            print(
+                f"Picking grid of {self.sites.numSites:,} sites built "
+                f"in {seconds:.2f} s"
+            )
+        return self.grid
+
+    def cameraRay(
+        self, camera: "QCamera", x: float, y: float, width: int, height: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Origin and unit direction in the lattice coordinates of the ray
+        through the pixel (x, y) of the view"""
+        inverse = numpy.linalg.inv(viewProjectionMatrix(camera, self.frame))
+        ndcX = 2 * x / max(width, 1) - 1
+        ndcY = 1 - 2 * y / max(height, 1)
+        near = inverse @ numpy.array([ndcX, ndcY, -1.0, 1.0])
+        far = inverse @ numpy.array([ndcX, ndcY, 1.0, 1.0])
+        near, far = near[:3] / near[3], far[:3] / far[3]
+        direction = far - near
+        return near, direction / numpy.linalg.norm(direction)
+
+    def pick(
+        self, camera: "QCamera", x: float, y: float, width: int, height: int
+    ) -> Optional[PickedSite]:
+        if self.sites.numSites == 0:
+            return None
+        grid = self.buildGrid()
+        origin, direction = self.cameraRay(camera, x, y, width, height)
+        # angle of PICK_PIXELS, sites smaller than it are picked within it
+        pixelAngle = numpy.radians(camera.fieldOfView()) / max(height, 1)
+        tolerance = pixelAngle * PICK_PIXELS
+        # depth where the ray leaves the sites, the tolerance grows with it
+        maxRadius = self.radii.max(initial=0)
+        span = grid.clipRay(origin, direction, maxRadius)
+        if span is None:
+            depth = float(numpy.linalg.norm(grid.upper - grid.lower) + 1)
+            depth += float(numpy.linalg.norm(origin - grid.lower))
+        else:
+            depth = span[1]
+        margin = max(maxRadius, tolerance * depth)
+
+        indices = grid.candidates(origin, direction, margin)
+        if len(indices) == 0:
+            return None
+        vectors = self.sites.positions[indices] - origin
+        along = vectors @ direction
+        offAxis2 = numpy.einsum("ij,ij->i", vectors, vectors) - along ** 2
+        radius = numpy.maximum(
+            self.radii[self.sites.siteTypes[indices]], tolerance * along
+        )
+        hit = (along > 0) & (offAxis2 <= radius ** 2)
+        if not hit.any():
+            return None
+        # nearest entry point of the ray into the (tolerance) spheres
+        entry = along - numpy.sqrt(numpy.maximum(radius ** 2 - offAxis2, 0))
+        entry[~hit] = numpy.inf
+        index = int(indices[numpy.argmin(entry)])
+        return self.pickedSite(index)
+
+    def pickedSite(self, index: int) -> PickedSite:
+        siteType = int(self.sites.siteTypes[index])
+        name = (
+            self.siteNames[siteType]
+            if siteType < len(self.siteNames)
+            else str(siteType + 1)
+        )
+        i, j = self.sites.cells[index].tolist()
+        return PickedSite(
+            index=index,
+            siteType=siteType,
+            siteName=name,
+            cell=(i, j),
+            position=tuple(self.sites.positions[index].tolist()),
+        )
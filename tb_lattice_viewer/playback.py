@@ -0,0 +1,160 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+PLAYBACK_FPS = 25
+PREFETCH_FRAMES = 8
+
+
+class TimeSeries:
+    """(T, N) per site values memory mapped from a .npy file, only the frames
+    which are shown are read from the disk"""
+
+    def __init__(self, path: Path, numSites: int):
+        self.path = Path(path)
+        self.data = numpy.load(self.path, mmap_mode="r")
+        if self.data.ndim != 2:
+            raise ValueError(
+                f"Expected (frames, sites) array, got shape {self.data.shape}"
+            )
+        if self.data.shape[1] != numSites:
+            raise ValueError(
+                f"Time series has {self.data.shape[1]} values per frame, "
+                f"but the lattice has {numSites} sites"
+            )
+
+    @property
+    def numFrames(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def numSites(self) -> int:
+        return self.data.shape[1]
+
+    def frame(self, t: int) -> numpy.ndarray:
+        """Copy of frame t, complex amplitudes are read as their modulus"""
+        values = numpy.array(self.data[t])
+        if numpy.iscomplexobj(values):
+            values = numpy.abs(values)
+        return values.astype(numpy.float64, copy=False)
+
+
+class FramePrefetcher:
+    """Reads the frames following the requested one in a background thread,
+    at most `ahead` frames are kept in memory"""
+
+    def __init__(self, series: TimeSeries, ahead: int = PREFETCH_FRAMES):
+        self.series = series
+        self.ahead = ahead
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="prefetch")
+        self.frames: "OrderedDict[int, Future]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, t: int) -> numpy.ndarray:
+        """Frame t, a frame which was not prefetched is read in this thread so
+        a seek does not wait for the reads queued before it"""
+        upcoming = self.upcoming(t)
+        self.cancelStale(upcoming)
+        future = self.frames.pop(t, None)
+        if future is not None and future.done():
+            self.hits += 1
+        else:
+            self.misses += 1
+        if future is not None and not future.cancel():
+            # read already done or in progress
+            values = future.result()
+        else:
+            values = self.series.frame(t)
+        self.prefetch(upcoming)
+        return values
+
+    def upcoming(self, t: int) -> List[int]:
+        """Frames t + 1 ... t + ahead, wrapping around at the end"""
+        return [(t + k) % self.series.numFrames for k in range(1, self.ahead + 1)]
+
+    def cancelStale(self, upcoming: List[int]):
+        """Cancels queued reads of frames outside the upcoming ones, a read in
+        progress cannot be cancelled and finishes in the background"""
+        keep = set(upcoming)
+        for key in list(self.frames):
+            if key not in keep and self.frames[key].cancel():
+                del self.frames[key]
+
+    def prefetch(self, upcoming: List[int]):
+        """Queues reads of the upcoming frames and forgets the other ones"""
+        for key in list(self.frames):
+            if key not in upcoming:
+                self.frames.pop(key).cancel()
+        for key in upcoming:
+            if key not in self.frames:
+                self.frames[key] = self.executor.submit(self.series.frame, key)
+
+    def shutdown(self):
+        for future in self.frames.values():
+            future.cancel()
+        self.frames.clear()
+        self.executor.shutdown(wait=False)
+
+
+class Playback(QObject):
+    """Shows the frames of a time series at a target frame rate by passing the
+    values of each frame to `apply`. Frames which take longer than the frame
+    interval delay the next one instead of queuing up."""
+
+    frameChanged = pyqtSignal(int)
+
+    def __init__(
+        self,
+        series: TimeSeries,
+        apply: Callable[[numpy.ndarray], None],
+        fps: float = PLAYBACK_FPS,
+        ahead: int = PREFETCH_FRAMES,
+        parent: Optional[QObject] = None,
+    ):
+        super().__init__(parent)
+        self.series = series
+        self.apply = apply
+        self.prefetcher = FramePrefetcher(series, ahead)
+        self.frame = 0
+        self.frameSeconds = 0.0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.step)
+        self.setFps(fps)
+
+    def setFps(self, fps: float):
+        self.interval = 1 / max(fps, 1e-3)
+
+    def isPlaying(self) -> bool:
+        return self.timer.isActive()
+
+    def play(self):
+        self.timer.start(0)
+
+    def pause(self):
+        self.timer.stop()
+
+    def step(self):
+        start = time.perf_counter()
+        self.seek((self.frame + 1) % self.series.numFrames)
+        remaining = self.interval - (time.perf_counter() - start)
+        self.timer.start(max(int(remaining * 1000), 0))
+
+    def seek(self, t: int):
+        """Shows frame t, only this frame is read when it was not prefetched"""
+        start = time.perf_counter()
+        self.frame = min(max(t, 0), self.series.numFrames - 1)
+        self.apply(self.prefetcher.get(self.frame))
+        self.frameSeconds = time.perf_counter() - start
+        self.frameChanged.emit(self.frame)
+
+    def stop(self):
+        self.pause()
+        self.prefetcher.shutdown()
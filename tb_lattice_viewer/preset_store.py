@@ -0,0 +1,159 @@
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from tb_lattice_viewer.snapshots import freeze
+
+SQLITE_SUFFIXES = [".sqlite", ".sqlite3", ".db"]
+DIGITS_PATTERN = re.compile(r"(\d+)")
+
+
+def naturalSortKey(name: str) -> str:
+    """String key which orders "dot2" before "dot10" with plain string comparison"""
+    chunks = DIGITS_PATTERN.split(name)
+    return "".join(c.zfill(20) if c.isdigit() else c for c in chunks)
+
+
+class SqlitePresetsStore:
+    """Presets stored in SQLite, names are read per category in the natural
+    order from an index, preset bodies are parsed on first access. Cached
+    bodies are frozen, so callers cannot modify them. The connection and the
+    caches are shared by all threads, like the server request handlers, and
+    are used under a lock."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS presets (
+                category TEXT NOT NULL,
+                name TEXT NOT NULL,
+                sort_key TEXT NOT NULL,
+                body TEXT NOT NULL,
+                PRIMARY KEY (category, name)
+            );
+            CREATE INDEX IF NOT EXISTS presets_sort_key
+                ON presets (category, sort_key);
+            CREATE TABLE IF NOT EXISTS categories (
+                category TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            """
+        )
+        self.namesCache: Dict[str, List[str]] = {}
+        self.bodiesCache: Dict[str, Dict[str, Any]] = {}
+        self.dataVersion = self.readDataVersion()
+        self.versions = self.readVersions()
+
+    def readDataVersion(self) -> int:
+        with self.lock:
+            # changes only when other connections commit to the database
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def readVersions(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.connection.execute("SELECT category, version FROM categories")
+            return dict(rows.fetchall())
+
+    def bumpVersion(self, category: str):
+        self.connection.execute(
+            "INSERT INTO categories (category, version) VALUES (?, 1) "
+            "ON CONFLICT (category) DO UPDATE SET version = version + 1",
+            (category,),
+        )
+        self.versions[category] = self.versions.get(category, 0) + 1
+
+    def changedCategories(self) -> Set[str]:
+        """Categories modified by other processes since the last check"""
+        with self.lock:
+            dataVersion = self.readDataVersion()
+            if dataVersion == self.dataVersion:
+                return set()
+            self.dataVersion = dataVersion
+            versions = self.readVersions()
+            changed = {
+                category
+                for category in set(versions) | set(self.versions)
+                if versions.get(category) != self.versions.get(category)
+            }
+            self.versions = versions
+            for category in changed:
+                self.namesCache.pop(category, None)
+                self.bodiesCache.pop(category, None)
+            return changed
+
+    def names(self, category: str) -> List[str]:
+        with self.lock:
+            if category not in self.namesCache:
+                rows = self.connection.execute(
+                    "SELECT name FROM presets WHERE category = ? ORDER BY sort_key",
+                    (category,),
+                )
+                self.namesCache[category] = [name for name, in rows]
+            return list(self.namesCache[category])
+
+    def getPreset(self, category: str, name: str) -> Dict[str, Any]:
+        with self.lock:
+            bodies = self.bodiesCache.setdefault(category, {})
+            if name not in bodies:
+                row = self.connection.execute(
+                    "SELECT body FROM presets WHERE category = ? AND name = ?",
+                    (category, name),
+                ).fetchone()
+                if row is None:
+                    return {}
+                bodies[name] = freeze(json.loads(row[0]))
+            return bodies[name]
+
+    def getPresets(self, category: str) -> Dict[str, Any]:
+        with self.lock:
+            names = self.names(category)
+            return {name: self.getPreset(category, name) for name in names}
+
+    def updatePreset(self, category: str, name: str, config: Dict[str, Any]):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO presets (category, name, sort_key, body) "
+                    "VALUES (?, ?, ?, ?)",
+                    (category, name, naturalSortKey(name), json.dumps(config)),
+                )
+                self.bumpVersion(category)
+            self.namesCache.pop(category, None)
+            # unchanged parts are shared with the previous version of the preset
+            bodies = self.bodiesCache.setdefault(category, {})
+            bodies[name] = freeze(config, bodies.get(name))
+
+    def deletePreset(self, category: str, name: str):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "DELETE FROM presets WHERE category = ? AND name = ?",
+                    (category, name),
+                )
+                self.bumpVersion(category)
+            self.namesCache.pop(category, None)
+            self.bodiesCache.get(category, {}).pop(name, None)
+
+    def importPresets(self, presets: Dict[str, Dict[str, Any]]):
+        with self.lock:
+            rows = [
+                (category, name, naturalSortKey(name), json.dumps(config))
+                for category, items in presets.items()
+                for name, config in items.items()
+            ]
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO presets (category, name, sort_key, body) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                for category in presets:
+                    self.bumpVersion(category)
+            self.namesCache.clear()
+            self.bodiesCache.clear()
@@ -1,62 +1,284 @@
 import json
+import os
+import stat
+import tempfile
+import weakref
 from abc import abstractmethod
 from collections import defaultdict
-from copy import deepcopy
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+from PyQt5.QtCore import QCoreApplication, QTimer
 from PyQt5.QtWidgets import *
-from natsort import natsorted
 
+from tb_lattice_viewer.preset_store import (
+    SQLITE_SUFFIXES,
+    SqlitePresetsStore,
+    naturalSortKey,
+)
+from tb_lattice_viewer.snapshots import freeze
 from tb_lattice_viewer.widgets import ParamsListDialog
 
 
 class PresetsManager:
     savePath: Path = Path("presets.json")
     presets = defaultdict(dict)
+    # saves requested within saveDelayMs are written to the file once
+    saveDelayMs: int = 500
+    saveTimer: Optional[QTimer] = None
+    # category -> name -> config (None when deleted) not written to the file yet
+    localChanges: Dict[str, Dict[str, Optional[Dict[str, Any]]]] = {}
+    # (category, name) -> (frozen config, its json text), presets are frozen so
+    # a cached text is valid while the preset is the same object
+    serializedPresets: Dict[Tuple[str, str], Tuple[Dict[str, Any], str]] = {}
+    sortedNames: Dict[str, List[str]] = {}
+    # used instead of the json file when the config path is an sqlite database
+    store: Optional[SqlitePresetsStore] = None
+    # (mtime, size) of the file when it was last read or written by us
+    fileStat: Optional[Tuple[int, int]] = None
+    watchIntervalMs: int = 2000
+    watchTimer: Optional[QTimer] = None
+    listeners: Dict[str, List[weakref.WeakMethod]] = defaultdict(list)
 
     @classmethod
     def getPresets(cls, category: str) -> Dict[str, Any]:
+        if cls.store is not None:
+            return cls.store.getPresets(category)
         return cls.presets.get(category, {})
 
     @classmethod
     def getPreset(cls, category: str, name: str) -> Dict[str, Any]:
+        cls.checkForChanges()
+        if cls.store is not None:
+            return cls.store.getPreset(category, name)
         return cls.getPresets(category).get(name, {})
 
     @classmethod
     def getPresetsNames(cls, category: str) -> List[str]:
-        return natsorted(cls.getPresets(category).keys())
+        cls.checkForChanges()
+        if cls.store is not None:
+            return cls.store.names(category)
+        if category not in cls.sortedNames:
+            names = cls.getPresets(category).keys()
+            cls.sortedNames[category] = sorted(names, key=naturalSortKey)
+        return list(cls.sortedNames[category])
 
     @classmethod
     def deletePreset(cls, category: str, name: str):
+        if cls.store is not None:
+            cls.store.deletePreset(category, name)
+            return
         if category in cls.presets:
             if name in cls.presets[category]:
                 del cls.presets[category][name]
+        cls.sortedNames.pop(category, None)
+        cls.localChanges.setdefault(category, {})[name] = None
         cls.save()
 
     @classmethod
     def updatePreset(cls, category: str, name: str, config: Dict[str, Any]):
         print(f"Updating preset: {category}: {name}")
+        if cls.store is not None:
+            # the store freezes the config against its previous version
+            cls.store.updatePreset(category, name, config)
+            return
         if category not in cls.presets:
             cls.presets[category] = {}
-        cls.presets[category][name] = deepcopy(config)
+        if name not in cls.presets[category]:
+            cls.sortedNames.pop(category, None)
+        # unchanged parts are shared with the previous version of the preset
+        cls.presets[category][name] = freeze(config, cls.presets[category].get(name))
+        cls.localChanges.setdefault(category, {})[name] = cls.presets[category][name]
         cls.save()
 
+    @classmethod
+    def subscribe(cls, category: str, callback: Callable[[], None]):
+        """Callback is called when presets of the category were changed by
+        another process, only a weak reference to the bound method is kept"""
+        cls.listeners[category].append(weakref.WeakMethod(callback))
+
+    @classmethod
+    def notify(cls, categories: Set[str]):
+        for category in categories:
+            alive = []
+            for ref in cls.listeners.get(category, []):
+                callback = ref()
+                if callback is None:
+                    continue
+                try:
+                    callback()
+                    alive.append(ref)
+                except RuntimeError:
+                    # underlying Qt widget was already deleted
+                    pass
+            cls.listeners[category] = alive
+
+    @classmethod
+    def checkForChanges(cls) -> Set[str]:
+        """Cheap stat of the file, external changes are merged per category"""
+        if cls.store is not None:
+            changed = cls.store.changedCategories()
+        else:
+            fileStat = statFile(cls.savePath)
+            if fileStat is None or fileStat == cls.fileStat:
+                return set()
+            try:
+                with open(cls.savePath, "r") as file:
+                    external = json.load(file)
+            except (OSError, ValueError) as error:
+                # file is being written by another process, fileStat is kept so
+                # the next check reads it again, presets in memory are kept
+                print(f"Cannot read presets: {cls.savePath}: {error}")
+                return set()
+            cls.fileStat = fileStat
+            changed = cls.mergeExternal(external)
+
+        if changed:
+            print(f"Presets changed externally: {sorted(changed)}")
+            cls.notify(changed)
+        return changed
+
+    @classmethod
+    def mergeExternal(cls, external: Dict[str, Dict[str, Any]]) -> Set[str]:
+        changed = set()
+        for category in set(external) | set(cls.presets):
+            current = cls.presets.get(category, {})
+            merged = {
+                name: freeze(config, current.get(name))
+                for name, config in external.get(category, {}).items()
+            }
+            for name, config in cls.localChanges.get(category, {}).items():
+                if config is None:
+                    merged.pop(name, None)
+                else:
+                    merged[name] = config
+            # frozen presets equal to the current ones are the same objects
+            if merged.keys() != current.keys() or any(
+                merged[name] is not current[name] for name in merged
+            ):
+                cls.presets[category] = merged
+                cls.sortedNames.pop(category, None)
+                changed.add(category)
+        return changed
+
     @classmethod
     def save(cls):
+        app = QCoreApplication.instance()
+        if app is None:
+            cls.flush()
+            return
+        if cls.saveTimer is None:
+            cls.saveTimer = QTimer()
+            cls.saveTimer.setSingleShot(True)
+            cls.saveTimer.timeout.connect(cls.flush)
+            app.aboutToQuit.connect(cls.flush)
+        cls.saveTimer.start(cls.saveDelayMs)
+
+    @classmethod
+    def flush(cls):
+        if cls.saveTimer is not None:
+            cls.saveTimer.stop()
+        if not cls.localChanges:
+            return
+
+        # do not overwrite presets saved by others since the last read
+        cls.checkForChanges()
+
         print(f"Saving presets: {cls.savePath}")
-        with open(cls.savePath, "w") as file:
-            json.dump(cls.presets, file, indent=2)
+        cls.localChanges = {}
+        writeAtomically(Path(cls.savePath), cls.serialize())
+        cls.fileStat = statFile(cls.savePath)
+
+    @classmethod
+    def serialize(cls) -> List[str]:
+        """Parts of the same text as json.dumps(presets, indent=2), only the
+        presets which changed since the last save are dumped again"""
+        if not cls.presets:
+            return ["{}"]
+        serialized = {}
+        parts = []
+        for category, presets in cls.presets.items():
+            parts += [",\n  " if parts else "{\n  ", json.dumps(category), ": "]
+            if not presets:
+                parts.append("{}")
+                continue
+            for index, (name, config) in enumerate(presets.items()):
+                key = (category, name)
+                cached = cls.serializedPresets.get(key)
+                if cached is None or cached[0] is not config:
+                    text = json.dumps(config, indent=2).replace("\n", "\n    ")
+                    cached = (config, f"{json.dumps(name)}: {text}")
+                serialized[key] = cached
+                parts += [",\n    " if index else "{\n    ", cached[1]]
+            parts.append("\n  }")
+        parts.append("\n}")
+        # deleted presets are dropped from the cache
+        cls.serializedPresets = serialized
+        return parts
+
+    @classmethod
+    def watch(cls):
+        app = QCoreApplication.instance()
+        if app is None or cls.watchTimer is not None:
+            return
+        cls.watchTimer = QTimer()
+        cls.watchTimer.timeout.connect(cls.checkForChanges)
+        cls.watchTimer.start(cls.watchIntervalMs)
 
     @classmethod
     def load(cls, savePath: Path):
         cls.savePath = savePath
+        cls.localChanges = {}
+        cls.serializedPresets = {}
+        cls.sortedNames = {}
+        cls.store = None
+        cls.fileStat = None
         print(f"Loading presets: {cls.savePath}")
+        cls.watch()
+        if Path(savePath).suffix.lower() in SQLITE_SUFFIXES:
+            cls.store = SqlitePresetsStore(savePath)
+            return
         if not Path(cls.savePath).exists():
             return
+        cls.fileStat = statFile(cls.savePath)
         with open(cls.savePath, "r") as file:
-            cls.presets = json.load(file)
+            cls.presets = {
+                category: {name: freeze(config) for name, config in presets.items()}
+                for category, presets in json.load(file).items()
+            }
+
+
+def statFile(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return result.st_mtime_ns, result.st_size
+
+
+def writeAtomically(path: Path, parts: Iterable[str]):
+    """Writes to a temporary file in the same directory and renames it, so
+    readers never see a partially written file"""
+    fd, tmpPath = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        # the file object owns the descriptor, it is closed on any error
+        with os.fdopen(fd, "w") as file:
+            # keep permissions of the shared file, mkstemp creates it as 0600
+            if path.exists():
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+            os.chmod(tmpPath, mode)
+            file.writelines(parts)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
 
 
 class PresetComboActionType(Enum):
@@ -70,11 +292,6 @@ class PropertyWidget(QWidget):
     def __init__(self, presetName: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.category = presetName
-        self.dialog = ParamsListDialog(
-            PresetsManager.getPresetsNames(self.category),
-            allow_add=False,
-            allow_delete=False,
-        )
 
     def buildUI(self):
         presetLayout = self.buildPresetLayout()
@@ -90,6 +307,7 @@ class PropertyWidget(QWidget):
         self.addPresetButton = QPushButton("Add")
 
         self.presetsCombo.currentIndexChanged.connect(self.presetSelected)
+        PresetsManager.subscribe(self.category, self.refreshPresets)
         self.savePresetButton.pressed.connect(self.savePreset)
         self.addPresetButton.pressed.connect(self.addPreset)
         self.deletePresetButton.pressed.connect(self.deletePreset)
@@ -174,6 +392,15 @@ class PropertyWidget(QWidget):
         if name is not None:
             self.presetsCombo.setCurrentText(name)
 
+    def refreshPresets(self):
+        """Updates names without selecting a preset, current edits are kept"""
+        current = self.presetsCombo.currentText()
+        self.presetsCombo.blockSignals(True)
+        self.presetsCombo.clear()
+        self.presetsCombo.addItems(PresetsManager.getPresetsNames(self.category))
+        self.presetsCombo.setCurrentText(current)
+        self.presetsCombo.blockSignals(False)
+
     @abstractmethod
     def getConfig(self):
         return {}
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+# oldest spans are dropped above this, long running processes record spans
+# without ever clearing them
+MAX_SPANS = 10000
+
+
+class Span(NamedTuple):
+    name: str
+    category: str
+    start: float  # seconds, time.perf_counter
+    duration: float  # seconds
+    threadId: int
+
+
+class Profiler:
+    """Collects named timing spans, cheap enough to be always enabled"""
+
+    def __init__(self, maxSpans: int = MAX_SPANS):
+        self.spans: Deque[Span] = deque(maxlen=maxSpans)
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str = "default"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter() - start)
+
+    def record(self, name: str, category: str, start: float, duration: float):
+        span = Span(name, category, start, duration, threading.get_ident())
+        with self.lock:
+            self.spans.append(span)
+
+    def clear(self, category: Optional[str] = None):
+        with self.lock:
+            if category is None:
+                self.spans.clear()
+            else:
+                self.spans = deque(
+                    (span for span in self.spans if span.category != category),
+                    maxlen=self.spans.maxlen,
+                )
+
+    def spansOf(self, category: str) -> List[Span]:
+        with self.lock:
+            return [span for span in self.spans if span.category == category]
+
+    def summary(self, category: str) -> str:
+        spans = self.spansOf(category)
+        if not spans:
+            return ""
+        width = max(len(span.name) for span in spans)
+        lines = [
+            f"{span.name:<{width}} : {span.duration * 1000:9.1f} ms" for span in spans
+        ]
+        return "\n".join(lines)
+
+    def chromeTrace(self, category: Optional[str] = None) -> Dict[str, Any]:
+        """Spans as complete events of the Chrome trace format, can be opened
+        in chrome://tracing or https://ui.perfetto.dev"""
+        with self.lock:
+            spans = [s for s in self.spans if category in (None, s.category)]
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start - self.origin) * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": pid,
+                "tid": span.threadId,
+            }
+            for span in spans
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def exportChromeTrace(self, path: Path, category: Optional[str] = None):
+        with open(path, "w") as file:
+            json.dump(self.chromeTrace(category), file)
+        print(f"Trace saved to: {path}")
+
+
+profiler = Profiler()
@@ -1,61 +1,205 @@
+import time
+from typing import Callable, Optional
+
+import numpy
+
 from PyQt5 import QtCore
-from PyQt5.Qt3DCore import *
-from PyQt5.Qt3DExtras import *
-from PyQt5.Qt3DRender import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
+from tb_lattice_viewer.picking import PickedSite, SitePicker
+from tb_lattice_viewer.playback import PLAYBACK_FPS, Playback, TimeSeries
+from tb_lattice_viewer.profiling import profiler
+from tb_lattice_viewer.scene import SceneStats
+
 
 class RenderWidget(QWidget):
+	"""Qt3D is imported and the 3D window is created after the main window is
+	shown for the first time, so it does not delay the startup"""
+
+	# emitted when the first frame of the scene passed to setScene is rendered
+	firstFrameRendered = pyqtSignal()
+	# PickedSite clicked in the view
+	sitePicked = pyqtSignal(object)
+
+	# render only when the camera or the scene changes instead of continuously
+	onDemand: bool = True
+	# frame rate cap, applied with the swap interval when the view is created
+	maxFps: Optional[float] = None
+
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.view = Qt3DWindow()
+		self.view = None
+		self.scene = None
+		self.camera = None
+		self.renderCapture = None
+		self.captureReply = None
 
-		self.widget = QWidget.createWindowContainer(self.view, self)
-		self.scene = QEntity()
+		# render statistics, logic ticks are sampled only when the stats are
+		# shown. Qt3DWindow has no frame swapped signal and the logic aspect
+		# ticks also when OnDemand renders nothing, so ticks are not frames.
+		# SceneStats or an object updating its stats, like a tiled scene
+		self.sceneStats = None
+		self.statsFrameAction = None
+		self.frameCount = 0
+		self.frameTimeSum = 0.0
+		self.frameTimeMax = 0.0
+		self.statsTimer = QTimer(self)
+		self.statsTimer.setInterval(500)
+		self.statsTimer.timeout.connect(self.updateStats)
 
-		# self.picker = QObjectPicker(self.scene)
-		# self.picker.setHoverEnabled(True)
-		# self.picker.setDragEnabled(True)
-		# self.scene.addComponent(self.picker)
+		self.statsButton = QPushButton("Stats")
+		self.statsButton.setCheckable(True)
+		self.statsButton.setToolTip("Show render statistics (F3)")
+		self.statsButton.setShortcut(QKeySequence(Qt.Key_F3))
+		self.statsButton.toggled.connect(self.setStatsVisible)
+		self.statsLabel = QLabel()
+		self.statsLabel.setVisible(False)
 
-		# camera
-		self.camera: QCamera = self.view.camera()
-		self.camera.lens().setPerspectiveProjection(45.0, 16.0 / 9.0, 0.1, 1000)
-		self.camera.setPosition(QVector3D(0, 0, 1))
-		self.camera.setNearPlane(0.01)
-		self.camera.setViewCenter(QVector3D(0, 0, 0))
+		# sites under the mouse are found on the CPU, see picking.SitePicker
+		self.picker: Optional[SitePicker] = None
+		self.pressPosition: Optional[QPoint] = None
+		self.pickLabel = QLabel()
 
-		# for camera control
-		camController = QFirstPersonCameraController(self.scene)
-		camController.setCamera(self.camera)
-		self.view.setRootEntity(self.scene)
+		self.onDemandButton = QPushButton("On demand")
+		self.onDemandButton.setCheckable(True)
+		self.onDemandButton.setChecked(self.onDemand)
+		self.onDemandButton.setToolTip(
+			"Redraw only when the camera or the scene changes, "
+			"otherwise the view is redrawn continuously"
+		)
+		self.onDemandButton.toggled.connect(self.setOnDemand)
+
+		toolbarLayout = QHBoxLayout()
+		toolbarLayout.addWidget(self.statsLabel, 1)
+		toolbarLayout.addWidget(self.pickLabel, 1)
+		toolbarLayout.addStretch()
+		toolbarLayout.addWidget(self.onDemandButton)
+		toolbarLayout.addWidget(self.statsButton)
+
+		# time series playback, shown when a series is set
+		self.playback: Optional[Playback] = None
+		self.playButton = QPushButton("Play")
+		self.playButton.setCheckable(True)
+		self.playButton.toggled.connect(self.setPlaying)
+		self.timelineSlider = QSlider(Qt.Horizontal)
+		self.timelineSlider.valueChanged.connect(self.seekFrame)
+		self.frameLabel = QLabel()
+		self.fpsSpinBox = QSpinBox()
+		self.fpsSpinBox.setRange(1, 240)
+		self.fpsSpinBox.setValue(PLAYBACK_FPS)
+		self.fpsSpinBox.setSuffix(" fps")
+		self.fpsSpinBox.valueChanged.connect(self.setPlaybackFps)
+
+		self.playbackBar = QWidget()
+		playbackLayout = QHBoxLayout()
+		playbackLayout.setContentsMargins(0, 0, 0, 0)
+		playbackLayout.addWidget(self.playButton)
+		playbackLayout.addWidget(self.timelineSlider, 1)
+		playbackLayout.addWidget(self.frameLabel)
+		playbackLayout.addWidget(self.fpsSpinBox)
+		self.playbackBar.setLayout(playbackLayout)
+		self.playbackBar.setVisible(False)
+
+		self.placeholder = QLabel("Initializing 3D view ...")
+		self.placeholder.setAlignment(Qt.AlignCenter)
 		layout = QVBoxLayout()
-		layout.addWidget(self.widget)
+		layout.addLayout(toolbarLayout)
+		layout.addWidget(self.placeholder)
+		layout.addWidget(self.playbackBar)
 		self.setLayout(layout)
 
-		renderSettings: QRenderSettings = self.view.renderSettings()
-		renderCapabilities: QRenderCapabilities = renderSettings.renderCapabilities()
-		print("renderSettings            :", renderSettings.activeFrameGraph())
-		print("renderPolicy			     :", renderSettings.renderPolicy())
-		print("renderCapabilities.profile:", renderCapabilities.profile())
+	def showEvent(self, event):
+		super().showEvent(event)
+		if self.view is None:
+			QTimer.singleShot(0, self.initializeView)
+
+	def initializeView(self):
+		if self.view is not None:
+			return
+
+		with profiler.span("import Qt3D", "startup"):
+			from PyQt5.Qt3DCore import QEntity
+			from PyQt5.Qt3DExtras import Qt3DWindow, QFirstPersonCameraController
+			from PyQt5.Qt3DRender import QCamera, QRenderSettings, QRenderCapabilities
+			from PyQt5.Qt3DRender import QRenderCapture
+
+		with profiler.span("RenderWidget.initializeView", "startup"):
+			self.view = Qt3DWindow()
+			self.view.installEventFilter(self)
+			if self.maxFps is not None:
+				self.view.setFormat(self.cappedFormat(self.view.format(), self.maxFps))
+
+			self.widget = QWidget.createWindowContainer(self.view, self)
+			self.scene = QEntity()
+
+			# a capture completes after its frame was rendered, the default frame
+			# graph is drawn under it
+			self.renderCapture = QRenderCapture()
+			self.view.activeFrameGraph().setParent(self.renderCapture)
+			self.view.setActiveFrameGraph(self.renderCapture)
+
+			# camera
+			self.camera: QCamera = self.view.camera()
+			self.camera.lens().setPerspectiveProjection(45.0, 16.0 / 9.0, 0.1, 1000)
+			self.camera.setPosition(QVector3D(0, 0, 1))
+			self.camera.setNearPlane(0.01)
+			self.camera.setViewCenter(QVector3D(0, 0, 0))
+
+			# for camera control
+			camController = QFirstPersonCameraController(self.scene)
+			camController.setCamera(self.camera)
+			self.view.setRootEntity(self.scene)
+
+			layout = self.layout()
+			index = layout.indexOf(self.placeholder)
+			layout.removeWidget(self.placeholder)
+			self.placeholder.deleteLater()
+			layout.insertWidget(index, self.widget)
+
+			renderSettings: QRenderSettings = self.view.renderSettings()
+			self.setOnDemand(self.onDemandButton.isChecked())
+			renderCapabilities: QRenderCapabilities = renderSettings.renderCapabilities()
+			print("renderSettings            :", renderSettings.activeFrameGraph())
+			print("renderPolicy			     :", renderSettings.renderPolicy())
+			print("renderCapabilities.profile:", renderCapabilities.profile())
+
+	@staticmethod
+	def cappedFormat(surfaceFormat: QSurfaceFormat, maxFps: float) -> QSurfaceFormat:
+		"""Qt3D renders in sync with the display, the frame rate is capped by
+		swapping buffers every n-th vertical refresh"""
+		refreshRate = QGuiApplication.primaryScreen().refreshRate() or 60.0
+		swapInterval = max(1, round(refreshRate / maxFps))
+		surfaceFormat.setSwapInterval(swapInterval)
+		print(f"Frame rate cap: {refreshRate / swapInterval:.0f} fps")
+		return surfaceFormat
 
-		# picking_settings: QPickingSettings = render_settings.pickingSettings()
-		# picking_settings.setFaceOrientationPickingMode(QPickingSettings.FrontFace)
-		# picking_settings.setPickMethod(QPickingSettings.BoundingVolumePicking)
-		# picking_settings.setPickResultMode(QPickingSettings.NearestPick)
+	def setOnDemand(self, onDemand: bool):
+		from PyQt5.Qt3DRender import QRenderSettings
 
-		# self.picker.pressed.connect(self.clicked)
-		# self.picker.clicked.connect(self.clicked)
-		# self.picker.moved.connect(self.clicked)
+		if self.view is None:
+			return
+		policy = QRenderSettings.OnDemand if onDemand else QRenderSettings.Always
+		self.view.renderSettings().setRenderPolicy(policy)
 
 	def setScene(self, sceneFn):
+		from PyQt5.Qt3DExtras import QOrbitCameraController
+
+		self.initializeView()
 		c = self.scene.children()
 		for e in c:
 			e.deleteLater()
+		self.captureReply = None
+		self.statsFrameAction = None
+		self.picker = None
+		self.pickLabel.setText("")
 
-		sceneFn(self.scene)
+		stats = sceneFn(self.scene, self.camera)
+		if isinstance(stats, SceneStats) or hasattr(stats, "sceneStats"):
+			self.sceneStats = stats
+		else:
+			self.sceneStats = None
 		camController = QOrbitCameraController(self.scene)
 		camController.setLinearSpeed(2.0)
 		camController.setLookSpeed(2.0)
@@ -64,9 +208,178 @@ class RenderWidget(QWidget):
 		camController.setAcceleration(5)
 		camController.setDeceleration(10)
 		camController.setCamera(self.camera)
+		self.waitForFirstFrame()
+		if self.statsButton.isChecked():
+			self.startFrameSampling()
+			self.updateStats()
+
+	def waitForFirstFrame(self):
+		"""Records time from now to the end of the next rendered frame as the
+		"first frame" span, the frame is captured so its end is known"""
+		start = time.perf_counter()
+		reply = self.renderCapture.requestCapture()
+		self.captureReply = reply
+
+		def frameRendered():
+			reply.deleteLater()
+			# a newer scene was set in the meantime
+			if self.captureReply is not reply:
+				return
+			self.captureReply = None
+			profiler.record("first frame", "pipeline", start, time.perf_counter() - start)
+			self.firstFrameRendered.emit()
+
+		reply.completed.connect(frameRendered)
+
+	def setStatsVisible(self, visible: bool):
+		self.statsLabel.setVisible(visible)
+		if visible:
+			self.startFrameSampling()
+			self.statsTimer.start()
+			self.updateStats()
+		else:
+			self.statsTimer.stop()
+			self.stopFrameSampling()
+
+	def startFrameSampling(self):
+		from PyQt5.Qt3DLogic import QFrameAction
+
+		if self.scene is None or self.statsFrameAction is not None:
+			return
+		self.frameCount, self.frameTimeSum, self.frameTimeMax = 0, 0.0, 0.0
+		self.statsFrameAction = QFrameAction(self.scene)
+		self.statsFrameAction.triggered.connect(self.frameSampled)
+		self.scene.addComponent(self.statsFrameAction)
+
+	def stopFrameSampling(self):
+		if self.statsFrameAction is None:
+			return
+		self.scene.removeComponent(self.statsFrameAction)
+		self.statsFrameAction.deleteLater()
+		self.statsFrameAction = None
+
+	def frameSampled(self, dt: float):
+		self.frameCount += 1
+		self.frameTimeSum += dt
+		self.frameTimeMax = max(self.frameTimeMax, dt)
+
+	def updateStats(self):
+		if self.frameCount > 0:
+			tickTime = self.frameTimeSum / self.frameCount
+			rate = 1 / max(tickTime, 1e-6)
+			maxTime = self.frameTimeMax * 1000
+			parts = [
+				f"logic tick {tickTime * 1000:.1f} ms "
+				f"(max {maxTime:.1f} ms, {rate:.0f}/s)"
+			]
+		else:
+			parts = ["logic tick: idle"]
+		if self.onDemandButton.isChecked():
+			parts.append("on demand: frames rendered only on changes")
+		self.frameCount, self.frameTimeSum, self.frameTimeMax = 0, 0.0, 0.0
+
+		stats = self.sceneStats
+		if stats is not None and not isinstance(stats, SceneStats):
+			stats = stats.sceneStats()
+		if stats is not None:
+			parts += [
+				f"entities {stats.entities:,}",
+				f"instances {stats.instances:,}",
+				f"triangles {stats.triangles:,}",
+				f"buffers {stats.bufferBytes / 2 ** 20:.2f} MB",
+			]
+		self.statsLabel.setText(" | ".join(parts))
+
+	def setTimeSeries(
+		self, series: Optional[TimeSeries], apply: Callable[[numpy.ndarray], None]
+	):
+		"""Plays the frames of series by passing their values to apply, None
+		hides the timeline"""
+		if self.playback is not None:
+			self.playback.stop()
+			self.playback.deleteLater()
+			self.playback = None
+		self.playButton.setChecked(False)
+		self.playbackBar.setVisible(series is not None)
+		if series is None:
+			return
+
+		self.playback = Playback(series, apply, self.fpsSpinBox.value(), parent=self)
+		self.playback.frameChanged.connect(self.showFrame)
+		self.timelineSlider.blockSignals(True)
+		self.timelineSlider.setRange(0, series.numFrames - 1)
+		self.timelineSlider.setValue(0)
+		self.timelineSlider.blockSignals(False)
+		self.playback.seek(0)
+		print(f"Time series: {series.numFrames} frames of {series.numSites} sites")
+
+	def setPlaying(self, playing: bool):
+		if self.playback is None:
+			return
+		if playing:
+			self.playback.play()
+		else:
+			self.playback.pause()
+		self.playButton.setText("Pause" if playing else "Play")
+
+	def setPlaybackFps(self, fps: int):
+		if self.playback is not None:
+			self.playback.setFps(fps)
+
+	def seekFrame(self, frame: int):
+		if self.playback is not None and frame != self.playback.frame:
+			self.playback.seek(frame)
+
+	def showFrame(self, frame: int):
+		self.timelineSlider.blockSignals(True)
+		self.timelineSlider.setValue(frame)
+		self.timelineSlider.blockSignals(False)
+		numFrames = self.playback.series.numFrames
+		seconds = self.playback.frameSeconds * 1000
+		self.frameLabel.setText(f"{frame + 1}/{numFrames} ({seconds:.1f} ms)")
 
 	def sizeHint(self) -> QtCore.QSize:
 		return QSize(800, 600)
 
-	def clicked(self, event: QPickEvent, *args, **kwargs):
-		print("clicked - not implemented", event.objectName())
\ No newline at end of file
+	def setSitePicker(self, picker: Optional[SitePicker]):
+		self.picker = picker
+		self.pickLabel.setText("")
+
+	def pickSite(self, position: QPoint) -> Optional[PickedSite]:
+		if self.picker is None or self.camera is None:
+			return None
+		return self.picker.pick(
+			self.camera,
+			position.x(),
+			position.y(),
+			self.view.width(),
+			self.view.height(),
+		)
+
+	def eventFilter(self, watched: QObject, event: QEvent) -> bool:
+		"""Hover over the view shows the site under the mouse, a click without
+		dragging the camera emits sitePicked"""
+		if watched is not self.view or self.picker is None:
+			return False
+		if event.type() == QEvent.MouseMove and event.buttons() == Qt.NoButton:
+			site = self.pickSite(event.pos())
+			self.pickLabel.setText("" if site is None else site.describe())
+		elif event.type() == QEvent.MouseButtonPress:
+			self.pressPosition = event.pos()
+		elif event.type() == QEvent.MouseButtonRelease and self.pressPosition:
+			moved = (event.pos() - self.pressPosition).manhattanLength()
+			self.pressPosition = None
+			if event.button() == Qt.LeftButton and moved <= 3:
+				self.clicked(event.pos())
+		return False
+
+	def clicked(self, position: QPoint):
+		start = time.perf_counter()
+		site = self.pickSite(position)
+		milliseconds = (time.perf_counter() - start) * 1000
+		if site is None:
+			self.pickLabel.setText("")
+			return
+		print(f"Picked {site.describe()} in {milliseconds:.2f} ms")
+		self.pickLabel.setText(site.describe())
+		self.sitePicked.emit(site)
@@ -0,0 +1,438 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy
+from PyQt5.QtGui import QColor, QVector3D
+
+from tb_lattice_viewer.lattice import LatticeSites
+
+SPHERE_RINGS = 10
+SPHERE_SLICES = 10
+# position, texture coordinate, normal and tangent floats of QSphereMesh vertex
+SPHERE_VERTEX_BYTES = (3 + 2 + 3 + 4) * 4
+# world matrix uniform of each entity transform
+TRANSFORM_BYTES = 16 * 4
+# float32 (x, y, z) of a site in the instance or point buffer
+POSITION_BYTES = 3 * 4
+# float32 (r, g, b) of a site in the color buffer
+COLOR_BYTES = 3 * 4
+POINT_SIZE = 6.0
+
+RENDER_MODES = ["spheres", "instanced", "points", "tiles"]
+
+INSTANCED_VERTEX_SHADER = """
+#version 150 core
+in vec3 vertexPosition;
+in vec3 vertexNormal;
+in vec3 instanceOffset;
+in vec3 instanceColor;
+out vec3 normal;
+out vec3 color;
+uniform mat4 modelViewProjection;
+uniform mat3 modelViewNormal;
+
+void main()
+{
+    normal = normalize(modelViewNormal * vertexNormal);
+    color = instanceColor;
+    gl_Position = modelViewProjection * vec4(vertexPosition + instanceOffset, 1.0);
+}
+"""
+
+INSTANCED_FRAGMENT_SHADER = """
+#version 150 core
+in vec3 normal;
+in vec3 color;
+out vec4 fragColor;
+
+void main()
+{
+    float light = 0.35 + 0.65 * max(dot(normalize(normal), vec3(0.0, 0.0, 1.0)), 0.0);
+    fragColor = vec4(color * light, 1.0);
+}
+"""
+
+POINTS_VERTEX_SHADER = """
+#version 150 core
+in vec3 vertexPosition;
+in vec3 vertexColor;
+out vec3 color;
+uniform mat4 modelViewProjection;
+uniform float pointSize;
+
+void main()
+{
+    color = vertexColor;
+    gl_Position = modelViewProjection * vec4(vertexPosition, 1.0);
+    gl_PointSize = pointSize;
+}
+"""
+
+POINTS_FRAGMENT_SHADER = """
+#version 150 core
+in vec3 color;
+out vec4 fragColor;
+
+void main()
+{
+    vec2 offset = gl_PointCoord * 2.0 - 1.0;
+    if (dot(offset, offset) > 1.0)
+        discard;
+    fragColor = vec4(color, 1.0);
+}
+"""
+
+
+class SceneStats(NamedTuple):
+    """Estimated cost of the scene, computed while it is built"""
+
+    entities: int
+    instances: int  # rendered objects, equal to entities without instancing
+    triangles: int  # submitted per frame
+    bufferBytes: int  # estimated GPU vertex, index and uniform buffers
+
+
+def sphereMeshSize(rings: int, slices: int) -> Tuple[int, int]:
+    """(vertices, triangles) of the QSphereMesh geometry"""
+    vertices = (rings + 1) * (slices + 1)
+    triangles = 2 * slices * (rings - 2) + 2 * slices
+    return vertices, triangles
+
+
+def spheresSceneStats(numSites: int, numTypes: int) -> SceneStats:
+    vertices, triangles = sphereMeshSize(SPHERE_RINGS, SPHERE_SLICES)
+    meshBytes = vertices * SPHERE_VERTEX_BYTES + triangles * 3 * 2
+    return SceneStats(
+        entities=numSites,
+        instances=numSites,
+        triangles=numSites * triangles,
+        bufferBytes=numTypes * meshBytes + numSites * TRANSFORM_BYTES,
+    )
+
+
+def instancedSceneStats(numSites: int, numTypes: int) -> SceneStats:
+    vertices, triangles = sphereMeshSize(SPHERE_RINGS, SPHERE_SLICES)
+    meshBytes = vertices * SPHERE_VERTEX_BYTES + triangles * 3 * 2
+    return SceneStats(
+        entities=numTypes,
+        instances=numSites,
+        triangles=numSites * triangles,
+        bufferBytes=numTypes * meshBytes + numSites * (POSITION_BYTES + COLOR_BYTES),
+    )
+
+
+def pointsSceneStats(numSites: int, numTypes: int) -> SceneStats:
+    return SceneStats(
+        entities=numTypes,
+        instances=numSites,
+        triangles=0,
+        bufferBytes=numSites * (POSITION_BYTES + COLOR_BYTES),
+    )
+
+
+class SceneFrame(NamedTuple):
+    """Maps lattice positions to the scene coordinates"""
+
+    origin: numpy.ndarray  # (3,)
+    scale: float
+
+    def apply(self, positions: numpy.ndarray) -> numpy.ndarray:
+        return (positions - self.origin) * self.scale
+
+    def invert(self, positions: numpy.ndarray) -> numpy.ndarray:
+        return positions / self.scale + self.origin
+
+
+def fitFrame(positions: numpy.ndarray) -> SceneFrame:
+    """Moves positions to the origin and scales them to the unit box"""
+    minPos, maxPos = positions.min(0), positions.max(0)
+    return SceneFrame(minPos, 1 / max(numpy.linalg.norm(maxPos - minPos), 1))
+
+
+def viewProjectionMatrix(camera: "QCamera", frame: SceneFrame) -> numpy.ndarray:
+    """(4, 4) matrix mapping lattice coordinates to the clip space of camera"""
+    projection = camera.projectionMatrix()
+    view = camera.viewMatrix()
+    # QMatrix4x4.data() is column major
+    matrix = numpy.array((projection * view).data()).reshape(4, 4).T
+    scale = numpy.eye(4) * frame.scale
+    scale[3, 3] = 1
+    scale[:3, 3] = -frame.origin * frame.scale
+    return matrix @ scale
+
+
+class ColorBuffers:
+    """Per site color buffers of a scene, recolored in place without rebuilding
+    its entities"""
+
+    def __init__(self):
+        self.buffers: List[Tuple["QBuffer", numpy.ndarray]] = []
+
+    def add(self, buffer: "QBuffer", siteIndices: numpy.ndarray):
+        """siteIndices are the indices of the buffer rows in the generated sites"""
+        self.buffers.append((buffer, siteIndices))
+
+    def clear(self):
+        self.buffers.clear()
+
+    def isEmpty(self) -> bool:
+        return len(self.buffers) == 0
+
+    def update(self, colors: numpy.ndarray):
+        """Uploads (numSites, 3) rgb colors in the order of the generated sites"""
+        from PyQt5.QtCore import QByteArray
+
+        for buffer, siteIndices in self.buffers:
+            data = numpy.ascontiguousarray(colors[siteIndices], dtype=numpy.float32)
+            buffer.setData(QByteArray(data.tobytes()))
+
+
+def createSpheresScene(
+    rootEntity: "QEntity",
+    sites: LatticeSites,
+    sizes: Sequence[float],
+    colors: Sequence[QColor],
+    frame: SceneFrame = None,
+    progress: bool = True,
+    colorBuffers: ColorBuffers = None,
+) -> SceneStats:
+    """One sphere entity per site, mesh and material are shared per site type.
+    Materials are per type, so the sites are not recolorable and colorBuffers
+    stays empty."""
+    from PyQt5.Qt3DCore import QEntity, QTransform
+    from PyQt5.Qt3DExtras import QSphereMesh, QGoochMaterial
+
+    frame = fitFrame(sites.positions) if frame is None else frame
+    norm = frame.scale
+    positions = frame.apply(sites.positions)
+
+    site2mesh = []
+    for size, color in zip(sizes, colors):
+        sphereMesh = QSphereMesh()
+        sphereMesh.setRadius(size * norm)
+        sphereMesh.setRings(SPHERE_RINGS)
+        sphereMesh.setSlices(SPHERE_SLICES)
+        material = QGoochMaterial(rootEntity)
+        material.setWarm(color)
+        material.setCool(QColor("white"))
+        site2mesh.append({"mesh": sphereMesh, "material": material})
+
+    items = zip(positions.tolist(), sites.siteTypes.tolist())
+    if progress:
+        from tqdm import tqdm
+
+        items = tqdm(items, total=sites.numSites)
+
+    for pos, siteType in items:
+        sphereEntity = QEntity(rootEntity)
+
+        sphereTransform = QTransform()
+        sphereTransform.setTranslation(QVector3D(*pos))
+
+        sphereEntity.addComponent(sphereTransform)
+        sphereEntity.addComponent(site2mesh[siteType]["mesh"])
+        sphereEntity.addComponent(site2mesh[siteType]["material"])
+
+    return spheresSceneStats(sites.numSites, len(site2mesh))
+
+
+def typeColors(count: int, color: QColor) -> numpy.ndarray:
+    """(count, 3) rgb rows of the site type color"""
+    return numpy.tile([color.redF(), color.greenF(), color.blueF()], (count, 1))
+
+
+def createShaderMaterial(
+    parent: "QNode",
+    vertexShader: str,
+    fragmentShader: str,
+    parameters: Dict[str, Any],
+    renderStates: Sequence["QRenderState"] = (),
+) -> "QMaterial":
+    """Material with a single OpenGL 3.2 technique for the forward renderer"""
+    from PyQt5.Qt3DRender import (
+        QEffect,
+        QFilterKey,
+        QGraphicsApiFilter,
+        QMaterial,
+        QParameter,
+        QRenderPass,
+        QShaderProgram,
+        QTechnique,
+    )
+
+    program = QShaderProgram()
+    program.setVertexShaderCode(vertexShader.encode("utf-8"))
+    program.setFragmentShaderCode(fragmentShader.encode("utf-8"))
+
+    renderPass = QRenderPass()
+    renderPass.setShaderProgram(program)
+    for renderState in renderStates:
+        renderPass.addRenderState(renderState)
+
+    technique = QTechnique()
+    apiFilter = technique.graphicsApiFilter()
+    apiFilter.setApi(QGraphicsApiFilter.OpenGL)
+    apiFilter.setProfile(QGraphicsApiFilter.CoreProfile)
+    apiFilter.setMajorVersion(3)
+    apiFilter.setMinorVersion(2)
+    filterKey = QFilterKey()
+    filterKey.setName("renderingStyle")
+    filterKey.setValue("forward")
+    technique.addFilterKey(filterKey)
+    technique.addRenderPass(renderPass)
+
+    effect = QEffect()
+    effect.addTechnique(technique)
+
+    material = QMaterial(parent)
+    material.setEffect(effect)
+    for name, value in parameters.items():
+        material.addParameter(QParameter(name, value))
+    return material
+
+
+def vectorAttribute(
+    geometry: "QGeometry", name: str, vectors: numpy.ndarray, divisor: int = 0
+) -> "QAttribute":
+    """Float32 (x, y, z) vertex attribute backed by its own buffer"""
+    from PyQt5.QtCore import QByteArray
+    from PyQt5.Qt3DRender import QAttribute, QBuffer
+
+    data = numpy.ascontiguousarray(vectors, dtype=numpy.float32)
+    buffer = QBuffer(geometry)
+    buffer.setData(QByteArray(data.tobytes()))
+
+    attribute = QAttribute(geometry)
+    attribute.setName(name)
+    attribute.setAttributeType(QAttribute.VertexAttribute)
+    attribute.setVertexBaseType(QAttribute.Float)
+    attribute.setVertexSize(3)
+    attribute.setByteStride(3 * data.itemsize)
+    attribute.setDivisor(divisor)
+    attribute.setCount(len(data))
+    attribute.setBuffer(buffer)
+    geometry.addAttribute(attribute)
+    return attribute
+
+
+def createInstancedScene(
+    rootEntity: "QEntity",
+    sites: LatticeSites,
+    sizes: Sequence[float],
+    colors: Sequence[QColor],
+    frame: SceneFrame = None,
+    colorBuffers: ColorBuffers = None,
+) -> SceneStats:
+    """One instanced sphere entity per site type, site positions are uploaded
+    once as per instance offsets. Per instance colors start with the type color,
+    their buffers are registered in colorBuffers."""
+    from PyQt5.Qt3DCore import QEntity
+    from PyQt5.Qt3DExtras import QSphereGeometry
+    from PyQt5.Qt3DRender import QGeometryRenderer
+
+    frame = fitFrame(sites.positions) if frame is None else frame
+    norm = frame.scale
+    positions = frame.apply(sites.positions)
+
+    for siteType, (size, color) in enumerate(zip(sizes, colors)):
+        siteIndices = numpy.flatnonzero(sites.siteTypes == siteType)
+        if len(siteIndices) == 0:
+            continue
+        offsets = positions[siteIndices]
+        entity = QEntity(rootEntity)
+        geometry = QSphereGeometry(entity)
+        geometry.setRadius(size * norm)
+        geometry.setRings(SPHERE_RINGS)
+        geometry.setSlices(SPHERE_SLICES)
+        offsetsAttribute = vectorAttribute(
+            geometry, "instanceOffset", offsets, divisor=1
+        )
+        colorAttribute = vectorAttribute(
+            geometry,
+            "instanceColor",
+            typeColors(len(siteIndices), color),
+            divisor=1,
+        )
+        if colorBuffers is not None:
+            colorBuffers.add(colorAttribute.buffer(), siteIndices)
+        # bounds of the instances, otherwise the single sphere is culled
+        geometry.setBoundingVolumePositionAttribute(offsetsAttribute)
+
+        renderer = QGeometryRenderer(entity)
+        renderer.setGeometry(geometry)
+        renderer.setInstanceCount(len(offsets))
+
+        material = createShaderMaterial(
+            entity,
+            INSTANCED_VERTEX_SHADER,
+            INSTANCED_FRAGMENT_SHADER,
+            {},
+        )
+        entity.addComponent(renderer)
+        entity.addComponent(material)
+
+    return instancedSceneStats(sites.numSites, len(sizes))
+
+
+def createPointsScene(
+    rootEntity: "QEntity",
+    sites: LatticeSites,
+    sizes: Sequence[float],
+    colors: Sequence[QColor],
+    frame: SceneFrame = None,
+    colorBuffers: ColorBuffers = None,
+) -> SceneStats:
+    """One point cloud entity per site type, drawn as round point sprites with
+    per point colors registered in colorBuffers"""
+    from PyQt5.Qt3DCore import QEntity
+    from PyQt5.Qt3DRender import QGeometry, QGeometryRenderer, QPointSize
+
+    frame = fitFrame(sites.positions) if frame is None else frame
+    positions = frame.apply(sites.positions)
+
+    for siteType, (size, color) in enumerate(zip(sizes, colors)):
+        siteIndices = numpy.flatnonzero(sites.siteTypes == siteType)
+        if len(siteIndices) == 0:
+            continue
+        points = positions[siteIndices]
+        entity = QEntity(rootEntity)
+        geometry = QGeometry(entity)
+        vectorAttribute(geometry, "vertexPosition", points)
+        colorAttribute = vectorAttribute(
+            geometry, "vertexColor", typeColors(len(siteIndices), color)
+        )
+        if colorBuffers is not None:
+            colorBuffers.add(colorAttribute.buffer(), siteIndices)
+
+        renderer = QGeometryRenderer(entity)
+        renderer.setGeometry(geometry)
+        renderer.setPrimitiveType(QGeometryRenderer.Points)
+        renderer.setVertexCount(len(points))
+
+        pointSize = QPointSize()
+        pointSize.setSizeMode(QPointSize.Programmable)
+        material = createShaderMaterial(
+            entity,
+            POINTS_VERTEX_SHADER,
+            POINTS_FRAGMENT_SHADER,
+            {"pointSize": POINT_SIZE * size},
+            [pointSize],
+        )
+        entity.addComponent(renderer)
+        entity.addComponent(material)
+
+    return pointsSceneStats(sites.numSites, len(sizes))
+
+
+SCENE_BUILDERS: Dict[str, Callable[..., SceneStats]] = {
+    "spheres": createSpheresScene,
+    "instanced": createInstancedScene,
+    "points": createPointsScene,
+}
+
+SCENE_STATS: Dict[str, Callable[[int, int], SceneStats]] = {
+    "spheres": spheresSceneStats,
+    "instanced": instancedSceneStats,
+    "points": pointsSceneStats,
+    # tiles are instanced, the estimator caps their memory with the tiles budget
+    "tiles": instancedSceneStats,
+}
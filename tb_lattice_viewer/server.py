@@ -0,0 +1,414 @@
+"""Local lattice generation service, run with:
+
+    lattice-viewer --serve /tmp/lattice.sock --workers 4
+    python -m tb_lattice_viewer.server --serve 8765 --config presets.json
+
+The address is a Unix socket path or a localhost port. Every message is a
+uint32 little endian length followed by a json header, followed by the raw
+bytes of the arrays listed in the header. A request header is
+
+    {"preset": "dot"} or {"config": {...}},
+    "window": [[xMin, yMin], [xMax, yMax]], "shells": 1, "constants": {...}
+
+and the response lists positions, site_types and cells, and rows, cols and
+shells of the bonds when shells > 0. Compiled kernels, generators and mask
+caches stay warm in the worker processes between requests.
+"""
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy
+
+from tb_lattice_viewer.kernels import (
+    Kernel,
+    buildSourceFromConfig,
+    compileKernel,
+    sourceHash,
+)
+from tb_lattice_viewer.lattice import (
+    Window,
+    asBasis,
+    findNeighbours,
+    generateLatticeSites,
+    latticeIndexRange,
+    latticeVectors,
+    neighbourOffsets,
+)
+from tb_lattice_viewer.mask_cache import MaskCache
+from tb_lattice_viewer.symmetry import symmetryOps
+from tb_lattice_viewer.sweep import presetConstants
+from tb_lattice_viewer.unit_cell import sitesFromConfig
+
+HEADER_LENGTH = struct.Struct("<I")
+# module name of kernels compiled from inline configs
+INLINE_MODULE = "inline_lattice"
+# generators with their mask caches kept warm by each worker process
+WORKER_GENERATORS = 8
+
+Address = Union[str, Tuple[str, int]]
+Arrays = Dict[str, numpy.ndarray]
+
+
+def parseAddress(text: str) -> Address:
+    """Port number on localhost or a Unix socket path"""
+    if text.isdigit():
+        return "127.0.0.1", int(text)
+    return text
+
+
+def receiveExactly(connection: socket.socket, size: int) -> Optional[bytes]:
+    chunks, remaining = [], size
+    while remaining > 0:
+        chunk = connection.recv(min(remaining, 2 ** 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def sendMessage(
+    connection: socket.socket, header: Dict[str, Any], arrays: Arrays = None
+):
+    arrays = {} if arrays is None else arrays
+    contiguous = {
+        name: numpy.ascontiguousarray(array) for name, array in arrays.items()
+    }
+    header = dict(header)
+    header["arrays"] = [
+        {"name": name, "dtype": array.dtype.str, "shape": list(array.shape)}
+        for name, array in contiguous.items()
+    ]
+    text = json.dumps(header).encode("utf-8")
+    connection.sendall(HEADER_LENGTH.pack(len(text)) + text)
+    for array in contiguous.values():
+        connection.sendall(memoryview(array).cast("B"))
+
+
+def receiveMessage(
+    connection: socket.socket,
+) -> Optional[Tuple[Dict[str, Any], Arrays]]:
+    """None when the other side closed the connection"""
+    prefix = receiveExactly(connection, HEADER_LENGTH.size)
+    if prefix is None:
+        return None
+    text = receiveExactly(connection, HEADER_LENGTH.unpack(prefix)[0])
+    if text is None:
+        return None
+    header = json.loads(text.decode("utf-8"))
+    arrays = {}
+    for spec in header.pop("arrays", []):
+        dtype = numpy.dtype(spec["dtype"])
+        size = int(numpy.prod(spec["shape"])) * dtype.itemsize
+        data = receiveExactly(connection, size) if size > 0 else b""
+        if data is None:
+            return None
+        arrays[spec["name"]] = numpy.frombuffer(data, dtype).reshape(spec["shape"])
+    return header, arrays
+
+
+class GenerationRequest(NamedTuple):
+    config: Dict[str, Any]
+    moduleName: str
+    source: str
+    window: Window
+    numShells: int
+    constants: Dict[str, Any]
+
+
+class LatticeGenerator:
+    """Kernel, symmetry and mask cache of one lattice config, kept by the
+    worker process for the following requests"""
+
+    def __init__(self, request: GenerationRequest, cacheDir: Optional[Path]):
+        lattice = request.config.get("lattice", {})
+        self.v1 = lattice.get("v1", (0, 1))
+        self.v2 = lattice.get("v2", (1, 0))
+        _, self.positions, _, _ = sitesFromConfig(lattice.get("sites"))
+        self.basis = asBasis(self.positions)
+        self.kernel: Kernel = compileKernel(
+            request.source, request.moduleName, cacheDir=cacheDir, verbose=False
+        )
+        self.maskCache = MaskCache()
+        symmetry = request.config.get("symmetry", {})
+        self.symmetry = None
+        if symmetry.get("group", "none") != "none":
+            self.symmetry = symmetryOps(
+                symmetry["group"],
+                latticeVectors(self.v1, self.v2),
+                self.basis,
+                symmetry.get("center", (0, 0)),
+                symmetry.get("mirrorAngle", 0.0),
+            )
+
+    def generate(self, request: GenerationRequest) -> Arrays:
+        # module variables are shared by generators of the same source
+        self.kernel.setUnitCellPositions(self.positions)
+        self.kernel.setConstants(request.constants)
+        # cached mask results are valid only for the same runtime constants
+        maskHash = self.kernel.hash + repr(sorted(request.constants.items()))
+        sites = generateLatticeSites(
+            self.v1,
+            self.v2,
+            self.basis,
+            latticeIndexRange(self.v1, self.v2, request.window),
+            request.window,
+            maskArrayFn=self.kernel.maskArray,
+            maskCache=self.maskCache,
+            maskHash=maskHash,
+            symmetry=self.symmetry,
+        )
+        arrays = {
+            "positions": sites.positions,
+            "site_types": sites.siteTypes,
+            "cells": sites.cells,
+        }
+        if request.numShells > 0:
+            offsets = neighbourOffsets(
+                self.v1, self.v2, self.basis, numShells=request.numShells
+            )
+            neighbours = findNeighbours(sites, offsets, len(self.basis))
+            arrays.update(
+                rows=neighbours.rows, cols=neighbours.cols, shells=neighbours.shells
+            )
+        return arrays
+
+
+# state of the worker process, created by the pool initializer
+workerCacheDir: Optional[Path] = None
+# least recently used generators are dropped above WORKER_GENERATORS
+workerGenerators: "OrderedDict[str, LatticeGenerator]" = OrderedDict()
+
+
+def initWorker(cacheDir: Optional[Path]):
+    global workerCacheDir
+    workerCacheDir = cacheDir
+
+
+def generatorKey(request: GenerationRequest) -> str:
+    config = {key: request.config.get(key) for key in ["lattice", "symmetry"]}
+    return sourceHash(request.source) + json.dumps(config, sort_keys=True)
+
+
+def runRequest(request: GenerationRequest) -> Arrays:
+    key = generatorKey(request)
+    generator = workerGenerators.get(key)
+    if generator is None:
+        generator = LatticeGenerator(request, workerCacheDir)
+        workerGenerators[key] = generator
+        while len(workerGenerators) > WORKER_GENERATORS:
+            workerGenerators.popitem(last=False)
+    workerGenerators.move_to_end(key)
+    return generator.generate(request)
+
+
+class LatticeServer:
+    """Resolves presets and compiles kernels in this process, generation runs
+    in a pool of worker processes which load the kernels from the cache"""
+
+    def __init__(self, workers: int = None, cacheDir: Optional[Path] = None):
+        self.cacheDir = cacheDir
+        self.pool = ProcessPoolExecutor(
+            workers, initializer=initWorker, initargs=(cacheDir,)
+        )
+        self.compileLock = threading.Lock()
+        self.presetsLock = threading.Lock()
+        self.compiled = set()
+
+    def buildRequest(self, header: Dict[str, Any]) -> GenerationRequest:
+        from tb_lattice_viewer.presets import PresetsManager
+
+        if "config" in header:
+            config, moduleName = header["config"], INLINE_MODULE
+        elif "preset" in header:
+            with self.presetsLock:
+                config = PresetsManager.getPreset("lattice", header["preset"])
+            moduleName = header["preset"]
+            if not config:
+                raise ValueError(f"Lattice preset '{header['preset']}' not found")
+        else:
+            raise ValueError("Request needs a 'preset' name or an inline 'config'")
+
+        dimensions = config.get("dimensions", {})
+        vMin, vMax = header.get(
+            "window", (dimensions.get("vMin", (0, 0)), dimensions.get("vMax", (1, 1)))
+        )
+        types = presetConstants(config)
+        constants = header.get("constants", {})
+        for name in constants:
+            if name not in types:
+                raise ValueError(f"Constant '{name}' is not defined in the preset")
+        constants = {name: type(types[name])(v) for name, v in constants.items()}
+        return GenerationRequest(
+            config=config,
+            moduleName=moduleName,
+            source=buildSourceFromConfig(config, moduleName, sorted(constants)),
+            window=(tuple(vMin), tuple(vMax)),
+            numShells=int(header.get("shells", 0)),
+            constants=constants,
+        )
+
+    def handle(self, header: Dict[str, Any]) -> Arrays:
+        request = self.buildRequest(header)
+        digest = sourceHash(request.source)
+        # workers load the kernel from the cache instead of compiling it
+        with self.compileLock:
+            if digest not in self.compiled:
+                compileKernel(
+                    request.source, request.moduleName, cacheDir=self.cacheDir
+                )
+                self.compiled.add(digest)
+        return self.pool.submit(runRequest, request).result()
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    """Answers requests of one connection until the client closes it"""
+
+    def handle(self):
+        latticeServer: LatticeServer = self.server.latticeServer
+        while True:
+            message = receiveMessage(self.request)
+            if message is None:
+                return
+            header, _ = message
+            start = time.perf_counter()
+            try:
+                arrays = latticeServer.handle(header)
+            except Exception as error:
+                traceback.print_exc()
+                sendMessage(self.request, {"status": "error", "error": str(error)})
+                continue
+            seconds = time.perf_counter() - start
+            numSites = len(arrays["positions"])
+            print(f"Generated {numSites} sites in {seconds:.3f} s")
+            sendMessage(self.request, {"status": "ok", "seconds": seconds}, arrays)
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(
+    address: Address,
+    presetsPath: Optional[Path] = None,
+    workers: int = None,
+    cacheDir: Optional[Path] = None,
+):
+    """Serves until interrupted, presets are reloaded when the file changes"""
+    from tb_lattice_viewer.presets import PresetsManager
+
+    if presetsPath is not None:
+        PresetsManager.load(presetsPath)
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.unlink(address)
+        server = ThreadingUnixServer(address, RequestHandler)
+    else:
+        server = ThreadingTCPServer(address, RequestHandler)
+    server.latticeServer = LatticeServer(workers, cacheDir)
+    print(f"Serving lattices on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.latticeServer.shutdown()
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+
+
+class LatticeClient:
+    """Blocking client of the local server, one request at a time"""
+
+    def __init__(self, address: Union[Address, str], timeout: float = None):
+        address = parseAddress(address) if isinstance(address, str) else address
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.settimeout(timeout)
+        self.connection.connect(address)
+
+    def generate(
+        self,
+        preset: str = None,
+        config: Dict[str, Any] = None,
+        window: Window = None,
+        shells: int = 0,
+        constants: Dict[str, Any] = None,
+    ) -> Arrays:
+        """Raises ValueError with the message of the server when it fails"""
+        header: Dict[str, Any] = {"shells": shells}
+        if preset is not None:
+            header["preset"] = preset
+        if config is not None:
+            header["config"] = config
+        if window is not None:
+            header["window"] = [list(window[0]), list(window[1])]
+        if constants:
+            header["constants"] = constants
+        sendMessage(self.connection, header)
+        message = receiveMessage(self.connection)
+        if message is None:
+            raise ValueError("Server closed the connection")
+        response, arrays = message
+        if response.get("status") != "ok":
+            raise ValueError(response.get("error", "Unknown server error"))
+        return arrays
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "LatticeClient":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = ArgumentParser(description="Serve generated lattices locally")
+    parser.add_argument(
+        "--serve", required=True, help="Unix socket path or localhost port"
+    )
+    parser.add_argument(
+        "--config",
+        default=Path("~/.tb-lattice-viewer/default.json"),
+        help="Path to presets json file or sqlite database",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Worker processes"
+    )
+    parser.add_argument("--cache-dir", default=None, help="Kernels cache directory")
+    args = parser.parse_args(argv)
+
+    serve(
+        parseAddress(args.serve),
+        Path(args.config).expanduser(),
+        workers=max(args.workers, 1),
+        cacheDir=None if args.cache_dir is None else Path(args.cache_dir),
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
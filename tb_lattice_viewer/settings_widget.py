@@ -1,40 +1,115 @@
-import glob
-import importlib
-import os
 import traceback
-import uuid
+from pathlib import Path
 from typing import Optional
 
 import numpy
 from PyQt5 import QtCore
-from PyQt5.Qt3DCore import *
-from PyQt5.Qt3DExtras import *
-from PyQt5.QtCore import QSize
-from PyQt5.QtGui import QVector3D, QColor
-from PyQt5.QtWidgets import QPushButton, QVBoxLayout, QLabel, QMessageBox
-from numpy import f2py
-from tqdm import tqdm
+from PyQt5.QtCore import QSize, QTimer, pyqtSignal
+from PyQt5.QtGui import QVector3D
+from PyQt5.QtWidgets import (
+    QPushButton,
+    QVBoxLayout,
+    QLabel,
+    QMessageBox,
+    QHBoxLayout,
+    QSpinBox,
+    QFileDialog,
+    QCheckBox,
+    QComboBox,
+    QDoubleSpinBox,
+    QFormLayout,
+)
 
+from tb_lattice_viewer.colormaps import COLORMAPS, loadField, mapScalars, valueRange
 from tb_lattice_viewer.editor import createCodeEditor
+from tb_lattice_viewer.estimator import (
+    EstimatorThresholds,
+    SceneEstimate,
+    chooseRenderMode,
+    estimateScene,
+)
+from tb_lattice_viewer.export import (
+    EXPORT_FILTERS,
+    exportGltf,
+    exportPly,
+    uniqueBonds,
+)
+from tb_lattice_viewer.hamiltonian import (
+    assembleHamiltonian,
+    hoppingsFromConstants,
+    onsiteFromConstants,
+    saveHamiltonian,
+)
+from tb_lattice_viewer.kernels import Kernel, buildModuleSource, compileKernel
+from tb_lattice_viewer.lattice import (
+    IndexRange,
+    LatticeSites,
+    NeighbourOffsets,
+    asBasis,
+    generateLatticeSites,
+    latticeIndexRange,
+    latticeVectors,
+    neighbourOffsets,
+    findNeighbours,
+)
+from tb_lattice_viewer.live_preview import PreviewInputs
+from tb_lattice_viewer.mask_cache import MASK_CACHE_MB, MaskCache
+from tb_lattice_viewer.picking import SitePicker
+from tb_lattice_viewer.playback import TimeSeries
 from tb_lattice_viewer.presets import PropertyWidget
+from tb_lattice_viewer.profiling import profiler
+from tb_lattice_viewer.scene import (
+    RENDER_MODES,
+    SCENE_BUILDERS,
+    ColorBuffers,
+    SceneFrame,
+    SceneStats,
+    createInstancedScene,
+    fitFrame,
+)
 from tb_lattice_viewer.property_widgets import (
     ScalarPropertiesListWidget,
     LatticeDefinitionWidget,
 )
-from tb_lattice_viewer.templates import (
-    FORTRAN_CODE_MASK_FN_TEMPLATE,
-    FORTRAN_CODE_MODULE_TEMPLATE,
-)
+from tb_lattice_viewer.snapshots import UndoHistory
+from tb_lattice_viewer.symmetry import SYMMETRY_GROUPS, SymmetryOps, symmetryOps
+from tb_lattice_viewer.tables import writeLatticeTables
+from tb_lattice_viewer.templates import FORTRAN_CODE_MASK_FN_TEMPLATE
+from tb_lattice_viewer.tiles import TILE_CELLS, TiledScene, tilesFrame
 from tb_lattice_viewer.widgets import VectorWidget, CollapsibleBox
 
 
 class SettingsWidget(PropertyWidget):
+    # the current sites need a scene with per site colors
+    sceneRebuildRequested = pyqtSignal()
+    # TimeSeries to play or None
+    timeSeriesChanged = pyqtSignal(object)
+    # SitePicker of the scene built from the generated sites
+    sitePickerChanged = pyqtSignal(object)
+
     def getConfig(self):
         return {
             "parameters": self.properties.getConfig(),
             "lattice": self.lattice.getConfig(),
             "code": self.editor.text(),
             "dimensions": {"vMin": self.vMin.getValue(), "vMax": self.vMax.getValue()},
+            "tables": self.tablesCheckBox.isChecked(),
+            "symmetry": {
+                "group": self.symmetryCombo.currentText(),
+                "center": self.symmetryCenter.getValue(),
+                "mirrorAngle": self.mirrorAngleSpinBox.value(),
+                "verifySamples": self.verifySamplesSpinBox.value(),
+            },
+            "render": {
+                "mode": self.renderModeCombo.currentText(),
+                "instancedSites": self.instancedSitesSpinBox.value(),
+                "pointsSites": self.pointsSitesSpinBox.value(),
+                "tilesSites": self.tilesSitesSpinBox.value(),
+                "warnMemoryMB": self.warnMemorySpinBox.value(),
+                "tileCells": self.tileCellsSpinBox.value(),
+                "tileBudgetMB": self.tileBudgetSpinBox.value(),
+                "maskCacheMB": self.maskCacheSpinBox.value(),
+            },
         }
 
     def setConfig(self, config):
@@ -44,11 +119,56 @@ class SettingsWidget(PropertyWidget):
         self.editor.setText(config.get("code", FORTRAN_CODE_MASK_FN_TEMPLATE))
         self.vMin.setValue(config.get("dimensions", {"vMin": (0, 0)})["vMin"])
         self.vMax.setValue(config.get("dimensions", {"vMax": (1, 1)})["vMax"])
+        self.tablesCheckBox.setChecked(config.get("tables", False))
+        symmetry = config.get("symmetry", {})
+        self.symmetryCombo.setCurrentText(symmetry.get("group", "none"))
+        self.symmetryCenter.setValue(symmetry.get("center", (0, 0)))
+        self.mirrorAngleSpinBox.setValue(symmetry.get("mirrorAngle", 0.0))
+        self.verifySamplesSpinBox.setValue(symmetry.get("verifySamples", 0))
+        render = config.get("render", {})
+        defaults = EstimatorThresholds()
+        self.renderModeCombo.setCurrentText(render.get("mode", "auto"))
+        self.instancedSitesSpinBox.setValue(
+            render.get("instancedSites", defaults.instancedSites)
+        )
+        self.pointsSitesSpinBox.setValue(render.get("pointsSites", defaults.pointsSites))
+        self.tilesSitesSpinBox.setValue(render.get("tilesSites", defaults.tilesSites))
+        self.warnMemorySpinBox.setValue(
+            render.get("warnMemoryMB", defaults.warnMemoryMB)
+        )
+        self.tileCellsSpinBox.setValue(render.get("tileCells", TILE_CELLS))
+        self.tileBudgetSpinBox.setValue(
+            render.get("tileBudgetMB", defaults.tileBudgetMB)
+        )
+        self.maskCacheSpinBox.setValue(render.get("maskCacheMB", MASK_CACHE_MB))
 
     def __init__(self, *args, **kwargs):
         super().__init__(presetName="lattice", *args, **kwargs)
 
         self.compileButton = QPushButton("Compile and generate lattice")
+        self.livePreviewCheckBox = QCheckBox("Live preview")
+        self.livePreviewCheckBox.setToolTip(
+            "Regenerate the lattice in the background after each change, "
+            "the kernel is recompiled only when the source changes"
+        )
+        self.previewLabel = QLabel()
+        self.exportHamiltonianButton = QPushButton("Export Hamiltonian")
+        self.exportSceneButton = QPushButton("Export scene")
+        self.exportSceneButton.setToolTip(
+            "Binary glTF with instanced spheres per site type or PLY point cloud"
+        )
+        self.exportBondsCheckBox = QCheckBox("Bonds")
+        self.exportBondsCheckBox.setToolTip(
+            "Export the bonds of the neighbour shells as lines (glTF) or edges (PLY)"
+        )
+        self.numShellsSpinBox = QSpinBox()
+        self.numShellsSpinBox.setRange(1, 10)
+        self.numShellsSpinBox.setValue(1)
+        self.tablesCheckBox = QCheckBox("Emit index tables")
+        self.tablesCheckBox.setToolTip(
+            "Adds load_lattice_tables routine to the module and writes "
+            "site index tables to mod_<preset>_tables.bin after generation"
+        )
         self.properties = ScalarPropertiesListWidget()
         self.lattice = LatticeDefinitionWidget()
         self.vMin = VectorWidget("Minimum (x, y)")
@@ -68,22 +188,258 @@ class SettingsWidget(PropertyWidget):
 
         t3.setContentLayout(dimLayout)
 
+        self.symmetryCombo = QComboBox()
+        self.symmetryCombo.addItems(SYMMETRY_GROUPS)
+        self.symmetryCombo.setToolTip(
+            "Point group of the mask, the mask is evaluated only on one site "
+            "of each orbit and copied to the other sites"
+        )
+        self.symmetryCenter = VectorWidget("Center (x, y)")
+        self.symmetryCenter.setValue((0, 0))
+        self.mirrorAngleSpinBox = QDoubleSpinBox()
+        self.mirrorAngleSpinBox.setRange(-180, 180)
+        self.mirrorAngleSpinBox.setSuffix(" deg")
+        self.verifySamplesSpinBox = QSpinBox()
+        self.verifySamplesSpinBox.setRange(0, 10 ** 6)
+        self.verifySamplesSpinBox.setSpecialValueText("off")
+        self.verifySamplesSpinBox.setToolTip(
+            "Number of random sites evaluated directly and compared with "
+            "their symmetric images"
+        )
+
+        t5 = CollapsibleBox(title="Symmetry")
+        symmetryLayout = QFormLayout()
+        symmetryLayout.addRow("Group", self.symmetryCombo)
+        symmetryLayout.addRow(self.symmetryCenter)
+        symmetryLayout.addRow("Mirror axis", self.mirrorAngleSpinBox)
+        symmetryLayout.addRow("Verify samples", self.verifySamplesSpinBox)
+        t5.setContentLayout(symmetryLayout)
+
+        defaults = EstimatorThresholds()
+        self.renderModeCombo = QComboBox()
+        self.renderModeCombo.addItems(["auto"] + RENDER_MODES)
+        self.renderModeCombo.setToolTip(
+            "auto - spheres, instanced spheres, points or tiles depending on "
+            "the number of generated sites\n"
+            "tiles - instanced spheres generated lazily per tile in view"
+        )
+        self.instancedSitesSpinBox = QSpinBox()
+        self.instancedSitesSpinBox.setRange(0, 10 ** 9)
+        self.instancedSitesSpinBox.setSingleStep(1000)
+        self.instancedSitesSpinBox.setValue(defaults.instancedSites)
+        self.pointsSitesSpinBox = QSpinBox()
+        self.pointsSitesSpinBox.setRange(0, 10 ** 9)
+        self.pointsSitesSpinBox.setSingleStep(100000)
+        self.pointsSitesSpinBox.setValue(defaults.pointsSites)
+        self.tilesSitesSpinBox = QSpinBox()
+        self.tilesSitesSpinBox.setRange(0, 2 ** 31 - 1)
+        self.tilesSitesSpinBox.setSingleStep(1000000)
+        self.tilesSitesSpinBox.setValue(defaults.tilesSites)
+        self.tileCellsSpinBox = QSpinBox()
+        self.tileCellsSpinBox.setRange(1, 4096)
+        self.tileCellsSpinBox.setValue(TILE_CELLS)
+        self.tileBudgetSpinBox = QSpinBox()
+        self.tileBudgetSpinBox.setRange(1, 10 ** 6)
+        self.tileBudgetSpinBox.setSuffix(" MB")
+        self.tileBudgetSpinBox.setValue(defaults.tileBudgetMB)
+        self.maskCacheSpinBox = QSpinBox()
+        self.maskCacheSpinBox.setRange(0, 10 ** 6)
+        self.maskCacheSpinBox.setSuffix(" MB")
+        self.maskCacheSpinBox.setValue(MASK_CACHE_MB)
+        self.maskCacheSpinBox.setToolTip(
+            "Mask results are kept per block of cells for the compiled kernel, "
+            "changing the window evaluates only cells not seen before"
+        )
+        self.warnMemorySpinBox = QSpinBox()
+        self.warnMemorySpinBox.setRange(1, 10 ** 6)
+        self.warnMemorySpinBox.setSuffix(" MB")
+        self.warnMemorySpinBox.setValue(defaults.warnMemoryMB)
+        self.estimateButton = QPushButton("Estimate")
+        self.estimateLabel = QLabel()
+
+        t4 = CollapsibleBox(title="Rendering")
+        renderLayout = QFormLayout()
+        renderLayout.addRow("Render mode", self.renderModeCombo)
+        renderLayout.addRow("Instanced above sites", self.instancedSitesSpinBox)
+        renderLayout.addRow("Points above sites", self.pointsSitesSpinBox)
+        renderLayout.addRow("Tiles above sites", self.tilesSitesSpinBox)
+        renderLayout.addRow("Warn above memory", self.warnMemorySpinBox)
+        renderLayout.addRow("Tile size (cells)", self.tileCellsSpinBox)
+        renderLayout.addRow("Tiles memory budget", self.tileBudgetSpinBox)
+        renderLayout.addRow("Mask cache limit", self.maskCacheSpinBox)
+        t4.setContentLayout(renderLayout)
+
+        self.loadFieldButton = QPushButton("Load .npy")
+        self.loadFieldButton.setToolTip(
+            "Per site values in the order of the generated sites, as in the "
+            "exported Hamiltonian"
+        )
+        self.loadSeriesButton = QPushButton("Load series")
+        self.loadSeriesButton.setToolTip(
+            "(frames, sites) .npy file, memory mapped and played frame by frame"
+        )
+        self.clearFieldButton = QPushButton("Clear")
+        self.fieldLabel = QLabel("No field")
+        self.colormapCombo = QComboBox()
+        self.colormapCombo.addItems(list(COLORMAPS))
+        self.fieldMinSpinBox = QDoubleSpinBox()
+        self.fieldMaxSpinBox = QDoubleSpinBox()
+        for spinBox in [self.fieldMinSpinBox, self.fieldMaxSpinBox]:
+            spinBox.setRange(-1e12, 1e12)
+            spinBox.setDecimals(6)
+        self.fieldMaxSpinBox.setValue(1)
+        self.autoRangeButton = QPushButton("Auto range")
+
+        t6 = CollapsibleBox(title="Field")
+        fieldLayout = QFormLayout()
+        fieldButtonsLayout = QHBoxLayout()
+        fieldButtonsLayout.addWidget(self.loadFieldButton)
+        fieldButtonsLayout.addWidget(self.loadSeriesButton)
+        fieldButtonsLayout.addWidget(self.clearFieldButton)
+        fieldLayout.addRow(fieldButtonsLayout)
+        fieldLayout.addRow(self.fieldLabel)
+        fieldLayout.addRow("Colormap", self.colormapCombo)
+        fieldLayout.addRow("Minimum", self.fieldMinSpinBox)
+        fieldLayout.addRow("Maximum", self.fieldMaxSpinBox)
+        fieldLayout.addRow(self.autoRangeButton)
+        t6.setContentLayout(fieldLayout)
+
         self.editor = createCodeEditor(FORTRAN_CODE_MASK_FN_TEMPLATE)
 
         mainLayout = QVBoxLayout()
         presetsBar = self.buildPresetLayout()
         mainLayout.addLayout(presetsBar)
+
+        self.undoButton = QPushButton("Undo")
+        self.redoButton = QPushButton("Redo")
+        historyLayout = QHBoxLayout()
+        historyLayout.addStretch()
+        historyLayout.addWidget(self.undoButton)
+        historyLayout.addWidget(self.redoButton)
+        mainLayout.addLayout(historyLayout)
+
         mainLayout.addWidget(t1)
         mainLayout.addWidget(t2)
         mainLayout.addWidget(t3)
+        mainLayout.addWidget(t5)
+        mainLayout.addWidget(t4)
+        mainLayout.addWidget(t6)
 
         mainLayout.addWidget(QLabel("<b>Editor</b>"))
         mainLayout.addWidget(self.editor)
         mainLayout.addWidget(self.compileButton)
+        previewLayout = QHBoxLayout()
+        previewLayout.addWidget(self.livePreviewCheckBox)
+        previewLayout.addWidget(self.previewLabel, 1)
+        mainLayout.addLayout(previewLayout)
+        estimateLayout = QHBoxLayout()
+        estimateLayout.addWidget(self.estimateLabel, 1)
+        estimateLayout.addWidget(self.estimateButton)
+        mainLayout.addLayout(estimateLayout)
+
+        hamiltonianLayout = QHBoxLayout()
+        hamiltonianLayout.addWidget(QLabel("Neighbour shells"))
+        hamiltonianLayout.addWidget(self.numShellsSpinBox)
+        hamiltonianLayout.addWidget(self.exportHamiltonianButton)
+        mainLayout.addLayout(hamiltonianLayout)
+        exportLayout = QHBoxLayout()
+        exportLayout.addStretch()
+        exportLayout.addWidget(self.exportBondsCheckBox)
+        exportLayout.addWidget(self.exportSceneButton)
+        mainLayout.addLayout(exportLayout)
+        mainLayout.addWidget(self.tablesCheckBox)
+
         self.setLayout(mainLayout)
         self.updatePresets()
 
         self.entities = []
+        self.maskFunction = None
+        self.kernel: Optional[Kernel] = None
+        self.maskCache = MaskCache(self.maskCacheSpinBox.value() * 2 ** 20)
+        self.maskCacheSpinBox.valueChanged.connect(
+            lambda value: self.maskCache.setMaxBytes(value * 2 ** 20)
+        )
+        self.sites: Optional[LatticeSites] = None
+        self.exportHamiltonianButton.pressed.connect(self.exportHamiltonian)
+        self.exportSceneButton.pressed.connect(self.exportScene)
+        self.estimateButton.pressed.connect(self.showEstimate)
+
+        # per site scalar field shown by recoloring the current scene in place
+        self.field: Optional[numpy.ndarray] = None
+        self.colorBuffers = ColorBuffers()
+        self.loadFieldButton.pressed.connect(self.loadField)
+        self.loadSeriesButton.pressed.connect(self.loadTimeSeries)
+        self.clearFieldButton.pressed.connect(self.clearField)
+        self.autoRangeButton.pressed.connect(self.autoFieldRange)
+        self.colormapCombo.currentIndexChanged.connect(self.applyField)
+        self.fieldMinSpinBox.valueChanged.connect(self.applyField)
+        self.fieldMaxSpinBox.valueChanged.connect(self.applyField)
+
+        # edits are recorded as snapshots once they stop for snapshotDelayMs
+        self.history = UndoHistory(maxLength=100)
+        self.snapshotTimer = QTimer(self)
+        self.snapshotTimer.setSingleShot(True)
+        self.snapshotTimer.setInterval(500)
+        self.snapshotTimer.timeout.connect(self.recordSnapshot)
+        for signal in self.changeSignals():
+            signal.connect(self.snapshotTimer.start)
+        self.undoButton.pressed.connect(self.undo)
+        self.redoButton.pressed.connect(self.redo)
+        self.recordSnapshot()
+
+    def changeSignals(self) -> list:
+        signals = [
+            self.editor.textChanged,
+            self.lattice.v1.valueChanged,
+            self.lattice.v2.valueChanged,
+            self.vMin.valueChanged,
+            self.vMax.valueChanged,
+            self.tablesCheckBox.toggled,
+            self.symmetryCombo.currentIndexChanged,
+            self.symmetryCenter.valueChanged,
+            self.mirrorAngleSpinBox.valueChanged,
+            self.verifySamplesSpinBox.valueChanged,
+            self.renderModeCombo.currentIndexChanged,
+            self.instancedSitesSpinBox.valueChanged,
+            self.pointsSitesSpinBox.valueChanged,
+            self.tilesSitesSpinBox.valueChanged,
+            self.warnMemorySpinBox.valueChanged,
+            self.tileCellsSpinBox.valueChanged,
+            self.tileBudgetSpinBox.valueChanged,
+            self.maskCacheSpinBox.valueChanged,
+        ]
+        for model in [self.properties.model, self.lattice.unitCellDefinition.model]:
+            signals += [
+                model.dataChanged,
+                model.rowsInserted,
+                model.rowsRemoved,
+                model.modelReset,
+            ]
+        return signals
+
+    def recordSnapshot(self):
+        self.history.push(self.getConfig())
+        self.updateHistoryButtons()
+
+    def updateHistoryButtons(self):
+        self.undoButton.setEnabled(self.history.canUndo())
+        self.redoButton.setEnabled(self.history.canRedo())
+
+    def undo(self):
+        # pending edits become the last snapshot before going back
+        if self.snapshotTimer.isActive():
+            self.snapshotTimer.stop()
+            self.history.push(self.getConfig())
+        snapshot = self.history.undo()
+        if snapshot is not None:
+            self.setConfig(snapshot)
+        self.updateHistoryButtons()
+
+    def redo(self):
+        snapshot = self.history.redo()
+        if snapshot is not None:
+            self.setConfig(snapshot)
+        self.updateHistoryButtons()
 
     def sizeHint(self) -> QtCore.QSize:
         return QSize(300, 800)
@@ -93,15 +449,11 @@ class SettingsWidget(PropertyWidget):
         return self.presetsCombo.currentText()
 
     def getLatticeStartEndIndices(self):
-        xyMin = self.vMin.asTuple()
-        xyMax = self.vMax.asTuple()
-        s1x1, s1y1 = self.lattice.v1.getStepIndexAt(*xyMin)
-        s1x2, s1y2 = self.lattice.v1.getStepIndexAt(*xyMax)
-        s2x1, s2y1 = self.lattice.v2.getStepIndexAt(*xyMin)
-        s2x2, s2y2 = self.lattice.v2.getStepIndexAt(*xyMax)
-        x = s1x1, s1x2, s2x1, s2x2
-        y = s1y1, s1y2, s2y1, s2y2
-        return min(x), min(y), max(x), max(y)
+        return latticeIndexRange(
+            self.lattice.v1.getValue(),
+            self.lattice.v2.getValue(),
+            (self.vMin.asTuple(), self.vMax.asTuple()),
+        )
 
     def isInWindow(self, vec: QVector3D) -> bool:
         xMin, yMin = self.vMin.asTuple()
@@ -113,30 +465,17 @@ class SettingsWidget(PropertyWidget):
         return True
 
     def buildSourceCode(self) -> Optional[str]:
-        source = FORTRAN_CODE_MODULE_TEMPLATE
+        unitCell = self.lattice.unitCellDefinition
         try:
-            params = []
-            for k, prop in enumerate(self.properties.properties()):
-                if prop.isEmpty():
-                    continue
-                if not prop.isValid():
-                    title = f"Missing name or value for property {k+1}"
-                    error = f"Set correct name or value"
-                    QMessageBox.critical(
-                        self, "Invalid property", "<p><b>%s</b></p>%s" % (title, error)
-                    )
-                    return None
-                paramStr = prop.toFortranDefinition()
-                params.append(paramStr)
-
-            params = "\n".join(params)
-
-            params = f"\n{params}\n{self.lattice.toFortranDefinition()}\n"
-
-            source = source.replace("{{PARAMETERS}}", params)
-            source = source.replace("{{MODULE_NAME}}", self.currentPreset)
-            source = source.replace("{{FUNCTIONS}}", self.editor.text())
-
+            source = buildModuleSource(
+                self.currentPreset,
+                self.properties.properties(),
+                self.lattice.v1.getValue(),
+                self.lattice.v2.getValue(),
+                unitCell.numUnits,
+                self.editor.text(),
+                self.tablesCheckBox.isChecked(),
+            )
         except Exception as error:
             title = f"Cannot parse source code"
             traceback.print_exc()
@@ -146,7 +485,8 @@ class SettingsWidget(PropertyWidget):
         return source
 
     def compileSourceCode(self):
-        source = self.buildSourceCode()
+        with profiler.span("source build", "pipeline"):
+            source = self.buildSourceCode()
         if source is None:
             return None
 
@@ -157,123 +497,411 @@ class SettingsWidget(PropertyWidget):
 
         print(">> SOURCE")
         print(source)
-        modulename = f"module_{uuid.uuid4().hex}"
-
-        result = f2py.compile(
-            source,
-            modulename=modulename,
-            verbose=True,
-            extension=".f90",
-            source_fn=f"mod_{self.currentPreset}.f90",
+        kernel = compileKernel(
+            source, self.currentPreset, sourceFn=f"mod_{self.currentPreset}.f90"
         )
-        if result != 0:
-            title = f"Cannot compile Fortran code! Check console for output!"
-            raise ValueError(title)
+        kernel.setUnitCellPositions(self.lattice.unitCellDefinition.positions())
 
-        m = importlib.import_module(modulename)
+        self.kernel = kernel
+        self.maskFunction = kernel.mask
+        self.sites = None
+        return True
 
-        def maskFn(x, y, z=0):
-            mask = getattr(m, self.currentPreset).mask(float(x), float(y), float(z))
-            return mask
+    def previewInputs(self) -> PreviewInputs:
+        """Snapshot of everything the live preview needs, taken on the GUI
+        thread, raises ValueError for invalid inputs"""
+        if self.currentPreset in ["", None]:
+            raise ValueError("No preset defined")
+        unitCell = self.lattice.unitCellDefinition
+        config = self.getConfig()
+        sites = config["lattice"]["sites"]
+        return PreviewInputs(
+            source=buildModuleSource(
+                self.currentPreset,
+                self.properties.properties(),
+                self.lattice.v1.getValue(),
+                self.lattice.v2.getValue(),
+                unitCell.numUnits,
+                self.editor.text(),
+                self.tablesCheckBox.isChecked(),
+            ),
+            moduleName=self.currentPreset,
+            v1=self.lattice.v1.getValue(),
+            v2=self.lattice.v2.getValue(),
+            basis=unitCell.positions(),
+            indexRange=self.getLatticeStartEndIndices(),
+            window=(self.vMin.asTuple(), self.vMax.asTuple()),
+            symmetry=self.symmetryOps(),
+            verifySamples=self.verifySamplesSpinBox.value(),
+            symmetryKey=repr(config["symmetry"]),
+            appearanceKey=repr((sites["sizes"], sites["colors"], config["render"])),
+        )
 
-        for p in glob.glob(f"{modulename}*.so"):
-            os.remove(p)
+    def generateSites(self) -> LatticeSites:
+        hits, misses = self.maskCache.hits, self.maskCache.misses
+        # timed here, the library function is also called by other threads
+        with profiler.span("mask evaluation", "pipeline"):
+            sites = generateLatticeSites(
+                v1=self.lattice.v1.getValue(),
+                v2=self.lattice.v2.getValue(),
+                basis=self.lattice.unitCellDefinition.positions(),
+                indexRange=self.getLatticeStartEndIndices(),
+                window=(self.vMin.asTuple(), self.vMax.asTuple()),
+                maskFn=self.maskFunction,
+                maskArrayFn=None if self.kernel is None else self.kernel.maskArray,
+                maskCache=self.maskCache,
+                maskHash=None if self.kernel is None else self.kernel.hash,
+                symmetry=self.symmetryOps(),
+                verifySamples=self.verifySamplesSpinBox.value(),
+            )
+        print(
+            f"Mask cache: {self.maskCache.misses - misses} cells evaluated, "
+            f"{self.maskCache.hits - hits} reused, "
+            f"{self.maskCache.usedBytes / 2 ** 20:.1f} MB"
+        )
+        self.sites = sites
+        return sites
 
-        self.maskFunction = maskFn
-        return True
+    def symmetryOps(self) -> Optional[SymmetryOps]:
+        group = self.symmetryCombo.currentText()
+        if group == "none":
+            return None
+        return symmetryOps(
+            group,
+            latticeVectors(self.lattice.v1.getValue(), self.lattice.v2.getValue()),
+            asBasis(self.lattice.unitCellDefinition.positions()),
+            self.symmetryCenter.getValue(),
+            self.mirrorAngleSpinBox.value(),
+        )
 
-    def createScene(self, rootEntity: QEntity):
+    def thresholds(self) -> EstimatorThresholds:
+        return EstimatorThresholds(
+            instancedSites=self.instancedSitesSpinBox.value(),
+            pointsSites=self.pointsSitesSpinBox.value(),
+            tilesSites=self.tilesSitesSpinBox.value(),
+            warnMemoryMB=self.warnMemorySpinBox.value(),
+            tileBudgetMB=self.tileBudgetSpinBox.value(),
+        )
+
+    def estimateScene(self) -> SceneEstimate:
+        """Predicts the scene size without generating sites, the mask is
+        sampled only when the source was compiled"""
+        return estimateScene(
+            v1=self.lattice.v1.getValue(),
+            v2=self.lattice.v2.getValue(),
+            basis=self.lattice.unitCellDefinition.positions(),
+            indexRange=self.getLatticeStartEndIndices(),
+            window=(self.vMin.asTuple(), self.vMax.asTuple()),
+            maskArrayFn=None if self.kernel is None else self.kernel.maskArray,
+            renderMode=self.renderModeCombo.currentText(),
+            thresholds=self.thresholds(),
+        )
+
+    def showEstimate(self):
+        try:
+            self.estimateLabel.setText(self.estimateScene().describe())
+        except Exception as error:
+            title = f"Cannot estimate the scene"
+            traceback.print_exc()
+            QMessageBox.critical(self, "Error", "<p><b>%s</b></p>%s" % (title, error))
+
+    def confirmEstimate(self, estimate: SceneEstimate) -> bool:
+        """Asks before building scenes above the memory threshold"""
+        self.estimateLabel.setText(estimate.describe())
+        if estimate.memoryMB <= self.warnMemorySpinBox.value():
+            return True
+        answer = QMessageBox.question(
+            self,
+            "Large scene",
+            f"<p><b>The scene needs about {estimate.memoryMB:,.0f} MB</b></p>"
+            f"<pre>{estimate.describe()}</pre>"
+            f"<p>Reduce the dimensions or continue anyway?</p>",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No,
+        )
+        return answer == QMessageBox.Yes
+
+    def renderMode(self, numSites: int) -> str:
+        mode = self.renderModeCombo.currentText()
+        if mode == "auto":
+            return chooseRenderMode(numSites, self.thresholds())
+        return mode
+
+    def neighbourOffsets(self) -> NeighbourOffsets:
+        return neighbourOffsets(
+            self.lattice.v1.getValue(),
+            self.lattice.v2.getValue(),
+            self.lattice.unitCellDefinition.positions(),
+            numShells=self.numShellsSpinBox.value(),
+        )
+
+    def writeIndexTables(self, sites: LatticeSites):
+        writeLatticeTables(
+            Path(f"mod_{self.currentPreset}_tables.bin"),
+            sites,
+            self.lattice.unitCellDefinition.numUnits,
+            self.neighbourOffsets(),
+        )
+
+    def exportHamiltonian(self):
+        try:
+            if self.maskFunction is None:
+                raise ValueError("Compile the lattice before exporting the Hamiltonian!")
+
+            path, _ = QFileDialog.getSaveFileName(
+                self, "Export Hamiltonian", f"{self.currentPreset}.npz", "*.npz"
+            )
+            if path == "":
+                return
+
+            sites = self.generateSites()
+            unitCell = self.lattice.unitCellDefinition
+            neighbours = findNeighbours(
+                sites, self.neighbourOffsets(), unitCell.numUnits
+            )
+            constants = self.properties.constants()
+            matrix = assembleHamiltonian(
+                sites,
+                neighbours,
+                hoppingsFromConstants(constants),
+                onsiteFromConstants(constants, unitCell.siteNames()),
+            )
+            saveHamiltonian(Path(path), matrix, sites)
+        except Exception as error:
+            title = f"Cannot export Hamiltonian"
+            traceback.print_exc()
+            QMessageBox.critical(self, "Error", "<p><b>%s</b></p>%s" % (title, error))
 
-        sXmin, sYmin, sXmax, sYmax = self.getLatticeStartEndIndices()
+    def exportScene(self):
+        try:
+            if self.maskFunction is None:
+                raise ValueError("Compile the lattice before exporting the scene!")
+
+            path, _ = QFileDialog.getSaveFileName(
+                self, "Export scene", f"{self.currentPreset}.glb", EXPORT_FILTERS
+            )
+            if path == "":
+                return
+            path = Path(path)
+
+            # tiled scenes keep no sites, the whole window is generated here
+            sites = self.generateSites() if self.sites is None else self.sites
+            unitCell = self.lattice.unitCellDefinition
+            colors = [(c.redF(), c.greenF(), c.blueF()) for c in unitCell.colors()]
+            bonds = None
+            if self.exportBondsCheckBox.isChecked():
+                neighbours = findNeighbours(
+                    sites, self.neighbourOffsets(), unitCell.numUnits
+                )
+                bonds = uniqueBonds(neighbours)
+
+            with profiler.span("scene export", "pipeline"):
+                if path.suffix.lower() == ".ply":
+                    siteColors = None
+                    if self.field is not None and len(self.field) == sites.numSites:
+                        colormap = self.colormapCombo.currentText()
+                        vMin = self.fieldMinSpinBox.value()
+                        vMax = self.fieldMaxSpinBox.value()
+                        siteColors = lambda start, stop: mapScalars(
+                            self.field[start:stop], colormap, vMin, vMax
+                        )
+                    exportPly(path, sites, colors, bonds, siteColors)
+                elif path.suffix.lower() == ".glb":
+                    exportGltf(path, sites, unitCell.sizes(), colors, bonds)
+                else:
+                    raise ValueError(f"Unknown export format: '{path.suffix}'")
+        except Exception as error:
+            title = f"Cannot export scene"
+            traceback.print_exc()
+            QMessageBox.critical(self, "Error", "<p><b>%s</b></p>%s" % (title, error))
+
+    def loadField(self):
+        try:
+            if self.sites is None:
+                raise ValueError("Generate the lattice before loading a field!")
+            path, _ = QFileDialog.getOpenFileName(self, "Load field", "", "*.npy")
+            if path == "":
+                return
+            self.field = loadField(path, self.sites.numSites)
+            self.timeSeriesChanged.emit(None)
+            self.fieldLabel.setText(Path(path).name)
+            print(f"Loaded field of {len(self.field)} sites: {path}")
+            self.autoFieldRange()
+            if self.colorBuffers.isEmpty():
+                # spheres have no color buffers, rebuilt as instanced once
+                self.sceneRebuildRequested.emit()
+        except Exception as error:
+            title = f"Cannot load field"
+            traceback.print_exc()
+            QMessageBox.critical(self, "Error", "<p><b>%s</b></p>%s" % (title, error))
+
+    def loadTimeSeries(self):
+        try:
+            if self.sites is None:
+                raise ValueError("Generate the lattice before loading a series!")
+            path, _ = QFileDialog.getOpenFileName(
+                self, "Load time series", "", "*.npy"
+            )
+            if path == "":
+                return
+            series = TimeSeries(Path(path), self.sites.numSites)
+            # range of the first frame, kept fixed during the playback
+            self.field = series.frame(0)
+            self.fieldLabel.setText(f"{Path(path).name} ({series.numFrames} frames)")
+            self.autoFieldRange()
+            if self.colorBuffers.isEmpty():
+                self.sceneRebuildRequested.emit()
+            self.timeSeriesChanged.emit(series)
+        except Exception as error:
+            title = f"Cannot load time series"
+            traceback.print_exc()
+            QMessageBox.critical(self, "Error", "<p><b>%s</b></p>%s" % (title, error))
+
+    def showFieldFrame(self, values: numpy.ndarray):
+        """Shows a frame of the played series, frames of a series which does
+        not match the current sites are skipped"""
+        if self.sites is None or len(values) != self.sites.numSites:
+            return
+        self.field = values
+        self.applyField()
+
+    def autoFieldRange(self):
+        if self.field is None:
+            return
+        vMin, vMax = valueRange(self.field)
+        spinBoxes = [self.fieldMinSpinBox, self.fieldMaxSpinBox]
+        for spinBox, value in zip(spinBoxes, [vMin, vMax]):
+            spinBox.blockSignals(True)
+            spinBox.setValue(value)
+            spinBox.blockSignals(False)
+        self.applyField()
+
+    def clearField(self):
+        self.field = None
+        self.timeSeriesChanged.emit(None)
+        self.fieldLabel.setText("No field")
+        if self.sites is not None and len(self.sites.siteTypes) > 0:
+            colors = self.lattice.unitCellDefinition.colors()
+            rgb = numpy.array([[c.redF(), c.greenF(), c.blueF()] for c in colors])
+            self.colorBuffers.update(rgb[self.sites.siteTypes])
+
+    def applyField(self):
+        """Rewrites only the color buffers of the current scene"""
+        if self.field is None or self.colorBuffers.isEmpty():
+            return
+        with profiler.span("field colors", "pipeline"):
+            colors = mapScalars(
+                self.field,
+                self.colormapCombo.currentText(),
+                self.fieldMinSpinBox.value(),
+                self.fieldMaxSpinBox.value(),
+            )
+            self.colorBuffers.update(colors)
+
+    def createTiledScene(
+        self, rootEntity: "QEntity", camera: "QCamera"
+    ) -> TiledScene:
+        """Sites are generated per tile when the tile comes into view"""
+        v1, v2 = self.lattice.v1.getValue(), self.lattice.v2.getValue()
+        basis = self.lattice.unitCellDefinition.positions()
+        window = (self.vMin.asTuple(), self.vMax.asTuple())
+        maskArrayFn = None if self.kernel is None else self.kernel.maskArray
+        maskHash = None if self.kernel is None else self.kernel.hash
+        unitCell = self.lattice.unitCellDefinition
+        sizes, colors = unitCell.sizes(), unitCell.colors()
+        tileCells = self.tileCellsSpinBox.value()
+
+        def generateTile(indexRange: IndexRange) -> LatticeSites:
+            return generateLatticeSites(
+                v1,
+                v2,
+                basis,
+                indexRange,
+                window,
+                self.maskFunction,
+                maskArrayFn,
+                self.maskCache,
+                maskHash,
+            )
+
+        def buildTile(entity, sites: LatticeSites, frame: SceneFrame) -> SceneStats:
+            return createInstancedScene(entity, sites, sizes, colors, frame)
+
+        self.sites = None
+        self.colorBuffers = ColorBuffers()
+        return TiledScene(
+            rootEntity,
+            camera,
+            v1,
+            v2,
+            basis,
+            self.getLatticeStartEndIndices(),
+            generateTile,
+            buildTile,
+            tilesFrame(v1, v2, window[0], tileCells),
+            tileCells=tileCells,
+            budgetBytes=self.tileBudgetSpinBox.value() * 2 ** 20,
+        )
+
+    def createScene(self, rootEntity: "QEntity", camera: "QCamera" = None):
+        renderMode = self.renderModeCombo.currentText()
+        if renderMode == "auto":
+            # tiles are chosen before the generation, other modes after it
+            renderMode = self.estimateScene().renderMode
+        if renderMode == "tiles":
+            if camera is None:
+                raise ValueError("Tiled rendering needs the camera of the view!")
+            print(f"Rendering tiles of {self.tileCellsSpinBox.value()} cells")
+            with profiler.span("entity creation", "pipeline"):
+                return self.createTiledScene(rootEntity, camera)
+
+        with profiler.span("index range", "pipeline"):
+            sXmin, sYmin, sXmax, sYmax = self.getLatticeStartEndIndices()
         print("sXmin, sYmin, sXmax, sYmax :", sXmin, sYmin, sXmax, sYmax)
-        sites = self.lattice.unitCellDefinition.unitCellSites()
-        maskFn = self.maskFunction
-
-        positions = []
-        for i in range(sXmin, sXmax + 1):
-            for j in range(sYmin, sYmax + 1):
-                position = self.lattice.getLatticePosition(i, j)
-                if not self.isInWindow(position):
-                    continue
-                for site in sites:
-                    pos = position + site.position
-                    if maskFn(pos.x(), pos.y(), pos.z()) == 0:
-                        continue
-
-                    positions.append([pos.x(), pos.y(), pos.z()])
-
-        positions = numpy.array(positions)
-        maxPos = positions.max(0)
-        minPos = positions.min(0)
-        norm = 1 / max(numpy.linalg.norm(maxPos - minPos), 1)
-        minPos = QVector3D(*minPos.tolist())
-
-        site2mesh = {}
-        for site in sites:
-            sphereMesh = QSphereMesh()
-            sphereMesh.setRadius(site.size * norm)
-            sphereMesh.setRings(10)
-            sphereMesh.setSlices(10)
-            material = QGoochMaterial(rootEntity)
-            material.setWarm(site.color)
-            material.setCool(QColor("white"))
-            site2mesh[site] = {"mesh": sphereMesh, "material": material}
-
-        index = 0
-        for i in tqdm(range(sXmin, sXmax + 1)):
-            for j in range(sYmin, sYmax + 1):
-                position = self.lattice.getLatticePosition(i, j)
-                if not self.isInWindow(position):
-                    continue
-
-                for site in sites:
-
-                    pos = position + site.position
-
-                    if maskFn(pos.x(), pos.y(), pos.z()) == 0:
-                        continue
-
-                    # sphereEntity = QEntity(rootEntity)
-
-                    # sphereMesh = QSphereMesh()
-                    # sphereMesh.setRadius(site.size * norm)
-                    # sphereMesh.setRings(10)
-                    # sphereMesh.setSlices(10)
-                    # material = QGoochMaterial(rootEntity)
-                    # material.setWarm(site.color)
-                    # material.setCool(QColor("white"))
-                    # sphereTransform = QTransform()
-                    # sphereEntity.addComponent(sphereTransform)
-                    # sphereEntity.addComponent(material)
-                    # sphereEntity.addComponent(sphereMesh)
-
-                    # if index >= len(self.entities):
-                    #     sphereEntity = QEntity(rootEntity)
-                    #
-                    #     sphereMesh = QSphereMesh()
-                    #     sphereMesh.setRadius(site.size * norm)
-                    #     sphereMesh.setRings(10)
-                    #     sphereMesh.setSlices(10)
-                    #     material = QGoochMaterial(rootEntity)
-                    #     material.setWarm(site.color)
-                    #     material.setCool(QColor("white"))
-                    #     sphereTransform = QTransform()
-                    #     sphereEntity.addComponent(sphereTransform)
-                    #     sphereEntity.addComponent(material)
-                    #     sphereEntity.addComponent(sphereMesh)
-                    #
-                    #     self.entities.append(sphereEntity)
-                    # else:
-                    #     sphereEntity = self.entities[index]
-                    #
-                    sphereEntity = QEntity(rootEntity)
-                    pos = (pos - minPos) * norm
-
-                    sphereTransform = QTransform()
-                    sphereTransform.setTranslation(pos)
-
-                    sphereEntity.addComponent(sphereTransform)
-                    sphereEntity.addComponent(site2mesh[site]["mesh"])
-                    sphereEntity.addComponent(site2mesh[site]["material"])
-
-        return rootEntity
+        with profiler.span("site generation", "pipeline"):
+            generated = self.generateSites()
+        if generated.numSites == 0:
+            raise ValueError("No sites inside the window, check mask and dimensions!")
+        if self.tablesCheckBox.isChecked():
+            with profiler.span("index tables", "pipeline"):
+                self.writeIndexTables(generated)
+
+        return self.createSceneFromSites(rootEntity, generated)
+
+    def createSceneFromSites(
+        self, rootEntity: "QEntity", sites: LatticeSites
+    ) -> SceneStats:
+        """Scene of already generated sites, used when only the appearance
+        changed"""
+        unitCell = self.lattice.unitCellDefinition
+        renderMode = self.renderMode(sites.numSites)
+        if renderMode == "tiles":
+            renderMode = "points"
+        if self.field is not None and len(self.field) != sites.numSites:
+            print(
+                f"Field of {len(self.field)} values does not match "
+                f"{sites.numSites} sites, cleared"
+            )
+            self.field = None
+            self.fieldLabel.setText("No field")
+            self.timeSeriesChanged.emit(None)
+        if renderMode == "spheres" and self.field is not None:
+            # sphere materials are per type, instances have per site colors
+            renderMode = "instanced"
+        print(f"Rendering {sites.numSites} sites as: {renderMode}")
+        self.colorBuffers = ColorBuffers()
+        frame = fitFrame(sites.positions)
+        with profiler.span("entity creation", "pipeline"):
+            stats = SCENE_BUILDERS[renderMode](
+                rootEntity,
+                sites,
+                unitCell.sizes(),
+                unitCell.colors(),
+                frame=frame,
+                colorBuffers=self.colorBuffers,
+            )
+        self.applyField()
+        self.sitePickerChanged.emit(
+            SitePicker(sites, unitCell.sizes(), frame, unitCell.siteNames())
+        )
+        return stats
@@ -0,0 +1,93 @@
+from collections import deque
+from typing import Any, Deque, Optional
+
+
+class FrozenDict(dict):
+    """Read only dict, safe to share between snapshots without copying"""
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is read only")
+
+    __setitem__ = __delitem__ = __readonly
+    clear = pop = popitem = setdefault = update = __readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value: Any, previous: Any = None) -> Any:
+    """Returns immutable copy of a json like config (dicts become FrozenDict,
+    lists become tuples). Parts equal to the previous snapshot are taken from
+    it, so consecutive snapshots share everything which was not changed."""
+    if isinstance(value, dict):
+        base = previous if isinstance(previous, FrozenDict) else {}
+        items = {k: freeze(v, base.get(k)) for k, v in value.items()}
+        if (
+            isinstance(previous, FrozenDict)
+            and len(previous) == len(items)
+            and all(k in previous and items[k] is previous[k] for k in items)
+        ):
+            return previous
+        return FrozenDict(items)
+
+    if isinstance(value, (list, tuple)):
+        base = previous if isinstance(previous, tuple) else ()
+        items = tuple(
+            freeze(v, base[k] if k < len(base) else None) for k, v in enumerate(value)
+        )
+        if (
+            isinstance(previous, tuple)
+            and len(previous) == len(items)
+            and all(a is b for a, b in zip(items, previous))
+        ):
+            return previous
+        return items
+
+    if previous is not None and type(previous) is type(value) and previous == value:
+        return previous
+    return value
+
+
+class UndoHistory:
+    """Bounded undo/redo stacks of frozen config snapshots"""
+
+    def __init__(self, maxLength: int = 100):
+        self.undoStack: Deque[Any] = deque(maxlen=maxLength)
+        self.redoStack: Deque[Any] = deque(maxlen=maxLength)
+        self.current: Optional[Any] = None
+
+    def push(self, config: Any) -> bool:
+        snapshot = freeze(config, self.current)
+        if snapshot is self.current:
+            return False
+        if self.current is not None:
+            self.undoStack.append(self.current)
+        self.current = snapshot
+        self.redoStack.clear()
+        return True
+
+    def canUndo(self) -> bool:
+        return len(self.undoStack) > 0
+
+    def canRedo(self) -> bool:
+        return len(self.redoStack) > 0
+
+    def undo(self) -> Optional[Any]:
+        if not self.canUndo():
+            return None
+        self.redoStack.append(self.current)
+        self.current = self.undoStack.pop()
+        return self.current
+
+    def redo(self) -> Optional[Any]:
+        if not self.canRedo():
+            return None
+        self.undoStack.append(self.current)
+        self.current = self.redoStack.pop()
+        return self.current
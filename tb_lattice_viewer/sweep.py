@@ -0,0 +1,342 @@
+"""Parameter sweep over the constants of a lattice preset, run with:
+
+    python -m tb_lattice_viewer.sweep --config presets.json --preset dot \\
+        --vary radius=5:20:16 --vary width=1,2 --workers 4 --output sweep
+
+The kernel is compiled once with the swept constants as runtime module
+variables and every point of the grid is generated in a process pool. Sites
+(and optionally the Hamiltonian) of each point are written to the output
+directory together with summary.csv.
+"""
+import csv
+import itertools
+import os
+import sys
+import time
+import traceback
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy
+
+from tb_lattice_viewer.hamiltonian import (
+    assembleHamiltonian,
+    hoppingsFromConstants,
+    onsiteFromConstants,
+    saveHamiltonian,
+)
+from tb_lattice_viewer.kernels import (
+    Kernel,
+    ScalarProperty,
+    buildSourceFromConfig,
+    compileKernel,
+)
+from tb_lattice_viewer.lattice import (
+    LatticeSites,
+    asBasis,
+    findNeighbours,
+    generateLatticeSites,
+    latticeIndexRange,
+    latticeVectors,
+    neighbourOffsets,
+)
+from tb_lattice_viewer.symmetry import symmetryOps
+from tb_lattice_viewer.unit_cell import sitesFromConfig
+
+
+class SweepRange(NamedTuple):
+    name: str
+    values: List[Any]
+
+
+class SweepPoint(NamedTuple):
+    index: int
+    constants: Dict[str, Any]
+
+
+class SweepResult(NamedTuple):
+    index: int
+    constants: Dict[str, Any]
+    numSites: int
+    seconds: float
+    output: str
+    error: str = ""
+
+
+def parseRange(text: str) -> SweepRange:
+    """name=start:stop:num (inclusive linspace) or name=v1,v2,..."""
+    name, sep, values = text.partition("=")
+    if sep == "" or name.strip() == "":
+        raise ValueError(f"Expected name=start:stop:num or name=v1,v2,...: '{text}'")
+    if ":" in values:
+        start, stop, num = values.split(":")
+        parsed = numpy.linspace(float(start), float(stop), int(num)).tolist()
+    else:
+        parsed = [eval(value) for value in values.split(",") if value.strip()]
+    if not parsed:
+        raise ValueError(f"No values for constant '{name}'")
+    return SweepRange(name.strip(), parsed)
+
+
+def presetConstants(config: Dict[str, Any]) -> Dict[str, Any]:
+    properties = [
+        ScalarProperty(param.get("name", ""), param.get("value", ""))
+        for param in config.get("parameters", [])
+    ]
+    return {prop.name: prop.evaluate() for prop in properties if prop.isValid()}
+
+
+def sweepPoints(
+    config: Dict[str, Any], ranges: Sequence[SweepRange]
+) -> List[SweepPoint]:
+    """Cartesian product of the ranges, values are cast to the type of the
+    constant in the preset since its Fortran type is fixed at compilation"""
+    constants = presetConstants(config)
+    types = {}
+    for sweepRange in ranges:
+        if sweepRange.name not in constants:
+            raise ValueError(
+                f"Constant '{sweepRange.name}' is not defined in the preset"
+            )
+        types[sweepRange.name] = type(constants[sweepRange.name])
+
+    names = [sweepRange.name for sweepRange in ranges]
+    grid = itertools.product(*[sweepRange.values for sweepRange in ranges])
+    return [
+        SweepPoint(k, {name: types[name](value) for name, value in zip(names, values)})
+        for k, values in enumerate(grid)
+    ]
+
+
+class SweepRunner:
+    """Generates the lattice of the preset config for given constants, one
+    instance lives in each worker process"""
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        source: str,
+        moduleName: str,
+        outputDir: Path,
+        cacheDir: Optional[Path] = None,
+        numShells: int = 0,
+    ):
+        lattice = config.get("lattice", {})
+        self.config = config
+        self.v1 = lattice.get("v1", (0, 1))
+        self.v2 = lattice.get("v2", (1, 0))
+        self.names, positions, _, _ = sitesFromConfig(lattice.get("sites"))
+        self.basis = asBasis(positions)
+        dimensions = config.get("dimensions", {})
+        self.window = (
+            tuple(dimensions.get("vMin", (0, 0))),
+            tuple(dimensions.get("vMax", (1, 1))),
+        )
+        self.outputDir = outputDir
+        self.numShells = numShells
+        self.constants = presetConstants(config)
+
+        self.kernel: Kernel = compileKernel(source, moduleName, cacheDir=cacheDir)
+        self.kernel.setUnitCellPositions(positions)
+        symmetry = config.get("symmetry", {})
+        self.symmetry = None
+        if symmetry.get("group", "none") != "none":
+            self.symmetry = symmetryOps(
+                symmetry["group"],
+                latticeVectors(self.v1, self.v2),
+                self.basis,
+                symmetry.get("center", (0, 0)),
+                symmetry.get("mirrorAngle", 0.0),
+            )
+
+    def generate(self, constants: Dict[str, Any]) -> LatticeSites:
+        self.kernel.setConstants(constants)
+        return generateLatticeSites(
+            self.v1,
+            self.v2,
+            self.basis,
+            latticeIndexRange(self.v1, self.v2, self.window),
+            self.window,
+            maskArrayFn=self.kernel.maskArray,
+            symmetry=self.symmetry,
+        )
+
+    def run(self, point: SweepPoint) -> SweepResult:
+        start = time.perf_counter()
+        path = self.outputDir / f"point_{point.index:04d}.npz"
+        try:
+            sites = self.generate(point.constants)
+            if self.numShells > 0:
+                self.saveHamiltonian(path, sites, point.constants)
+            else:
+                numpy.savez(
+                    path,
+                    positions=sites.positions,
+                    site_types=sites.siteTypes,
+                    cells=sites.cells,
+                )
+        except Exception as error:
+            traceback.print_exc()
+            seconds = time.perf_counter() - start
+            return SweepResult(
+                point.index, point.constants, 0, seconds, "", str(error)
+            )
+        seconds = time.perf_counter() - start
+        return SweepResult(
+            point.index, point.constants, sites.numSites, seconds, str(path)
+        )
+
+    def saveHamiltonian(
+        self, path: Path, sites: LatticeSites, constants: Dict[str, Any]
+    ):
+        offsets = neighbourOffsets(
+            self.v1, self.v2, self.basis, numShells=self.numShells
+        )
+        neighbours = findNeighbours(sites, offsets, len(self.basis))
+        constants = {**self.constants, **constants}
+        matrix = assembleHamiltonian(
+            sites,
+            neighbours,
+            hoppingsFromConstants(constants),
+            onsiteFromConstants(constants, self.names),
+        )
+        saveHamiltonian(path, matrix, sites)
+
+
+# runner of the worker process, created by the pool initializer
+workerRunner: Optional[SweepRunner] = None
+
+
+def initWorker(*args):
+    global workerRunner
+    workerRunner = SweepRunner(*args)
+
+
+def runPoint(point: SweepPoint) -> SweepResult:
+    return workerRunner.run(point)
+
+
+def runSweep(
+    config: Dict[str, Any],
+    moduleName: str,
+    ranges: Sequence[SweepRange],
+    outputDir: Path,
+    workers: int = None,
+    cacheDir: Optional[Path] = None,
+    numShells: int = 0,
+) -> List[SweepResult]:
+    """Compiles the kernel once in this process, workers load it from the
+    kernels cache"""
+    points = sweepPoints(config, ranges)
+    source = buildSourceFromConfig(config, moduleName, [r.name for r in ranges])
+    outputDir.mkdir(parents=True, exist_ok=True)
+    args = (config, source, moduleName, outputDir, cacheDir, numShells)
+
+    print(f"Sweeping {len(points)} points of {', '.join(r.name for r in ranges)}")
+    if workers == 1:
+        runner = SweepRunner(*args)
+        return [runner.run(point) for point in points]
+
+    compileKernel(source, moduleName, cacheDir=cacheDir)
+    with ProcessPoolExecutor(workers, initializer=initWorker, initargs=args) as pool:
+        return list(pool.map(runPoint, points))
+
+
+def formatTable(results: Sequence[SweepResult], names: Sequence[str]) -> str:
+    header = ["#"] + list(names) + ["sites", "time [s]", "output"]
+    rows = [
+        [str(r.index)]
+        + [f"{r.constants[name]:g}" for name in names]
+        + [f"{r.numSites:,}", f"{r.seconds:.3f}", r.error or Path(r.output).name]
+        for r in results
+    ]
+    rows = [header] + rows
+    widths = [max(len(row[k]) for row in rows) for k in range(len(header))]
+    lines = [
+        " ".join(value.rjust(width) for value, width in zip(row, widths))
+        for row in rows
+    ]
+    return "\n".join(lines)
+
+
+def saveSummary(path: Path, results: Sequence[SweepResult], names: Sequence[str]):
+    print(f"Saving sweep summary: {path}")
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ["index"] + list(names) + ["num_sites", "seconds", "output", "error"]
+        )
+        for r in results:
+            writer.writerow(
+                [r.index]
+                + [r.constants[name] for name in names]
+                + [r.numSites, f"{r.seconds:.6f}", r.output, r.error]
+            )
+
+
+def main(argv: Sequence[str] = None) -> int:
+    from tb_lattice_viewer.presets import PresetsManager
+
+    parser = ArgumentParser(description="Sweep constants of a lattice preset")
+    parser.add_argument(
+        "--config",
+        default=Path("~/.tb-lattice-viewer/default.json"),
+        help="Path to presets json file or sqlite database",
+    )
+    parser.add_argument("--preset", required=True, help="Name of the lattice preset")
+    parser.add_argument(
+        "--vary",
+        action="append",
+        type=parseRange,
+        required=True,
+        help="Swept constant: name=start:stop:num or name=v1,v2,... "
+        "can be given multiple times for a grid",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes, 1 runs in this process",
+    )
+    parser.add_argument(
+        "--shells",
+        type=int,
+        default=0,
+        help="Export the Hamiltonian with this many neighbour shells instead "
+        "of the sites only",
+    )
+    parser.add_argument("--cache-dir", default=None, help="Kernels cache directory")
+    parser.add_argument("--output", default="sweep", help="Output directory")
+    args = parser.parse_args(argv)
+
+    PresetsManager.load(Path(args.config).expanduser())
+    config = PresetsManager.getPreset("lattice", args.preset)
+    if not config:
+        print(f"Lattice preset '{args.preset}' not found in {args.config}")
+        return 2
+
+    outputDir = Path(args.output)
+    names = [r.name for r in args.vary]
+    try:
+        results = runSweep(
+            config,
+            args.preset,
+            args.vary,
+            outputDir,
+            workers=max(args.workers, 1),
+            cacheDir=None if args.cache_dir is None else Path(args.cache_dir),
+            numShells=args.shells,
+        )
+    except ValueError as error:
+        print(f"Cannot run the sweep: {error}")
+        return 2
+
+    print(formatTable(results, names))
+    saveSummary(outputDir / "summary.csv", results, names)
+    return 1 if any(r.error for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+from typing import Callable, List, NamedTuple, Sequence, Tuple
+
+import numpy
+
+SYMMETRY_GROUPS = ["none", "C2", "C3", "C4", "C6", "Cs", "C2v", "C3v", "C4v", "C6v"]
+# largest cell index which fits the orbit keys
+MAX_CELL_INDEX = 2 ** 24
+TOLERANCE = 1e-6
+
+
+class SymmetryOps(NamedTuple):
+    """Point group operations acting on site indices: site `k` of cell `n` is
+    mapped to site `permutations[g, k]` of cell `n @ matrices[g] + offsets[g, k]`"""
+
+    name: str
+    matrices: numpy.ndarray  # (G, 2, 2) int64
+    offsets: numpy.ndarray  # (G, numBasis, 2) int64
+    permutations: numpy.ndarray  # (G, numBasis) int64
+
+    @property
+    def order(self) -> int:
+        return len(self.matrices)
+
+
+def pointGroupMatrices(group: str, mirrorAngle: float = 0.0) -> List[numpy.ndarray]:
+    """Rotations of Cn and the mirrors of Cnv, the first mirror axis is at
+    mirrorAngle degrees from the x axis"""
+    if group not in SYMMETRY_GROUPS:
+        raise ValueError(f"Unknown symmetry group: '{group}', expected {SYMMETRY_GROUPS}")
+    if group == "none":
+        return [numpy.eye(2)]
+    n = 1 if group == "Cs" else int(group[1])
+    rotations = []
+    for k in range(n):
+        angle = 2 * numpy.pi * k / n
+        c, s = numpy.cos(angle), numpy.sin(angle)
+        rotations.append(numpy.array([[c, -s], [s, c]]))
+    if not group.endswith("v") and group != "Cs":
+        return rotations
+    angle = 2 * numpy.radians(mirrorAngle)
+    c, s = numpy.cos(angle), numpy.sin(angle)
+    mirror = numpy.array([[c, s], [s, -c]])
+    return rotations + [rotation @ mirror for rotation in rotations]
+
+
+def asInteger(values: numpy.ndarray) -> numpy.ndarray:
+    rounded = numpy.round(values)
+    if numpy.abs(values - rounded).max(initial=0) > TOLERANCE:
+        raise ValueError("not an integer")
+    return rounded.astype(numpy.int64)
+
+
+def symmetryOps(
+    group: str,
+    vectors: numpy.ndarray,
+    basis: numpy.ndarray,
+    center: Sequence[float] = (0, 0),
+    mirrorAngle: float = 0.0,
+) -> SymmetryOps:
+    """Operations of the group around center expressed in the lattice indices,
+    raises ValueError when an operation does not map the lattice onto itself"""
+    vectors2d = vectors[:, :2]
+    if abs(numpy.linalg.det(vectors2d)) < TOLERANCE:
+        raise ValueError("Lattice vectors v1 and v2 are parallel")
+    inverse = numpy.linalg.inv(vectors2d)
+    center = numpy.asarray(center, dtype=numpy.float64)
+    numBasis = len(basis)
+
+    matrices, offsets, permutations = [], [], []
+    for k, rotation in enumerate(pointGroupMatrices(group, mirrorAngle)):
+        try:
+            # rows of the lattice vectors: n @ V @ R^T = (n @ M) @ V
+            matrix = asInteger(vectors2d @ rotation.T @ inverse)
+        except ValueError:
+            raise ValueError(
+                f"Operation {k + 1} of {group} does not map lattice vectors "
+                f"v1 and v2 onto the lattice"
+            )
+        images = (basis[:, :2] - center) @ rotation.T + center
+        offset = numpy.zeros((numBasis, 2), dtype=numpy.int64)
+        permutation = numpy.full(numBasis, -1, dtype=numpy.int64)
+        for site, image in enumerate(images):
+            for other in range(numBasis):
+                if abs(basis[site, 2] - basis[other, 2]) > TOLERANCE:
+                    continue
+                try:
+                    offset[site] = asInteger((image - basis[other, :2]) @ inverse)
+                except ValueError:
+                    continue
+                permutation[site] = other
+                break
+            if permutation[site] < 0:
+                raise ValueError(
+                    f"Operation {k + 1} of {group} maps unit cell site {site + 1} "
+                    f"outside the lattice, check the unit cell and the center"
+                )
+        matrices.append(matrix)
+        offsets.append(offset)
+        permutations.append(permutation)
+
+    return SymmetryOps(
+        name=group,
+        matrices=numpy.array(matrices),
+        offsets=numpy.array(offsets),
+        permutations=numpy.array(permutations),
+    )
+
+
+def orbitKeys(cells: numpy.ndarray, siteTypes: numpy.ndarray, numBasis: int):
+    i = cells[:, 0] + MAX_CELL_INDEX
+    j = cells[:, 1] + MAX_CELL_INDEX
+    return (i * (2 * MAX_CELL_INDEX) + j) * numBasis + siteTypes
+
+
+def irreducibleSites(
+    ops: SymmetryOps, cells: numpy.ndarray, siteTypes: numpy.ndarray
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Maps each site to the image with the smallest key in its orbit, returns
+    cells and types of the distinct images, the index of the image of every
+    site and which sites are not their own image"""
+    numBasis = ops.offsets.shape[1]
+    if len(cells) and numpy.abs(cells).max() * 4 >= MAX_CELL_INDEX:
+        raise ValueError("Lattice indices are too large for the symmetry reduction")
+
+    siteKeys = orbitKeys(cells, siteTypes, numBasis)
+    bestKeys = siteKeys.copy()
+    bestCells, bestTypes = cells.copy(), siteTypes.astype(numpy.int64)
+    for matrix, offset, permutation in zip(ops.matrices, ops.offsets, ops.permutations):
+        imageCells = cells @ matrix + offset[siteTypes]
+        imageTypes = permutation[siteTypes]
+        keys = orbitKeys(imageCells, imageTypes, numBasis)
+        smaller = keys < bestKeys
+        bestKeys[smaller] = keys[smaller]
+        bestCells[smaller] = imageCells[smaller]
+        bestTypes[smaller] = imageTypes[smaller]
+
+    _, first, inverse = numpy.unique(bestKeys, return_index=True, return_inverse=True)
+    return bestCells[first], bestTypes[first], inverse.ravel(), siteKeys != bestKeys
+
+
+def evaluateSymmetric(
+    ops: SymmetryOps,
+    vectors: numpy.ndarray,
+    basis: numpy.ndarray,
+    cells: numpy.ndarray,
+    siteTypes: numpy.ndarray,
+    evaluate: Callable[[numpy.ndarray], numpy.ndarray],
+    verifySamples: int = 0,
+    seed: int = 0,
+) -> numpy.ndarray:
+    """Evaluates the mask only on the irreducible sites and copies the result
+    to their images. With verifySamples, that many random images are evaluated
+    directly and compared, ValueError is raised when the mask is not symmetric."""
+    repCells, repTypes, inverse, isImage = irreducibleSites(ops, cells, siteTypes)
+    keep = evaluate(repCells @ vectors + basis[repTypes])[inverse]
+    print(
+        f"Symmetry {ops.name}: mask evaluated on {len(repCells)} "
+        f"of {len(cells)} sites"
+    )
+
+    images = numpy.flatnonzero(isImage)
+    if verifySamples > 0 and len(images) > 0:
+        random = numpy.random.default_rng(seed)
+        numSamples = min(verifySamples, len(images))
+        sample = random.choice(images, numSamples, replace=False)
+        direct = evaluate(cells[sample] @ vectors + basis[siteTypes[sample]])
+        wrong = int((direct != keep[sample]).sum())
+        if wrong > 0:
+            raise ValueError(
+                f"Mask is not {ops.name} symmetric: {wrong} of {len(sample)} "
+                f"sampled sites differ from their symmetric images"
+            )
+    return keep
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+import numpy
+
+from tb_lattice_viewer.lattice import LatticeSites, NeighbourOffsets, siteIndexTable
+
+
+def writeLatticeTables(
+    path: Path, sites: LatticeSites, numBasis: int, offsets: NeighbourOffsets
+):
+    """Writes lookup tables in the layout read by the generated Fortran routine
+    load_lattice_tables: int32 header followed by column major arrays"""
+    (iMin, jMin), table = siteIndexTable(sites, numBasis)
+    iMax, jMax = iMin + table.shape[0] - 1, jMin + table.shape[1] - 1
+    header = [iMin, iMax, jMin, jMax, numBasis, sites.numSites, offsets.numOffsets]
+    neighbours = numpy.stack(
+        [
+            offsets.siteFrom + 1,
+            offsets.siteTo + 1,
+            offsets.di,
+            offsets.dj,
+            offsets.shell + 1,
+        ],
+        axis=1,
+    )
+
+    print(f"Saving lattice tables: {path}")
+    with open(path, "wb") as file:
+        numpy.array(header, dtype=numpy.int32).tofile(file)
+        numpy.ascontiguousarray((table + 1).T, dtype=numpy.int32).tofile(file)
+        numpy.ascontiguousarray(sites.positions.T, dtype=numpy.float64).tofile(file)
+        numpy.ascontiguousarray(neighbours.T, dtype=numpy.int32).tofile(file)
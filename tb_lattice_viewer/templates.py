@@ -24,4 +24,66 @@ is_in_lattice = 1
 
 
 end subroutine
-"""
\ No newline at end of file
+"""
+
+FORTRAN_CODE_MASK_ARRAY_TEMPLATE = """
+subroutine mask_array(is_in_lattice, positions, n)
+integer, intent(in) :: n
+real*8, intent(in) :: positions(n, 3)
+integer, intent(out) :: is_in_lattice(n)
+integer :: k
+
+do k = 1, n
+    call mask(is_in_lattice(k), positions(k, 1), positions(k, 2), positions(k, 3))
+end do
+
+end subroutine
+"""
+
+FORTRAN_CODE_UNIT_CELL_SETTER_TEMPLATE = """
+subroutine set_unit_cell_positions(positions, n)
+integer, intent(in) :: n
+double precision, intent(in) :: positions(n, 2)
+
+if (allocated(unit_cell_positions)) deallocate(unit_cell_positions)
+allocate(unit_cell_positions(n, 2))
+unit_cell_positions = positions
+
+end subroutine
+"""
+
+FORTRAN_CODE_TABLES_DECLARATIONS_TEMPLATE = """
+! Lookup tables filled by load_lattice_tables, all indices start from 1
+! site_index(i, j, site) = global site index or 0 when the site is not generated
+! site_positions(index, :) = (x, y, z) of the site with the global index
+! neighbour_offsets(k, :) = (site_from, site_to, di, dj, shell)
+integer, dimension(:, :, :), allocatable :: site_index
+double precision, dimension(:, :), allocatable :: site_positions
+integer, dimension(:, :), allocatable :: neighbour_offsets
+"""
+
+FORTRAN_CODE_TABLES_LOADER_TEMPLATE = """
+subroutine load_lattice_tables(filename)
+character(len=*), intent(in) :: filename
+integer :: unit_id
+integer :: header(7) ! i_min, i_max, j_min, j_max, num_basis, num_sites, num_offsets
+
+open(newunit=unit_id, file=filename, access="stream", form="unformatted", &
+     status="old", action="read")
+read(unit_id) header
+
+if (allocated(site_index)) deallocate(site_index)
+if (allocated(site_positions)) deallocate(site_positions)
+if (allocated(neighbour_offsets)) deallocate(neighbour_offsets)
+
+allocate(site_index(header(1):header(2), header(3):header(4), header(5)))
+allocate(site_positions(header(6), 3))
+allocate(neighbour_offsets(header(7), 5))
+
+read(unit_id) site_index
+read(unit_id) site_positions
+read(unit_id) neighbour_offsets
+close(unit_id)
+
+end subroutine
+"""
@@ -0,0 +1,268 @@
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy
+from PyQt5.QtCore import QObject, QTimer
+
+from tb_lattice_viewer.estimator import ENTITY_BYTES
+from tb_lattice_viewer.lattice import IndexRange, LatticeSites, asBasis, latticeVectors
+from tb_lattice_viewer.scene import SceneFrame, SceneStats, viewProjectionMatrix
+
+TileKey = Tuple[int, int]
+# size of a tile in the scene coordinates, the camera starts 1 unit above
+TILE_SCENE_SIZE = 0.25
+TILE_CELLS = 64
+
+
+def tileIndexRange(key: TileKey, tileCells: int) -> IndexRange:
+    i0, j0 = key[0] * tileCells, key[1] * tileCells
+    return i0, j0, i0 + tileCells - 1, j0 + tileCells - 1
+
+
+def tileKeysRange(indexRange: IndexRange, tileCells: int) -> IndexRange:
+    """(tiMin, tjMin, tiMax, tjMax) of the tiles covering the index range"""
+    iMin, jMin, iMax, jMax = indexRange
+    return (
+        iMin // tileCells,
+        jMin // tileCells,
+        iMax // tileCells,
+        jMax // tileCells,
+    )
+
+
+def tilesFrame(
+    v1: Sequence[float], v2: Sequence[float], origin: Sequence[float], tileCells: int
+) -> SceneFrame:
+    """Fixed frame for all tiles, a tile is about TILE_SCENE_SIZE wide"""
+    vectors = latticeVectors(v1, v2)
+    cellSize = max(numpy.linalg.norm(vectors, axis=1).max(), 1e-12)
+    originXYZ = numpy.zeros(3)
+    originXYZ[: len(origin)] = origin
+    return SceneFrame(originXYZ, TILE_SCENE_SIZE / (tileCells * cellSize))
+
+
+def tileBoxes(
+    keys: numpy.ndarray,
+    tileCells: int,
+    vectors: numpy.ndarray,
+    basis: numpy.ndarray,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """(K, 3) minimum and maximum corners of the tiles in lattice coordinates"""
+    corners = numpy.array([[0, 0], [1, 0], [0, 1], [1, 1]]) * tileCells
+    cells = keys[:, None, :] * tileCells + corners[None, :, :]
+    origins = cells @ vectors
+    mins = origins.min(1) + basis.min(0)
+    maxs = origins.max(1) + basis.max(0)
+    return mins, maxs
+
+
+def frustumPlanes(viewProjection: numpy.ndarray) -> numpy.ndarray:
+    """(6, 4) planes (a, b, c, d) of the frustum, a * x + b * y + c * z + d >= 0
+    inside, extracted from the rows of the view projection matrix"""
+    m = viewProjection
+    return numpy.array(
+        [m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]]
+    )
+
+
+def boxesInFrustum(
+    planes: numpy.ndarray, mins: numpy.ndarray, maxs: numpy.ndarray
+) -> numpy.ndarray:
+    """Conservative test, True for boxes which may intersect the frustum"""
+    normals = planes[:, :3]
+    # corner of each box furthest along each plane normal
+    farthest = numpy.where(normals[None, :, :] >= 0, maxs[:, None, :], mins[:, None, :])
+    distances = (farthest * normals[None, :, :]).sum(-1) + planes[None, :, 3]
+    return (distances >= 0).all(1)
+
+
+def planeFootprint(
+    inverseViewProjection: numpy.ndarray,
+) -> Optional[Tuple[numpy.ndarray, numpy.ndarray]]:
+    """(min, max) xy where the frustum corner rays cross the z = 0 plane, all
+    frustum corners are used when no ray crosses it"""
+    ndc = numpy.array(
+        [[x, y, z, 1.0] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+    )
+    points = ndc @ inverseViewProjection.T
+    if numpy.any(numpy.abs(points[:, 3]) < 1e-12):
+        return None
+    points = points[:, :3] / points[:, 3:]
+    near, far = points[0::2], points[1::2]
+    footprint = [
+        a + a[2] / (a[2] - b[2]) * (b - a)
+        for a, b in zip(near, far)
+        if (a[2] > 0) != (b[2] > 0)
+    ]
+    footprint = numpy.array(footprint) if footprint else points
+    return footprint[:, :2].min(0), footprint[:, :2].max(0)
+
+
+class Tile(NamedTuple):
+    entity: Optional["QEntity"]
+    sites: LatticeSites
+    stats: SceneStats
+    numBytes: int
+
+
+class TiledScene(QObject):
+    """Tiles of tileCells x tileCells unit cells, generated and uploaded when
+    they enter the camera frustum. Tiles out of view are disabled and evicted
+    in the least recently seen order when the memory budget is exceeded."""
+
+    def __init__(
+        self,
+        rootEntity: "QEntity",
+        camera: "QCamera",
+        v1: Sequence[float],
+        v2: Sequence[float],
+        basis: Sequence[Sequence[float]],
+        indexRange: IndexRange,
+        generateTile: Callable[[IndexRange], LatticeSites],
+        buildTile: Callable[["QEntity", LatticeSites, SceneFrame], SceneStats],
+        frame: SceneFrame,
+        tileCells: int = TILE_CELLS,
+        budgetBytes: int = 512 * 2 ** 20,
+        maxVisibleTiles: int = 256,
+        tilesPerUpdate: int = 4,
+        intervalMs: int = 100,
+    ):
+        super().__init__(rootEntity)
+        self.rootEntity = rootEntity
+        self.camera = camera
+        self.vectors = latticeVectors(v1, v2)
+        self.basis = asBasis(basis)
+        self.keysRange = tileKeysRange(indexRange, tileCells)
+        self.generateTile = generateTile
+        self.buildTile = buildTile
+        self.frame = frame
+        self.tileCells = tileCells
+        self.budgetBytes = budgetBytes
+        self.maxVisibleTiles = maxVisibleTiles
+        self.tilesPerUpdate = tilesPerUpdate
+
+        self.tiles: "OrderedDict[TileKey, Tile]" = OrderedDict()
+        self.usedBytes = 0
+        self.visible: List[TileKey] = []
+        self.lastViewProjection: Optional[numpy.ndarray] = None
+        self.pending = True
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(intervalMs)
+        self.timer.timeout.connect(self.update)
+        self.timer.start()
+
+    def viewProjection(self) -> numpy.ndarray:
+        # tiles are in lattice coordinates, the frame maps them to the scene
+        return viewProjectionMatrix(self.camera, self.frame)
+
+    def visibleKeys(self, viewProjection: numpy.ndarray) -> List[TileKey]:
+        """Tiles inside the frustum, the closest to the view center first"""
+        footprint = planeFootprint(numpy.linalg.inv(viewProjection))
+        if footprint is None:
+            return []
+        (xMin, yMin), (xMax, yMax) = footprint
+        inverse = numpy.linalg.pinv(self.vectors[:, :2])
+        corners = numpy.array([[xMin, yMin], [xMax, yMin], [xMin, yMax], [xMax, yMax]])
+        cells = corners @ inverse
+        tiMin, tjMin = numpy.floor(cells.min(0) / self.tileCells).astype(int) - 1
+        tiMax, tjMax = numpy.ceil(cells.max(0) / self.tileCells).astype(int) + 1
+
+        center = self.viewCenterKey()
+        radius = int(numpy.ceil(numpy.sqrt(self.maxVisibleTiles)))
+        kiMin, kjMin, kiMax, kjMax = self.keysRange
+        tiMin = max(tiMin, kiMin, center[0] - radius)
+        tjMin = max(tjMin, kjMin, center[1] - radius)
+        tiMax = min(tiMax, kiMax, center[0] + radius)
+        tjMax = min(tjMax, kjMax, center[1] + radius)
+        if tiMin > tiMax or tjMin > tjMax:
+            return []
+
+        ti, tj = numpy.meshgrid(
+            numpy.arange(tiMin, tiMax + 1), numpy.arange(tjMin, tjMax + 1), indexing="ij"
+        )
+        keys = numpy.stack([ti.ravel(), tj.ravel()], axis=1)
+        mins, maxs = tileBoxes(keys, self.tileCells, self.vectors, self.basis)
+        keys = keys[boxesInFrustum(frustumPlanes(viewProjection), mins, maxs)]
+        distances = numpy.abs(keys - numpy.array(center)).sum(1)
+        keys = keys[numpy.argsort(distances, kind="stable")][: self.maxVisibleTiles]
+        return [tuple(key) for key in keys.tolist()]
+
+    def viewCenterKey(self) -> TileKey:
+        viewCenter = self.camera.viewCenter()
+        center = self.frame.invert(
+            numpy.array([viewCenter.x(), viewCenter.y(), viewCenter.z()])
+        )
+        cell = center[:2] @ numpy.linalg.pinv(self.vectors[:, :2])
+        i, j = numpy.floor(cell / self.tileCells).astype(int)
+        return int(i), int(j)
+
+    def update(self):
+        viewProjection = self.viewProjection()
+        moved = self.lastViewProjection is None or not numpy.allclose(
+            viewProjection, self.lastViewProjection
+        )
+        if not moved and not self.pending:
+            return
+        self.lastViewProjection = viewProjection
+
+        if moved:
+            self.visible = self.visibleKeys(viewProjection)
+            visible = set(self.visible)
+            for key, tile in self.tiles.items():
+                if tile.entity is not None:
+                    tile.entity.setEnabled(key in visible)
+
+        missing = [key for key in self.visible if key not in self.tiles]
+        for key in missing[: self.tilesPerUpdate]:
+            self.loadTile(key)
+        self.pending = len(missing) > self.tilesPerUpdate
+
+        for key in reversed(self.visible):
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+        self.evict()
+
+    def loadTile(self, key: TileKey):
+        sites = self.generateTile(tileIndexRange(key, self.tileCells))
+        entity, stats = None, SceneStats(0, 0, 0, 0)
+        if sites.numSites > 0:
+            from PyQt5.Qt3DCore import QEntity
+
+            entity = QEntity(self.rootEntity)
+            stats = self.buildTile(entity, sites, self.frame)
+        numBytes = (
+            sites.positions.nbytes
+            + sites.siteTypes.nbytes
+            + sites.cells.nbytes
+            + stats.bufferBytes
+            + stats.entities * ENTITY_BYTES
+        )
+        self.tiles[key] = Tile(entity, sites, stats, numBytes)
+        self.usedBytes += numBytes
+
+    def evict(self):
+        visible = set(self.visible)
+        while self.usedBytes > self.budgetBytes and self.tiles:
+            key = next(iter(self.tiles))
+            if key in visible:
+                # only tiles in view are left
+                break
+            tile = self.tiles.pop(key)
+            self.usedBytes -= tile.numBytes
+            if tile.entity is not None:
+                tile.entity.setParent(None)
+                tile.entity.deleteLater()
+
+    def sceneStats(self) -> SceneStats:
+        """Stats of the loaded tiles"""
+        stats = [tile.stats for tile in self.tiles.values()]
+        return SceneStats(
+            entities=sum(s.entities for s in stats),
+            instances=sum(s.instances for s in stats),
+            triangles=sum(s.triangles for s in stats),
+            bufferBytes=sum(s.bufferBytes for s in stats),
+        )
+
+    def stop(self):
+        self.timer.stop()
@@ -0,0 +1,118 @@
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import numpy
+
+DEFAULT_SITE_NAME = "v"
+
+
+def isNumber(text: str) -> bool:
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def loadXYZSites(path: Path) -> Tuple[List[str], numpy.ndarray]:
+    """Reads standard .xyz file: number of atoms, comment line, `name x y z` rows.
+    Only the first frame of a multi-frame file is read."""
+    with open(path, "r") as file:
+        firstLine = file.readline().strip()
+    try:
+        count = int(firstLine)
+    except ValueError:
+        raise ValueError(
+            f"Expected the number of atoms in the first line, got: '{firstLine}'"
+        )
+
+    rows = numpy.loadtxt(
+        path, skiprows=2, max_rows=count, usecols=(0, 1, 2), dtype=str, ndmin=2
+    )
+    if len(rows) != count:
+        raise ValueError(f"Expected {count} atoms, but the file has {len(rows)} rows")
+    try:
+        positions = rows[:, 1:].astype(numpy.float64)
+    except ValueError:
+        raise ValueError("Expected `name x y z` rows after the comment line")
+    return rows[:, 0].tolist(), positions
+
+
+def loadCSVSites(path: Path) -> Tuple[List[str], numpy.ndarray]:
+    """Reads `x, y[, z]` or `name, x, y[, z]` rows with an optional header"""
+    with open(path, "r") as file:
+        firstLine = file.readline()
+        secondLine = file.readline()
+
+    skipRows = 0
+    if not all(isNumber(t) for t in firstLine.split(",")[-2:]):
+        skipRows = 1
+        firstLine = secondLine
+
+    fields = firstLine.split(",")
+    if isNumber(fields[0]):
+        positions = numpy.loadtxt(
+            path, delimiter=",", skiprows=skipRows, usecols=(0, 1), ndmin=2
+        )
+        return [DEFAULT_SITE_NAME] * len(positions), positions
+
+    names = numpy.loadtxt(
+        path, delimiter=",", skiprows=skipRows, usecols=0, dtype=str, ndmin=1
+    )
+    positions = numpy.loadtxt(
+        path, delimiter=",", skiprows=skipRows, usecols=(1, 2), ndmin=2
+    )
+    return [n.strip() for n in names.tolist()], positions
+
+
+def loadNPYSites(path: Path) -> Tuple[List[str], numpy.ndarray]:
+    """Reads (N, 2) or (N, 3) array of positions"""
+    positions = numpy.load(path)
+    if positions.ndim != 2 or positions.shape[1] < 2:
+        raise ValueError(
+            f"Expected array of shape (N, 2) or (N, 3), got: {positions.shape}"
+        )
+    return [DEFAULT_SITE_NAME] * len(positions), positions[:, :2]
+
+
+SITE_LOADERS = {
+    ".xyz": loadXYZSites,
+    ".csv": loadCSVSites,
+    ".npy": loadNPYSites,
+}
+
+
+def loadUnitCellSites(path: Path) -> Tuple[List[str], numpy.ndarray]:
+    path = Path(path)
+    loader = SITE_LOADERS.get(path.suffix.lower())
+    if loader is None:
+        raise ValueError(
+            f"Unsupported file: '{path.name}', expected one of {list(SITE_LOADERS)}"
+        )
+    names, positions = loader(path)
+    print(f"Loaded {len(names)} sites from: {path}")
+    return names, numpy.asarray(positions, dtype=numpy.float64)
+
+
+def sitesFromConfig(
+    config: Any,
+) -> Tuple[List[str], numpy.ndarray, Optional[list], Optional[list]]:
+    """Returns (names, positions, sizes, colors) of the unit cell config, accepts
+    columnar config or the list of per site dicts of older presets"""
+    if isinstance(config, dict):
+        positions = numpy.array(config.get("positions", []), dtype=numpy.float64)
+        return (
+            list(config.get("names", [])),
+            positions.reshape(-1, 2),
+            config.get("sizes"),
+            config.get("colors"),
+        )
+    if isinstance(config, (list, tuple)):
+        positions = [site.get("value", (0, 0))[:2] for site in config]
+        return (
+            [site.get("name", DEFAULT_SITE_NAME) for site in config],
+            numpy.array(positions, dtype=numpy.float64).reshape(-1, 2),
+            [site.get("size", 1.0) for site in config],
+            [site.get("color", (255, 255, 255)) for site in config],
+        )
+    return [], numpy.zeros((0, 2)), None, None
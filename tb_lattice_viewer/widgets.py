@@ -1,9 +1,14 @@
-from typing import List, Optional
+import bisect
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
 from PyQt5 import QtCore
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-from natsort import natsorted
+
+from tb_lattice_viewer.profiling import profiler
 
 
 class ListWidget(QListWidget):
@@ -14,6 +19,119 @@ class ListWidget(QListWidget):
         return s
 
 
+class SearchIndex:
+    """Lowercase names, token -> items map and sorted tokens for prefix lookups,
+    updated incrementally when items are added or removed. QListWidgetItem is
+    not hashable, items are referred to by their id(). Dicts keyed by the id
+    keep the insertion order, so an item is removed without a scan."""
+
+    TOKEN_PATTERN = re.compile(r"[^0-9a-z]+")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.itemsById: Dict[int, QListWidgetItem] = {}
+        self.itemsByName: Dict[str, QListWidgetItem] = {}
+        self.lowerNameOf: Dict[int, str] = {}
+        self.lowerNamesCount: Dict[str, int] = defaultdict(int)
+        self.tokens: Dict[str, Set[int]] = defaultdict(set)
+        self.sortedTokens: List[str] = []
+        # insertion number of each item, orders the matches of findFirst
+        self.sequence: Dict[int, int] = {}
+        self.added = 0
+
+    @property
+    def items(self) -> List[QListWidgetItem]:
+        return list(self.itemsById.values())
+
+    @property
+    def lowerNames(self) -> List[str]:
+        return list(self.lowerNameOf.values())
+
+    def tokenize(self, lowerName: str) -> Set[str]:
+        return {t for t in self.TOKEN_PATTERN.split(lowerName) if t != ""}
+
+    def ids(self) -> Set[int]:
+        return set(self.itemsById)
+
+    def add(self, item: QListWidgetItem):
+        text = item.text()
+        lowerName = text.lower()
+        self.itemsById[id(item)] = item
+        self.sequence[id(item)] = self.added
+        self.added += 1
+        self.itemsByName[text] = item
+        self.lowerNameOf[id(item)] = lowerName
+        self.lowerNamesCount[lowerName] += 1
+        for token in self.tokenize(lowerName):
+            if token not in self.tokens:
+                bisect.insort(self.sortedTokens, token)
+            self.tokens[token].add(id(item))
+
+    def remove(self, item: QListWidgetItem):
+        lowerName = self.lowerNameOf.pop(id(item))
+        del self.itemsById[id(item)]
+        del self.sequence[id(item)]
+        self.itemsByName.pop(item.text(), None)
+        self.lowerNamesCount[lowerName] -= 1
+        if self.lowerNamesCount[lowerName] == 0:
+            del self.lowerNamesCount[lowerName]
+        for token in self.tokenize(lowerName):
+            self.tokens[token].discard(id(item))
+            if not self.tokens[token]:
+                del self.tokens[token]
+                del self.sortedTokens[bisect.bisect_left(self.sortedTokens, token)]
+
+    def item(self, itemId: int) -> QListWidgetItem:
+        return self.itemsById[itemId]
+
+    def find(self, text: str) -> Optional[QListWidgetItem]:
+        return self.itemsByName.get(text)
+
+    def hasName(self, word: str) -> bool:
+        return word.lower() in self.lowerNamesCount
+
+    def withTokenPrefix(self, prefix: str) -> Set[int]:
+        ids = set()
+        start = bisect.bisect_left(self.sortedTokens, prefix)
+        for token in self.sortedTokens[start:]:
+            if not token.startswith(prefix):
+                break
+            ids |= self.tokens[token]
+        return ids
+
+    def findFirst(self, word: str) -> Optional[QListWidgetItem]:
+        """First added item which contains the lowercase word. The earliest
+        item with a token starting with the word is a match too, so only the
+        items added before it are scanned."""
+        prefixed = self.withTokenPrefix(word)
+        bound = min(prefixed, key=self.sequence.__getitem__) if prefixed else None
+        # lowerNameOf is in the insertion order
+        for itemId, lowerName in self.lowerNameOf.items():
+            if itemId == bound or word in lowerName:
+                return self.itemsById[itemId]
+        return None
+
+    def match(self, words: List[str], candidates: Optional[Set[int]] = None) -> Set[int]:
+        """Returns ids of items which contain all words, searching only among
+        candidates when given. Items with a token starting with the word are
+        taken from the prefix index, only the rest is checked for substrings."""
+        if candidates is None:
+            candidates = self.ids()
+        if not words:
+            return set(candidates)
+
+        for word in words:
+            prefixed = self.withTokenPrefix(word) & candidates
+            candidates = prefixed | {
+                itemId
+                for itemId in candidates - prefixed
+                if word in self.lowerNameOf[itemId]
+            }
+        return candidates
+
+
 class ParamsListWidget(QWidget):
     """A list with searchable items, item can be deleted"""
 
@@ -26,6 +144,8 @@ class ParamsListWidget(QWidget):
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
+        from natsort import natsorted
+
         mainLayout = QVBoxLayout()
         self.itemsList = ListWidget()
 
@@ -49,42 +169,49 @@ class ParamsListWidget(QWidget):
         self.addItemButton.pressed.connect(self.addEditItem)
         self.deleteItemButton.pressed.connect(self.removeSelectedItems)
         self.nameEdit.textChanged.connect(self.searchForItem)
+        self.searchIndex = SearchIndex()
         self.updateList()
 
     def updateList(self):
         self.itemsList.clear()
+        self.searchIndex.clear()
         for elem in self.default_items:
             item = QListWidgetItem(elem)
             item.setForeground(QColor("green"))
             self.itemsList.addItem(item)
+            self.searchIndex.add(item)
+        self.resetSearchState()
+
+    def resetSearchState(self):
+        self.lastSearchText: Optional[str] = None
+        self.visibleItems: Set[int] = self.searchIndex.ids()
 
     def removeSelectedItems(self):
         listItems = self.itemsList.selectedItems()
         if not listItems:
             return
         for item in listItems:
+            self.searchIndex.remove(item)
+            self.visibleItems.discard(id(item))
             self.itemsList.takeItem(self.itemsList.row(item))
 
     @property
     def names(self) -> List[str]:
-        return [self.itemsList.item(i).text() for i in range(self.itemsList.count())]
+        return [item.text() for item in self.searchIndex.items]
 
     @property
     def normalizedNames(self) -> List[str]:
-        return [n.lower() for n in self.names]
+        return self.searchIndex.lowerNames
 
     def hasWordInNames(self, word: str) -> bool:
-        return word.lower() in self.normalizedNames
+        return self.searchIndex.hasName(word)
 
     def hasAnyOfWordsInNames(self, words: List[str]) -> bool:
         return any(self.hasWordInNames(word) for word in words)
 
     def findInNames(self, word: str) -> str:
-        word = word.lower()
-        for n, normed_n in zip(self.names, self.normalizedNames):
-            if word in normed_n:
-                return n
-        return ""
+        item = self.searchIndex.findFirst(word.lower())
+        return "" if item is None else item.text()
 
     def findInNamesWords(self, words: List[str]) -> Optional[str]:
         matches = [self.findInNames(w) for w in words]
@@ -98,20 +225,29 @@ class ParamsListWidget(QWidget):
         return self.nameEdit.text()
 
     def searchForItem(self):
-        searchWords = self.searchText.lower().split(" ")
-        matchedItems = []
-        for i in range(self.itemsList.count()):
-            item: QListWidgetItem = self.itemsList.item(i)
-            itemText = item.text().lower()
-            item.setSelected(False)
-            if all([sw in itemText for sw in searchWords]):
-                item.setHidden(False)
-                matchedItems.append(item)
-            else:
-                item.setHidden(True)
+        searchText = self.searchText.lower()
+        searchWords = [sw for sw in searchText.split(" ") if sw != ""]
+
+        # typing more characters can only narrow down the previous result
+        if self.lastSearchText is not None and searchText.startswith(
+            self.lastSearchText
+        ):
+            candidates = self.visibleItems
+        else:
+            candidates = None
 
+        matchedItems = self.searchIndex.match(searchWords, candidates)
+        for itemId in self.visibleItems - matchedItems:
+            self.searchIndex.item(itemId).setHidden(True)
+        for itemId in matchedItems - self.visibleItems:
+            self.searchIndex.item(itemId).setHidden(False)
+
+        self.visibleItems = matchedItems
+        self.lastSearchText = searchText
+
+        self.itemsList.clearSelection()
         if len(matchedItems) == 1:
-            matchedItems[0].setSelected(True)
+            self.searchIndex.item(next(iter(matchedItems))).setSelected(True)
 
     def addEditItem(self):
         self.addItem(self.nameEdit.text())
@@ -120,22 +256,22 @@ class ParamsListWidget(QWidget):
         if text == "":
             return
 
-        current_items = []
-        for i in range(self.itemsList.count()):
-            item: QListWidgetItem = self.itemsList.item(i)
-            current_items.append(item.text())
-
-        if text not in current_items:
-            self.itemsList.addItem(text)
+        if self.searchIndex.find(text) is None:
+            item = QListWidgetItem(text)
+            self.itemsList.addItem(item)
+            self.searchIndex.add(item)
+            self.visibleItems.add(id(item))
+            self.lastSearchText = None
 
     def removeItem(self, text: str):
         if text in self.default_items:
             return
 
-        for i in range(self.itemsList.count()):
-            item: QListWidgetItem = self.itemsList.item(i)
-            if item.text() == text:
-                self.itemsList.takeItem(item)
+        item = self.searchIndex.find(text)
+        if item is not None:
+            self.searchIndex.remove(item)
+            self.visibleItems.discard(id(item))
+            self.itemsList.takeItem(self.itemsList.row(item))
 
     def selectedItem(self) -> Optional[str]:
         selItems = self.itemsList.selectedItems()
@@ -149,13 +285,15 @@ class ParamsListWidget(QWidget):
             self.searchForItem()
             return
 
-        for i in range(self.itemsList.count()):
-            item: QListWidgetItem = self.itemsList.item(i)
-            item.setSelected(False)
+        self.itemsList.clearSelection()
+        for item in self.searchIndex.items:
             item.setHidden(False)
-            if item.text() == text:
-                item.setSelected(True)
-                self.nameEdit.setFocus()
+        self.resetSearchState()
+
+        item = self.searchIndex.find(text)
+        if item is not None:
+            item.setSelected(True)
+            self.nameEdit.setFocus()
 
 
 class ParamsListDialog(QDialog, ParamsListWidget):
@@ -255,6 +393,8 @@ class CollapsibleBox(QWidget):
 
 
 class VectorWidget(QWidget):
+    valueChanged = pyqtSignal()
+
     def __init__(self, name: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.name = name
@@ -286,6 +426,9 @@ class VectorWidget(QWidget):
         h.setContentsMargins(0, 0, 0, 0)
         self.setLayout(h)
 
+        self.v1x.valueChanged.connect(self.valueChanged)
+        self.v1y.valueChanged.connect(self.valueChanged)
+
     def setName(self, name):
         self.name = name
         self.nameLabel.setText(f"<b>{name}</b> = ")
@@ -319,3 +462,42 @@ class VectorWidget(QWidget):
             sy = round(y / self.v1y.value())
 
         return sx, sy
+
+
+class TimingsPanel(QWidget):
+    """One line summary of the last profiled pipeline run for the status bar,
+    the full table is in the tooltip"""
+
+    def __init__(self, category: str = "pipeline", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.category = category
+        self.summaryLabel = QLabel("No timings yet")
+        self.exportButton = QPushButton("Export trace")
+        self.exportButton.setEnabled(False)
+        self.exportButton.pressed.connect(self.exportTrace)
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.summaryLabel, 1)
+        layout.addWidget(self.exportButton)
+        self.setLayout(layout)
+
+    def refresh(self):
+        spans = profiler.spansOf(self.category)
+        if not spans:
+            return
+        parts = [f"{span.name} {span.duration * 1000:.0f} ms" for span in spans]
+        self.summaryLabel.setText(" | ".join(parts))
+        self.summaryLabel.setToolTip(f"<pre>{profiler.summary(self.category)}</pre>")
+        self.exportButton.setEnabled(True)
+
+    def exportTrace(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Chrome trace", "trace.json", "*.json"
+        )
+        if path == "":
+            return
+        try:
+            profiler.exportChromeTrace(path, self.category)
+        except OSError as error:
+            QMessageBox.critical(self, "Error", f"Cannot save trace: {error}")
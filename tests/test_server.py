@@ -0,0 +1,42 @@
+import threading
+
+from tb_lattice_viewer.preset_store import SqlitePresetsStore
+from tb_lattice_viewer.presets import PresetsManager
+from tb_lattice_viewer.server import LatticeServer
+
+
+def test_preset_request_from_sqlite_config(tmp_path):
+    path = tmp_path / "presets.sqlite"
+    config = {
+        "lattice": {"v1": [1.0, 0.0], "v2": [0.0, 1.0]},
+        "dimensions": {"vMin": [-2, -2], "vMax": [2, 2]},
+    }
+    SqlitePresetsStore(path).importPresets({"lattice": {"square": config}})
+    PresetsManager.load(path)
+
+    server = LatticeServer(workers=1)
+    results, errors = [], []
+
+    def handle():
+        # requests are handled on the threads of the socket server
+        try:
+            results.append(server.buildRequest({"preset": "square"}))
+        except Exception as error:
+            errors.append(error)
+
+    try:
+        threads = [threading.Thread(target=handle) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.shutdown()
+        PresetsManager.load(tmp_path / "presets.json")
+
+    assert errors == []
+    assert len(results) == 4
+    request = results[0]
+    assert request.moduleName == "square"
+    assert request.window == ((-2, -2), (2, 2))
+    assert dict(request.config["lattice"]) == {"v1": (1.0, 0.0), "v2": (0.0, 1.0)}